@@ -0,0 +1,128 @@
+"""/activity latency over a month of command_history
+
+Fills command_history of a temporary database with --rows commands spread
+over the last --days days and builds command_hourly from them with
+"/stats rebuild", the same statements migration 9 backfills with. Then
+times the hourly and daily charts two ways. "scan" reads timestamp and
+command of every row in the range with one query and bins the chunks with
+NumPy. "rollup" is what /activity does, Database.get_command_hours() into
+plugins.admin.activity.build_chart(), rendering included. Each step runs
+--repeat times and the median is reported.
+
+Usage: python benchmarks/bench_activity.py [--rows N] [--days N] [--repeat N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ADMIN_IDS", "1")
+
+# Weighted like real traffic, most commands are /qr
+COMMANDS = ("qr",) * 12 + ("start",) * 4 + ("qrbatch", "help", "stats", "history", "settings", "about")
+
+def fill(path, rows, days, batch=100000):
+    rng = random.Random(3)
+    end = datetime.now()
+    span = days * 86400
+    conn = sqlite3.connect(path)
+    with conn:
+        for offset in range(0, rows, batch):
+            conn.executemany(
+                'INSERT INTO command_history (user_id, command, args, timestamp) VALUES (?, ?, ?, ?)',
+                [
+                    (rng.randrange(50000), rng.choice(COMMANDS), "",
+                     end - timedelta(seconds=span * (1 - n / rows)))
+                    for n in range(offset, min(offset + batch, rows))
+                ]
+            )
+    conn.close()
+
+async def scan(db, start, end, step, chunk_size=50000):
+    """Bin every command_history row of [start, end) per command, return the total"""
+    origin = np.datetime64(start, 's')
+    buckets = int((end - start).total_seconds()) // step
+    counts = {}
+
+    def timeline(cursor):
+        cursor.execute(
+            'SELECT timestamp, command FROM command_history WHERE timestamp >= ? AND timestamp < ?',
+            (start, end)
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            timestamps, commands = zip(*rows)
+            index = (np.array(timestamps, dtype='datetime64[s]') - origin).astype(np.int64) // step
+            names, codes = np.unique(np.array(commands, dtype=str), return_inverse=True)
+            binned = np.bincount(codes * buckets + index, minlength=len(names) * buckets)
+            for name, row in zip(names.tolist(), binned.reshape(len(names), buckets)):
+                counts[name] = counts.get(name, 0) + row
+
+    await db.run_read(timeline)
+    return int(sum(row.sum() for row in counts.values()))
+
+async def timed(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, result
+
+async def run(path, days, repeat):
+    from database import Database
+    from plugins.admin.activity import ActivityHistogram, GRANULARITIES, bucket_range, build_chart
+
+    db = Database(path)
+    await db.start()
+    rebuild_ms, _ = await timed(1, db.rebuild_stats)
+    hours = (await db._fetchone('SELECT COUNT(*) FROM command_hourly'))[0]
+    print(f"command_hourly rebuilt in {rebuild_ms:.0f}ms, {hours} rows\n")
+
+    print(f"{'granularity':<12} {'commands':>9} {'scan ms':>8} {'rollup ms':>10} {'PNG KB':>7}")
+    for granularity in ("hour", "day"):
+        start, end = bucket_range(days, granularity)
+
+        async def rollup():
+            rows = await db.get_command_hours(start, end)
+            histogram = ActivityHistogram(start, end, granularity)
+            histogram.add_rows(rows)
+            chart, _ = await asyncio.to_thread(build_chart, rows, start, end, granularity)
+            return int(histogram.totals().sum()), chart
+
+        scan_ms, scanned = await timed(repeat, lambda: scan(db, start, end, GRANULARITIES[granularity]))
+        rollup_ms, (total, chart) = await timed(repeat, rollup)
+        assert scanned == total, (scanned, total)
+        print(f"{granularity:<12} {total:>9} {scan_ms:>8.0f} {rollup_ms:>10.0f} "
+              f"{len(chart.getvalue()) / 1024:>7.0f}")
+    await db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=3_000_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "activity.db")
+        from database import Database
+        # Creates the schema
+        asyncio.run(Database(path).close())
+        print(f"Filling command_history with {args.rows} rows over {args.days} days...")
+        fill(path, args.rows, args.days)
+        asyncio.run(run(path, args.days, args.repeat))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Deliver a broadcast to many users through a local fake Bot API server
+
+The fake server speaks HTTP like api.telegram.org and enforces its limits:
+it answers 429 with retry_after when the bot goes over the global rate or
+messages a chat twice within a second, 403 for users who blocked the bot,
+and injects a flood-control error every --flood-every requests. Halfway
+through, the broadcaster is stopped and a fresh one resumes the job from the
+database, like a dyno restart. The run then checks that every user got the
+message exactly once.
+
+Usage: python benchmarks/bench_broadcast.py [--users N] [--rate MSG_PER_S]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from urllib.parse import parse_qs
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ADMIN_IDS", "1")
+
+from telegram import Bot  # noqa: E402
+from telegram.request import HTTPXRequest  # noqa: E402
+
+from database import Database  # noqa: E402
+from plugins.admin.broadcast import Broadcaster  # noqa: E402
+from benchmarks.stub_api import BOT_USER  # noqa: E402
+
+ADMIN_CHAT = 1
+
+class FakeBotAPI:
+    def __init__(self, rate_limit, blocked, flood_every):
+        self.rate_limit = rate_limit
+        self.blocked = blocked
+        self.flood_every = flood_every
+        self.delivered = Counter()
+        self.last_message = {}
+        self.recent = deque()
+        self.requests = 0
+        self.rate_limited = 0
+        self.floods = 0
+        self.max_per_second = 0
+        self.message_ids = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                method = request_line.split()[1].decode().rsplit("/", 1)[-1]
+                if "json" in headers.get("content-type", ""):
+                    params = json.loads(body or b"{}")
+                else:
+                    params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+                status, payload = self.answer(method, params)
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def flood(self, retry_after):
+        self.rate_limited += 1
+        return 429, {
+            "ok": False, "error_code": 429,
+            "description": f"Too Many Requests: retry after {retry_after}",
+            "parameters": {"retry_after": retry_after}
+        }
+
+    def message(self, chat_id, text):
+        self.message_ids += 1
+        return {
+            "message_id": self.message_ids, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "from": BOT_USER, "text": text
+        }
+
+    def answer(self, method, params):
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        chat_id = int(params.get("chat_id", 0))
+        if method == "editMessageText" or chat_id == ADMIN_CHAT:
+            return 200, {"ok": True, "result": self.message(chat_id, params.get("text", ""))}
+
+        self.requests += 1
+        now = time.monotonic()
+        if self.flood_every and self.requests % self.flood_every == 0:
+            self.floods += 1
+            return self.flood(1)
+
+        # Sliding one-second window for the global limit
+        while self.recent and self.recent[0] <= now - 1:
+            self.recent.popleft()
+        if len(self.recent) >= self.rate_limit:
+            return self.flood(1)
+        if now - self.last_message.get(chat_id, -1) < 1:
+            return self.flood(1)
+        self.recent.append(now)
+        self.max_per_second = max(self.max_per_second, len(self.recent))
+        self.last_message[chat_id] = now
+
+        if chat_id in self.blocked:
+            return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+        self.delivered[chat_id] += 1
+        return 200, {"ok": True, "result": self.message(chat_id, params.get("text", ""))}
+
+async def run_broadcaster(db_path, port, rate, concurrency, stop_after=None, broadcast=False):
+    """Run one broadcaster 'process' until the job is done or stop_after messages went out"""
+    db = Database(db_path)
+    await db.start()
+    bot = Bot(
+        "1000:bench",
+        base_url=f"http://127.0.0.1:{port}/bot",
+        request=HTTPXRequest(connection_pool_size=concurrency * 2)
+    )
+    await bot.initialize()
+
+    broadcaster = Broadcaster(db, rate=rate, concurrency=concurrency)
+    await broadcaster.start(bot)
+    if broadcast:
+        await broadcaster.create(ADMIN_CHAT, ADMIN_CHAT, "Hello from the benchmark")
+
+    while broadcaster.jobs:
+        job = next(iter(broadcaster.jobs.values()))
+        if stop_after is not None and job.sent + job.failed >= stop_after:
+            break
+        await asyncio.sleep(0.05)
+    await broadcaster.stop()
+
+    await bot.shutdown()
+    await db.close()
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--rate", type=float, default=1000, help="broadcaster rate, messages/s")
+    parser.add_argument("--server-limit", type=int, help="fake server limit per second (default rate * 1.1)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--blocked", type=float, default=0.02, help="share of users who blocked the bot")
+    parser.add_argument("--flood-every", type=int, default=25_000)
+    args = parser.parse_args()
+
+    user_ids = range(1000, 1000 + args.users)
+    step = int(1 / args.blocked) if args.blocked else 0
+    blocked = set(user_ids[::step]) if step else set()
+    api = FakeBotAPI(args.server_limit or int(args.rate * 1.1), blocked, args.flood_every)
+    server = await asyncio.start_server(api.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "bench.db")
+        db = Database(db_path)
+        with db.conn:
+            db.conn.executemany(
+                "INSERT INTO users (user_id, username, first_name, last_seen) VALUES (?, ?, ?, ?)",
+                ((user_id, f"user{user_id}", "Bench", "2024-01-01") for user_id in user_ids)
+            )
+        await db.close()
+
+        start = time.perf_counter()
+        await run_broadcaster(db_path, port, args.rate, args.concurrency,
+                              stop_after=args.users // 2, broadcast=True)
+        restart_at = time.perf_counter() - start
+        await run_broadcaster(db_path, port, args.rate, args.concurrency)
+        elapsed = time.perf_counter() - start
+
+        db = Database(db_path)
+        counts = await db.get_broadcast_counts(1)
+        await db.close()
+
+    server.close()
+    duplicates = sum(1 for count in api.delivered.values() if count > 1)
+    missing = args.users - len(blocked) - len(api.delivered)
+    print(f"recipients:        {args.users} ({len(blocked)} blocked the bot)")
+    print(f"restart after:     {restart_at:.1f}s")
+    print(f"total time:        {elapsed:.1f}s ({args.users / elapsed:.0f} msg/s, target {args.rate:.0f})")
+    print(f"peak rate:         {api.max_per_second} msg/s in a 1s window (server limit {api.rate_limit})")
+    print(f"429 responses:     {api.rate_limited} ({api.floods} injected)")
+    print(f"recipient status:  {dict(counts)}")
+    print(f"delivered:         {len(api.delivered)}, duplicates {duplicates}, missing {missing}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+"""Cost of the error path under a synthetic burst of failing updates
+
+Builds the real Bot against benchmarks.stub_api.StubRequest, adds handlers
+that raise from two places (a "database is locked" error and a ValueError)
+and pushes --errors updates from --users users through
+Application.process_update(). Reports the time spent per failing update and
+the Bot API calls it caused, for the error handler with the admin digest and
+for the previous per-error fan-out (two replies to the user and a traceback
+to every admin per error), reproduced here as a baseline.
+
+Usage: python benchmarks/bench_errors.py [--errors N] [--admins N]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+def fail_locked():
+    raise sqlite3.OperationalError("database is locked")
+
+def fail_value():
+    raise ValueError("synthetic failure")
+
+async def failing_handler(update, context):
+    if update.effective_user.id % 2:
+        fail_locked()
+    fail_value()
+
+async def fanout_error_handler(update, context):
+    """The error handler before digests: every error messages the user twice and every admin"""
+    import config
+    await update.effective_message.reply_text("An error occurred while processing your request.")
+    await update.effective_message.reply_text(
+        "😔 An error occurred while processing your request. Please try again later."
+    )
+    error_text = f"❌ Error for user {update.effective_user.id}:\n"
+    error_text += f"Command: {update.message.text}\n"
+    error_text += "Error: " + "".join(traceback.format_exception(context.error))
+    for admin_id in config.ADMIN_IDS:
+        await context.bot.send_message(chat_id=admin_id, text=error_text[:4000])
+
+async def burst(mode, errors, users, concurrency):
+    sys.path.insert(0, ROOT)
+    import config
+    config.METRICS_PORT = 0
+    config.FLOOD_USER_CALLS = 10 ** 9
+
+    from telegram import Update
+    from telegram.ext import CommandHandler
+    from benchmarks.stub_api import StubRequest, make_update
+    from bot import Bot
+
+    bot = Bot()
+    request = StubRequest()
+    app = bot.build_application(request=request)
+    app.add_handler(CommandHandler("fail", failing_handler))
+    if mode == "fanout":
+        app.error_handlers.clear()
+        app.add_error_handler(fanout_error_handler)
+
+    updates = [
+        Update.de_json(make_update(n, 1000 + n % users, "/fail"), app.bot) for n in range(errors)
+    ]
+
+    async with app:
+        await bot.post_init(app)
+        await app.start()
+        request.calls.clear()
+
+        async def worker():
+            while updates:
+                await app.process_update(updates.pop())
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        during = sum(request.calls.values())
+
+        # Digests go out at the end of the interval, or when the bot stops
+        await app.stop()
+        await bot.post_stop(app)
+        await bot.post_shutdown(app)
+        total = sum(request.calls.values())
+
+    return {"per_error_us": elapsed / errors * 1e6, "calls_during": during, "calls_total": total}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--errors", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--admins", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mode", choices=("digest", "fanout"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        result = asyncio.run(burst(args.mode, args.errors, args.users, args.concurrency))
+        print(" ".join(f"{key}={value:.1f}" for key, value in result.items()))
+        return
+
+    print(f"{args.errors} failing updates from {args.users} users, {args.admins} admins")
+    print(f"{'mode':<8} {'us/error':>10} {'API calls':>10} {'after stop':>11}")
+    for mode in ("fanout", "digest"):
+        with tempfile.TemporaryDirectory() as workdir:
+            env = dict(
+                os.environ,
+                BOT_TOKEN="1000:bench",
+                ADMIN_IDS=",".join(str(admin) for admin in range(1, args.admins + 1))
+            )
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode,
+                 "--errors", str(args.errors), "--users", str(args.users),
+                 "--concurrency", str(args.concurrency)],
+                cwd=workdir, env=env, capture_output=True, text=True
+            )
+        if completed.returncode != 0:
+            sys.stderr.write(completed.stderr[-4000:])
+            raise SystemExit(f"{mode} run failed")
+        result = dict(item.split("=") for item in completed.stdout.split()[-3:])
+        print(f"{mode:<8} {float(result['per_error_us']):>10.0f} "
+              f"{float(result['calls_during']):>10.0f} {float(result['calls_total']):>11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Peak memory of /export as command_history grows
+
+Fills command_history of a temporary database in steps up to --rows rows and
+after each step exports it in a fresh process. "stream" is what /export does,
+Database.export() into plugins.admin.export.ExportWriter. "fetchall" reads
+every row with one fetchall() before writing, the way get_all_users() works,
+and only runs on the smaller steps because it needs memory for every row.
+Reports the peak RSS of the process, how far the export raised it, the time
+taken and the compressed size.
+
+Usage: python benchmarks/bench_export.py [--rows N] [--format csv|ndjson]
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ADMIN_IDS", "1")
+
+COMMANDS = ("start", "qr", "qrbatch", "stats")
+
+def peak_rss_kb():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def fill(path, start, end, batch=100000):
+    """Append rows start..end-1 to command_history"""
+    conn = sqlite3.connect(path)
+    first_day = datetime(2024, 1, 1)
+    with conn:
+        for offset in range(start, end, batch):
+            conn.executemany(
+                'INSERT INTO command_history (user_id, command, args, timestamp) VALUES (?, ?, ?, ?)',
+                [
+                    (n % 5000, COMMANDS[n % 4], f"https://example.com/page/{n}",
+                     first_day + timedelta(seconds=n))
+                    for n in range(offset, min(offset + batch, end))
+                ]
+            )
+    conn.close()
+
+async def export(mode, path, fmt):
+    from database import Database
+    from plugins.admin.export import ExportWriter
+    from storage import EXPORT_COLUMNS
+
+    db = Database(path)
+    await db.start()
+    writer = ExportWriter(EXPORT_COLUMNS["commands"], fmt)
+    base = peak_rss_kb()
+    start = time.perf_counter()
+    if mode == "stream":
+        count = await db.export("commands", writer.write_rows)
+    else:
+        columns = ", ".join(EXPORT_COLUMNS["commands"])
+        rows = await db._fetchall(f'SELECT {columns} FROM command_history')
+        writer.write_rows(rows)
+        count = len(rows)
+    parts = writer.close()
+    elapsed = time.perf_counter() - start
+    size = sum(os.fstat(part.fileno()).st_size for part in parts)
+    for part in parts:
+        part.close()
+    await db.close()
+    return {
+        "rows": count, "parts": len(parts), "compressed_mb": size / 1024 / 1024,
+        "peak_rss_mb": peak_rss_kb() / 1024, "rss_growth_mb": (peak_rss_kb() - base) / 1024,
+        "seconds": elapsed
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--format", choices=("csv", "ndjson"), default="csv")
+    parser.add_argument("--mode", choices=("stream", "fetchall"), help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(asyncio.run(export(args.mode, args.db, args.format))))
+        return
+
+    steps = [args.rows // 100, args.rows // 10, args.rows]
+    print(f"Exporting command_history as {args.format}")
+    print(f"{'rows':>10} {'mode':<9} {'peak RSS MB':>12} {'growth MB':>10} "
+          f"{'seconds':>8} {'gzip MB':>8} {'parts':>6}")
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "export.db")
+        from database import Database
+        # Creates the schema
+        asyncio.run(Database(path).close())
+        filled = 0
+        for step, rows in enumerate(steps):
+            fill(path, filled, rows)
+            filled = rows
+            # fetchall() of the largest step would need gigabytes
+            modes = ("stream", "fetchall") if step < len(steps) - 1 else ("stream",)
+            for mode in modes:
+                completed = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--mode", mode,
+                     "--db", path, "--format", args.format],
+                    cwd=workdir, capture_output=True, text=True
+                )
+                if completed.returncode != 0:
+                    sys.stderr.write(completed.stderr[-4000:])
+                    raise SystemExit(f"{mode} export failed")
+                result = json.loads(completed.stdout.splitlines()[-1])
+                print(f"{result['rows']:>10} {mode:<9} {result['peak_rss_mb']:>12.1f} {result['rss_growth_mb']:>10.1f} "
+                      f"{result['seconds']:>8.1f} {result['compressed_mb']:>8.1f} {result['parts']:>6}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Per-call cost of logger.info on the calling thread, direct handlers vs. the queue
+
+"direct" rebuilds the previous setup: the file and console handlers attached
+to the logger with a BotLogFilter each, so every call formats and writes on
+the caller. "queue" is logger.setup_logger() as used by the bot. Console
+output goes to os.devnull and files to a temporary directory.
+
+Usage: python benchmarks/bench_logging.py [--calls N]
+"""
+import argparse
+import atexit
+import logging
+import os
+import sys
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ADMIN_IDS", "1")
+
+def direct_logger(name, log_file, stream):
+    import logger as bot_logger
+
+    log = logging.getLogger(name)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    log_format = '%(asctime)s - %(levelname)s - %(message)s'
+
+    file_handler = RotatingFileHandler(log_file, maxBytes=10485760, backupCount=5, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter(log_format))
+    file_handler.addFilter(bot_logger.BotLogFilter())
+
+    console_handler = bot_logger.WindowsSafeStreamHandler(stream)
+    console_handler.setFormatter(logging.Formatter(log_format, datefmt='%H:%M:%S'))
+    console_handler.addFilter(bot_logger.BotLogFilter())
+
+    log.addHandler(file_handler)
+    log.addHandler(console_handler)
+    return log
+
+def time_calls(log, calls):
+    fields = {"user_id": 42, "command": "qr", "latency_ms": 12.5}
+    start = time.perf_counter()
+    for i in range(calls):
+        log.info(f"QR code generated and sent successfully {i}", extra=fields)
+    return (time.perf_counter() - start) / calls * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=50_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, 'w') as devnull:
+        os.chdir(workdir)
+        # The bot's console handler writes to sys.stderr
+        sys.stderr = devnull
+
+        results = {}
+        drain = {}
+        log = direct_logger("bench.direct", os.path.join(workdir, "direct.log"), devnull)
+        results["direct"] = time_calls(log, args.calls)
+
+        for log_format in ("text", "json"):
+            import config
+            config.LOG_FORMAT = log_format
+            import logger as bot_logger
+            log = logging.getLogger("TelegramBot")
+            log.handlers.clear()
+            log = bot_logger.setup_logger()
+            results[f"queue ({log_format})"] = time_calls(log, args.calls)
+            # Wait for the listener thread to write everything out
+            listener = log.handlers[0].listener
+            atexit.unregister(listener.stop)
+            start = time.perf_counter()
+            listener.stop()
+            drain[f"queue ({log_format})"] = (time.perf_counter() - start) * 1000
+
+        sys.stderr = sys.__stderr__
+
+    for name, micros in results.items():
+        backlog = f", listener finished {drain[name]:.0f}ms later" if name in drain else ""
+        print(f"{name:>12}: {micros:6.2f} us per call on the caller{backlog}")
+    print(f"queue (text) is {results['direct'] / results['queue (text)']:.1f}x cheaper for the caller")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Overhead of metrics.timed() per call, for sync and async functions
+
+Usage: python benchmarks/bench_metrics.py [--calls N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("ADMIN_IDS", "1")
+
+from metrics import Metrics  # noqa: E402
+
+def noop(value):
+    return value
+
+async def async_noop(value):
+    return value
+
+def per_call_sync(func, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return (time.perf_counter() - start) / calls * 1e9
+
+async def per_call_async(func, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        await func(i)
+    return (time.perf_counter() - start) / calls * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    metrics = Metrics()
+    timed_noop = metrics.timed("bench", "noop", noop)
+    timed_async_noop = metrics.timed("bench", "async_noop", async_noop)
+
+    sync_plain = per_call_sync(noop, args.calls)
+    sync_timed = per_call_sync(timed_noop, args.calls)
+    async_plain = asyncio.run(per_call_async(async_noop, args.calls))
+    async_timed = asyncio.run(per_call_async(timed_async_noop, args.calls))
+
+    print(f" sync: {sync_plain:7.0f} ns plain, {sync_timed:7.0f} ns timed, "
+          f"overhead {sync_timed - sync_plain:5.0f} ns")
+    print(f"async: {async_plain:7.0f} ns plain, {async_timed:7.0f} ns timed, "
+          f"overhead {async_timed - async_plain:5.0f} ns")
+
+    histogram = metrics.histogram("bench", "noop")
+    percentile_start = time.perf_counter()
+    histogram.percentile(0.99)
+    print(f"p99 of {histogram.count} samples computed in "
+          f"{(time.perf_counter() - percentile_start) * 1e6:.0f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Compare the qrcode PIL image factory with the NumPy rasterizer for QR versions 1-40
+
+Usage: python benchmarks/bench_render.py [--repeat N] [--scale PX]
+"""
+import argparse
+import os
+import sys
+import time
+from io import BytesIO
+
+import qrcode
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from plugins.qr_generator.renderer import rasterize_png, render_svg  # noqa: E402
+import numpy as np  # noqa: E402
+
+def make_qr(version, border):
+    qr = qrcode.QRCode(version=version, border=border)
+    qr.add_data("x")
+    qr.make(fit=False)
+    return qr
+
+def pil_path(qr, scale):
+    # What the plugin did before: one rectangle per dark module
+    qr.box_size = scale
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, "PNG")
+    return buffer.getvalue()
+
+def numpy_path(qr, scale):
+    return rasterize_png(np.array(qr.get_matrix(), dtype=bool), scale)
+
+def svg_path(qr, scale):
+    return render_svg(np.array(qr.get_matrix(), dtype=bool), scale)
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--border", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'version':>7} {'modules':>7} {'pil ms':>9} {'numpy ms':>9} {'svg ms':>9} {'speedup':>8}")
+    for version in range(1, 41):
+        qr = make_qr(version, args.border)
+        modules = len(qr.get_matrix())
+        pil_ms = best_of(lambda: pil_path(qr, args.scale), args.repeat)
+        numpy_ms = best_of(lambda: numpy_path(qr, args.scale), args.repeat)
+        svg_ms = best_of(lambda: svg_path(qr, args.scale), args.repeat)
+        print(
+            f"{version:>7} {modules:>7} {pil_ms:>9.2f} {numpy_ms:>9.2f} "
+            f"{svg_ms:>9.2f} {pil_ms / numpy_ms:>7.1f}x"
+        )
+
+if __name__ == "__main__":
+    main()
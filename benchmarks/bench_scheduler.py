@@ -0,0 +1,135 @@
+"""Latency of cheap and admin commands while /qr floods the bot
+
+Builds the real Bot against benchmarks.stub_api.StubRequest with a simulated
+Bot API latency and pushes --flood /qr updates from many users through the
+update processor at once, then sends /start from other users and /stats from
+an admin every --interval seconds while the flood is being worked off.
+Reports the latency of each kind of update and how many were turned away,
+for the cost class scheduler and for a single FIFO pool of handler slots
+(the processor before cost classes), each in a fresh process.
+
+Usage: python benchmarks/bench_scheduler.py [--flood N] [--probes N] [--latency S]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ADMIN_ID = 1
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+async def flood(mode, updates, probes, interval, latency, concurrency, queue_size):
+    sys.path.insert(0, ROOT)
+    import config
+    config.METRICS_PORT = 0
+    config.FLOOD_USER_CALLS = 10 ** 9
+    config.CONCURRENT_UPDATES = concurrency
+    config.CLASS_QUEUE_SIZE = queue_size
+
+    from telegram import Update
+    from benchmarks.stub_api import StubRequest, make_update
+    from bot import Bot
+
+    bot = Bot()
+    request = StubRequest(latency=latency)
+    app = bot.build_application(request=request)
+    processor = app.bot_data["update_processor"]
+    if mode == "fifo":
+        # Every update in one class that may use every slot, first come first served
+        processor._commands.clear()
+        processor.admin_ids.clear()
+        for cost_class in processor.classes.values():
+            cost_class.concurrency = concurrency
+            cost_class.max_queue = 10 ** 9
+
+    # /qr allows 5 codes per user and 30 seconds
+    qr_updates = [
+        Update.de_json(make_update(n, 10000 + n // 4, f"/qr flood {n}"), app.bot) for n in range(updates)
+    ]
+    latencies = {"qr": [], "start": [], "stats": []}
+
+    async def timed(kind, update):
+        start = time.perf_counter()
+        await processor.process_update(update, app.process_update(update))
+        latencies[kind].append(time.perf_counter() - start)
+
+    async with app:
+        await bot.post_init(app)
+        await app.start()
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(timed("qr", update)) for update in qr_updates]
+        for n in range(probes):
+            await asyncio.sleep(interval)
+            tasks.append(asyncio.create_task(timed(
+                "start", Update.de_json(make_update(updates + 2 * n, 500 + n, "/start"), app.bot)
+            )))
+            tasks.append(asyncio.create_task(timed(
+                "stats", Update.de_json(make_update(updates + 2 * n + 1, ADMIN_ID, "/stats"), app.bot)
+            )))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        shed = sum(class_stats["shed"] for class_stats in processor.stats().values())
+        await app.stop()
+        await bot.post_stop(app)
+        await bot.post_shutdown(app)
+
+    result = {"elapsed": elapsed, "shed": shed}
+    for kind, values in latencies.items():
+        result[f"{kind}_p50"] = percentile(values, 0.5) * 1000
+        result[f"{kind}_p99"] = percentile(values, 0.99) * 1000
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flood", type=int, default=600)
+    parser.add_argument("--probes", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--mode", choices=("fifo", "priority"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        result = asyncio.run(flood(
+            args.mode, args.flood, args.probes, args.interval, args.latency,
+            args.concurrency, args.queue_size
+        ))
+        print(" ".join(f"{key}={value:.1f}" for key, value in result.items()))
+        return
+
+    print(f"{args.flood} /qr updates, {args.probes} /start and admin /stats probes, "
+          f"{args.latency * 1000:.0f}ms API latency, {args.concurrency} slots")
+    print(f"{'mode':<9} {'qr p50/p99 ms':>16} {'start p50/p99 ms':>18} "
+          f"{'stats p50/p99 ms':>18} {'turned away':>12} {'total s':>8}")
+    for mode in ("fifo", "priority"):
+        with tempfile.TemporaryDirectory() as workdir:
+            env = dict(os.environ, BOT_TOKEN="1000:bench", ADMIN_IDS=str(ADMIN_ID))
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode,
+                 "--flood", str(args.flood), "--probes", str(args.probes),
+                 "--interval", str(args.interval), "--latency", str(args.latency),
+                 "--concurrency", str(args.concurrency), "--queue-size", str(args.queue_size)],
+                cwd=workdir, env=env, capture_output=True, text=True
+            )
+        if completed.returncode != 0:
+            sys.stderr.write(completed.stderr[-4000:])
+            raise SystemExit(f"{mode} run failed")
+        result = {
+            key: float(value)
+            for key, value in (item.split("=") for item in completed.stdout.split()[-8:])
+        }
+        print(f"{mode:<9} {result['qr_p50']:>7.0f}/{result['qr_p99']:<8.0f} "
+              f"{result['start_p50']:>8.0f}/{result['start_p99']:<9.0f} "
+              f"{result['stats_p50']:>8.0f}/{result['stats_p99']:<9.0f} "
+              f"{result['shed']:>12.0f} {result['elapsed']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""/search latency over a large qr_history
+
+Fills qr_history of a temporary database with --rows synthetic URLs through
+the FTS5 triggers, then times Database.search_history() for words of
+different frequency, with and without a user filter, against the LIKE scan
+an admin would otherwise run. Each query runs --repeat times and the median
+is reported, searches interrupted after SEARCH_TIMEOUT show as ">5000".
+
+Usage: python benchmarks/bench_search.py [--rows N] [--repeat N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ADMIN_IDS", "1")
+
+# One row in RARE_EVERY carries the phishing domain searched for
+RARE_EVERY = 100000
+USERS = 50000
+
+def fill(conn, rows, batch=100000):
+    rng = random.Random(7)
+    words = [f"w{n:04d}" for n in range(2000)]
+    now = datetime.now()
+    start = time.perf_counter()
+    for offset in range(0, rows, batch):
+        batch_rows = []
+        for n in range(offset, min(offset + batch, rows)):
+            if n % RARE_EVERY == 0:
+                host = "paypa1-secure-login"
+            else:
+                host = f"{rng.choice(words)}-{rng.choice(words)}"
+            text = f"https://{host}.example{n % 100}.com/{rng.choice(words)}?ref={n}"
+            batch_rows.append((n % USERS, text, now))
+        with conn:
+            conn.executemany(
+                'INSERT INTO qr_history (user_id, text_content, timestamp) VALUES (?, ?, ?)', batch_rows
+            )
+    return rows / (time.perf_counter() - start)
+
+async def timed(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await func(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, result
+
+async def run(workdir, rows, repeat):
+    from database import Database, SEARCH_TIMEOUT, fts_query
+
+    db = Database(os.path.join(workdir, "search.db"))
+    print(f"Filling qr_history with {rows} rows...")
+    rate = fill(db.conn, rows)
+    print(f"{rate:.0f} rows/s inserted with the FTS5 triggers")
+    size = os.path.getsize(db.path) / 1024 / 1024
+    print(f"Database size {size:.0f}MB\n")
+    await db.start()
+
+    rare_user = (RARE_EVERY * 3) % USERS
+    cases = [
+        ("rare word", "paypa1", None),
+        ("rare phrase", "paypa1-secure-login", None),
+        ("rare word, user", "paypa1", rare_user),
+        ("0.1% word", "w0042", None),
+        ("prefix", "paypa*", None),
+        ("every row", "https", None),
+    ]
+    print(f"{'query':<18} {'matches':>8} {'FTS5 ms':>9} {'LIKE ms':>9}")
+    for name, text, user_id in cases:
+        query = fts_query(text)
+        try:
+            fts_ms, _ = await timed(repeat, db.search_history, query, user_id, 10, 0)
+            fts = f"{fts_ms:>9.1f}"
+        except sqlite3.OperationalError:
+            fts = f"{'>' + str(SEARCH_TIMEOUT * 1000):>9}"
+        like = f"%{text.rstrip('*')}%"
+        sql = 'SELECT id FROM qr_history WHERE text_content LIKE ?'
+        params = (like,)
+        if user_id is not None:
+            sql += ' AND user_id = ?'
+            params = (like, user_id)
+        like_ms, matches = await timed(1, db._fetchall, sql, params)
+        print(f"{name:<18} {len(matches):>8} {fts} {like_ms:>9.1f}")
+    await db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        asyncio.run(run(workdir, args.rows, args.repeat))
+
+if __name__ == "__main__":
+    main()
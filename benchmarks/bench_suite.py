@@ -0,0 +1,258 @@
+"""Throughput and tail latency of the bot's handlers at growing database sizes
+
+For every size the real Bot is built in a fresh process and temporary
+directory, the database is seeded with that many users and as many rows in
+command_history and qr_history, and synthetic Updates are pushed through
+Application.process_update() against benchmarks.stub_api.StubRequest, whose
+Bot API calls return immediately. Each scenario is run once sequentially
+for latency percentiles and once with --concurrency updates in flight for
+throughput.
+
+Results are written as JSON (--output) with sorted keys so two runs can be
+diffed, and --compare OLD.json prints the change against an earlier run.
+
+/broadcast is only benchmarked as "/broadcast status": starting a broadcast
+would message every seeded user in the background and skew the other
+scenarios. bench_broadcast.py covers delivery. /activity is run twice, once
+answered from its chart cache and once with the cache emptied before every
+update, so the query, the NumPy binning and the rendering are timed.
+
+Usage: python benchmarks/bench_suite.py [--sizes 1000,10000,100000,1000000] [--output FILE]
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+ADMIN_ID = 1
+COMMANDS = ["start", "qr", "qrbatch", "stats", "users", "userinfo"]
+
+# (name, admin, text); {user} is replaced by a seeded user id, {n} by a counter
+SCENARIOS = [
+    ("start", False, "/start"),
+    ("qr_new", False, "/qr bench text {n}"),
+    ("qr_cached", False, "/qr bench cached text"),
+    ("admin_stats", True, "/stats"),
+    ("admin_perf", True, "/perf"),
+    ("admin_users", True, "/users"),
+    ("admin_userinfo", True, "/userinfo {user}"),
+    ("admin_logs_tail", True, "/logs tail 50"),
+    ("admin_logs_grep", True, "/logs grep qr 1h"),
+    ("admin_broadcast_status", True, "/broadcast status"),
+    ("admin_search", True, "/search text {n}"),
+    ("admin_activity", True, "/activity 30 hour"),
+    ("admin_activity_render", True, "/activity 30 hour"),
+    ("admin_export", True, "/export commands 1h"),
+]
+
+# Scenarios run with AdminPlugin.activity_charts emptied before every update
+UNCACHED = ("admin_activity_render",)
+
+def seed(db, size):
+    """Fill the database with size users and size rows of command and QR history"""
+    rng = random.Random(size)
+    now = datetime.now()
+    start = now - timedelta(days=30)
+    step = (now - start) / size
+
+    with db.conn:
+        db.conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, last_seen, commands_used, join_date) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            ((1000 + i, f"user{i}", f"User {i}", start + step * i, 1, start) for i in range(size))
+        )
+        db.conn.executemany(
+            "INSERT INTO command_history (user_id, command, args, timestamp) VALUES (?, ?, ?, ?)",
+            ((1000 + rng.randrange(size), rng.choice(COMMANDS), "", start + step * i) for i in range(size))
+        )
+        db.conn.executemany(
+            "INSERT INTO qr_history (user_id, text_content, timestamp) VALUES (?, ?, ?)",
+            ((1000 + rng.randrange(size), f"text {i}", start + step * i) for i in range(size))
+        )
+    db.stats.rebuild(db.conn)
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+
+    def percentile(q):
+        return latencies[max(0, math.ceil(q * len(latencies)) - 1)] * 1000
+
+    return {
+        "count": len(latencies),
+        "p50_ms": round(percentile(0.5), 3),
+        "p95_ms": round(percentile(0.95), 3),
+        "p99_ms": round(percentile(0.99), 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "throughput_per_s": round(len(latencies) / elapsed, 1) if elapsed else None
+    }
+
+async def run_size(size, updates, concurrency):
+    sys.path.insert(0, ROOT)
+    import config
+    config.METRICS_PORT = 0
+    # Flood control would reject the synthetic users after a few commands
+    config.FLOOD_USER_CALLS = 10 ** 9
+
+    from telegram import Update
+    from benchmarks.stub_api import StubRequest, make_update
+    from database import get_database
+    from bot import Bot
+
+    seed_start = time.perf_counter()
+    seed(get_database(), size)
+    seed_seconds = time.perf_counter() - seed_start
+
+    bot = Bot()
+    request = StubRequest()
+    app = bot.build_application(request=request)
+    app.bot_data["flood_control"].limits.clear()
+    admin = next(plugin for plugin in bot.plugins if type(plugin).__name__ == "AdminPlugin")
+    rng = random.Random(size)
+    counter = iter(range(10 ** 9))
+
+    def make(admin, text):
+        user_id = ADMIN_ID if admin else 1000 + rng.randrange(size)
+        text = text.format(user=1000 + rng.randrange(size), n=next(counter))
+        return Update.de_json(make_update(next(counter), user_id, text), app.bot)
+
+    async def process(name, update):
+        if name in UNCACHED:
+            admin.activity_charts.clear()
+        await app.process_update(update)
+
+    results = {}
+    async with app:
+        await bot.post_init(app)
+        await app.start()
+
+        for name, is_admin, text in SCENARIOS:
+            # Warm up caches, thread pools and the renderer processes
+            for _ in range(3):
+                await process(name, make(is_admin, text))
+
+            latencies = []
+            for _ in range(updates):
+                update = make(is_admin, text)
+                start = time.perf_counter()
+                await process(name, update)
+                latencies.append(time.perf_counter() - start)
+            sequential = summarize(latencies, sum(latencies))
+
+            pending = [make(is_admin, text) for _ in range(updates)]
+            concurrent_latencies = []
+
+            async def worker():
+                while pending:
+                    update = pending.pop()
+                    start = time.perf_counter()
+                    await process(name, update)
+                    concurrent_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            concurrent = summarize(concurrent_latencies, time.perf_counter() - start)
+
+            results[name] = {"sequential": sequential, "concurrent": concurrent}
+
+        await app.stop()
+        await bot.post_stop(app)
+        await bot.post_shutdown(app)
+
+    return {"seed_seconds": round(seed_seconds, 2), "scenarios": results}
+
+def compare(old, new):
+    print(f"{'size':>8} {'scenario':<24} {'old p95':>9} {'new p95':>9} {'old/s':>9} {'new/s':>9}")
+    for size, result in new["results"].items():
+        old_result = old.get("results", {}).get(size)
+        if not old_result:
+            continue
+        for name, scenario in result["scenarios"].items():
+            old_scenario = old_result["scenarios"].get(name)
+            if not old_scenario:
+                continue
+            print(
+                f"{size:>8} {name:<24} "
+                f"{old_scenario['sequential']['p95_ms']:>9.2f} {scenario['sequential']['p95_ms']:>9.2f} "
+                f"{old_scenario['concurrent']['throughput_per_s'] or 0:>9.0f} "
+                f"{scenario['concurrent']['throughput_per_s'] or 0:>9.0f}"
+            )
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="comma-separated numbers of users and history rows")
+    parser.add_argument("--updates", type=int, default=200, help="updates per scenario and phase")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size:
+        result = asyncio.run(run_size(args.size, args.updates, args.concurrency))
+        print(json.dumps(result))
+        return
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "updates": args.updates,
+            "concurrency": args.concurrency,
+            "date": datetime.now().isoformat(timespec="seconds")
+        },
+        "results": {}
+    }
+    for size in (int(value) for value in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as workdir:
+            env = dict(os.environ, BOT_TOKEN="1000:bench", ADMIN_IDS=str(ADMIN_ID))
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--size", str(size),
+                 "--updates", str(args.updates), "--concurrency", str(args.concurrency)],
+                cwd=workdir, env=env, capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                sys.stderr.write(completed.stderr[-4000:])
+                raise SystemExit(f"size {size} failed")
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+        output["results"][str(size)] = result
+
+        print(f"\n{size} users / history rows (seeded in {result['seed_seconds']}s)")
+        print(f"{'scenario':<24} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'seq/s':>8} {'conc/s':>8}")
+        for name, scenario in result["scenarios"].items():
+            sequential, concurrent = scenario["sequential"], scenario["concurrent"]
+            print(
+                f"{name:<24} {sequential['p50_ms']:>8.2f} {sequential['p95_ms']:>8.2f} "
+                f"{sequential['p99_ms']:>8.2f} {sequential['throughput_per_s']:>8.0f} "
+                f"{concurrent['throughput_per_s']:>8.0f}"
+            )
+
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=2, sort_keys=True)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), output)
+
+if __name__ == "__main__":
+    main()
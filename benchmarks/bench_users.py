@@ -0,0 +1,89 @@
+"""Writes to users for a stream of commands, with and without the user cache
+
+Replays --commands calls to add_or_update_user() from --users users, where a
+tenth of the users send most of the commands, spread over --seconds with the
+write-behind queue running. "direct" queues one upsert per command like
+before the cache, "cached" goes through Database.user_cache. Reports the
+upserts written, the time the writer thread spent in flushes and the size of
+the WAL file, each mode on a fresh database in a temporary directory.
+
+Usage: python benchmarks/bench_users.py [--commands N] [--users N] [--seconds S]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ADMIN_IDS", "1")
+
+async def replay(mode, workdir, commands, users, seconds, flush_interval):
+    import config
+    config.USER_FLUSH_INTERVAL = flush_interval
+    from database import Database
+
+    db = Database(os.path.join(workdir, f"{mode}.db"))
+    await db.start()
+    rng = random.Random(42)
+    heavy = max(1, users // 10)
+    ticks = max(1, int(seconds / 0.01))
+    per_tick = max(1, commands // ticks)
+
+    flush_seconds = 0.0
+    flush = db.write_queue.flush
+
+    async def timed_flush():
+        nonlocal flush_seconds
+        start = time.perf_counter()
+        try:
+            return await flush()
+        finally:
+            flush_seconds += time.perf_counter() - start
+    db.write_queue.flush = timed_flush
+
+    sent = 0
+    while sent < commands:
+        for _ in range(min(per_tick, commands - sent)):
+            # 90% of the commands come from the heavy tenth of the users
+            user_id = rng.randrange(heavy) if rng.random() < 0.9 else rng.randrange(heavy, users)
+            if mode == "direct":
+                db.write_user(user_id, f"user{user_id}", "Bench", 1, datetime.now())
+            else:
+                db.add_or_update_user(user_id, f"user{user_id}", "Bench")
+            sent += 1
+        await asyncio.sleep(0.01)
+
+    await db.user_cache.sync()
+    rows = db.write_queue.rows_written
+    wal = os.path.getsize(os.path.join(workdir, f"{mode}.db-wal"))
+    commands_used = (await db.run_read(
+        lambda cursor: cursor.execute('SELECT SUM(commands_used) FROM users').fetchone()
+    ))[0]
+    await db.close()
+    return rows, flush_seconds, wal, commands_used
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commands", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--flush-interval", type=float, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.commands} commands from {args.users} users over {args.seconds:g}s, "
+          f"user flush every {args.flush_interval:g}s")
+    print(f"{'mode':<8} {'upserts':>8} {'flush ms':>9} {'WAL KB':>8} {'commands_used':>14}")
+    for mode in ("direct", "cached"):
+        with tempfile.TemporaryDirectory() as workdir:
+            rows, flush_seconds, wal, commands_used = asyncio.run(replay(
+                mode, workdir, args.commands, args.users, args.seconds, args.flush_interval
+            ))
+        print(f"{mode:<8} {rows:>8} {flush_seconds * 1000:>9.0f} {wal / 1024:>8.0f} {commands_used:>14}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Throughput of sequential polling-style processing vs. webhooks with concurrent updates
+
+Each mode runs the real Bot (with /start as the workload) in a fresh process
+and temporary directory, against benchmarks.stub_api.StubRequest with a
+simulated Bot API latency. Polling mode feeds updates through the update queue
+one at a time like run_polling() with default settings. Webhook mode starts
+PTB's webhook server on localhost and POSTs the same updates to it.
+
+Usage: python benchmarks/bench_webhook.py [--updates N] [--users N] [--latency S]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+async def run_mode(mode, updates, users, latency, concurrency, connections, port):
+    sys.path.insert(0, ROOT)
+    import httpx
+    import config
+    config.CONCURRENT_UPDATES = 1 if mode == "polling" else concurrency
+
+    from telegram import Update
+    from benchmarks.stub_api import StubRequest, make_update
+    from bot import Bot
+
+    request = StubRequest(latency=latency)
+    app = Bot().build_application(request=request)
+    payloads = [make_update(i, 1 + i % users, "/start") for i in range(1, updates + 1)]
+
+    async with app:
+        await app.start()
+        start = time.perf_counter()
+        if mode == "polling":
+            for payload in payloads:
+                await app.update_queue.put(Update.de_json(payload, app.bot))
+        else:
+            await app.updater.start_webhook(
+                listen="127.0.0.1",
+                port=port,
+                url_path="telegram",
+                webhook_url=f"http://127.0.0.1:{port}/telegram"
+            )
+            start = time.perf_counter()
+            # Telegram keeps at most max_connections requests open per bot
+            pending = list(reversed(payloads))
+            async with httpx.AsyncClient(limits=httpx.Limits(max_connections=connections)) as client:
+                async def sender():
+                    while pending:
+                        await client.post(f"http://127.0.0.1:{port}/telegram", json=pending.pop())
+                await asyncio.gather(*(sender() for _ in range(connections)))
+
+        # Every /start ends with one sendMessage
+        while request.calls["sendMessage"] < updates:
+            await asyncio.sleep(0.005)
+        elapsed = time.perf_counter() - start
+
+        if app.updater.running:
+            await app.updater.stop()
+        await app.stop()
+
+    return {"mode": mode, "updates": updates, "seconds": elapsed, "updates_per_second": updates / elapsed}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated Bot API latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--connections", type=int, default=16, help="parallel webhook deliveries")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mode", choices=["polling", "webhook"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        result = asyncio.run(run_mode(
+            args.mode, args.updates, args.users, args.latency, args.concurrency,
+            args.connections, args.port
+        ))
+        print(json.dumps(result))
+        return
+
+    results = {}
+    for mode in ("polling", "webhook"):
+        with tempfile.TemporaryDirectory() as workdir:
+            env = dict(os.environ, BOT_TOKEN="1000:bench", ADMIN_IDS=os.getenv("ADMIN_IDS", "1"))
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode] + sys.argv[1:],
+                cwd=workdir, env=env, capture_output=True, text=True, check=True
+            ).stdout
+            results[mode] = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>8}: {results[mode]['updates_per_second']:8.1f} updates/s "
+              f"({results[mode]['seconds']:.2f}s for {args.updates})")
+
+    gain = results["webhook"]["updates_per_second"] / results["polling"]["updates_per_second"]
+    print(f"webhook + concurrent updates: {gain:.1f}x the sequential throughput")
+
+if __name__ == "__main__":
+    main()
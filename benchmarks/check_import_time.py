@@ -0,0 +1,88 @@
+"""Regression check for the bot's cold start, measured with python -X importtime
+
+Imports bot and builds the Bot (plugin discovery included) in a fresh
+interpreter, then fails if any module that must stay lazy was imported or if
+the cumulative import time of bot exceeds --budget-ms (median of --runs).
+tests/test_import_time.py runs the same check with pytest.
+
+Usage: python benchmarks/check_import_time.py [--budget-ms MS] [--runs N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Only needed once a QR code is rendered, or not at all
+LAZY_MODULES = (
+    "numpy",
+    "PIL",
+    "qrcode",
+    "plugins.qr_generator.qr_handler",
+    "plugins.qr_generator.renderer",
+    "qr_generator",
+    "command",
+)
+
+def measure():
+    """Return {module: (cumulative microseconds, top level)} for one cold start"""
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            PYTHONPATH=ROOT,
+            BOT_TOKEN="1000:check",
+            ADMIN_IDS=os.getenv("ADMIN_IDS", "1"),
+            METRICS_PORT="0"
+        )
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import bot; bot.Bot()"],
+            cwd=workdir, env=env, capture_output=True, text=True
+        )
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr[-4000:])
+        raise SystemExit("importing bot failed")
+
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented below the module that triggered them
+        top_level = len(name) - len(name.lstrip()) <= 1
+        cumulative[name.strip()] = (int(cumulative_us), top_level)
+    return cumulative
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    bot_ms = statistics.median(run["bot"][0] for run in runs) / 1000
+
+    failures = []
+    leaked = sorted({name for run in runs for name in run if name in LAZY_MODULES})
+    if leaked:
+        failures.append(f"imported at startup but should be lazy: {', '.join(leaked)}")
+    if bot_ms > args.budget_ms:
+        failures.append(f"import bot took {bot_ms:.0f}ms, budget is {args.budget_ms:.0f}ms")
+
+    top_level = [(name, micros) for name, (micros, top) in runs[-1].items() if top]
+    top_level.sort(key=lambda item: item[1], reverse=True)
+    print(f"import bot: {bot_ms:.0f}ms (median of {args.runs})")
+    print("slowest top-level imports:")
+    for name, micros in top_level[:10]:
+        print(f"  {name:<30} {micros / 1000:8.1f}ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
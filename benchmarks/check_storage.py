@@ -0,0 +1,197 @@
+"""Run the same calls against the SQLite and MongoDB backends and compare the results
+
+The MongoDB backend uses --mongodb-uri (a local mongod, the database given by
+--mongodb-database is dropped first) or, without it, mongomock if installed.
+Timestamps are left out of the comparison since the calls happen at different
+times. Also reports how fast each backend flushes --writes queued logging calls.
+tests/test_storage_parity.py runs the same comparison against mongomock.
+
+Usage: python benchmarks/check_storage.py [--mongodb-uri URI] [--writes N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault("ADMIN_IDS", "1")
+
+USERS = 50
+
+# Rows written in the same millisecond (MongoDB's resolution) may come back in any order
+UNORDERED = ("get_user_history", "get_qr_history", "export/qr", "export/users")
+
+def normalize(value):
+    if isinstance(value, datetime):
+        return "<time>"
+    if isinstance(value, str):
+        # SQLite returns DATETIME columns as text
+        try:
+            datetime.fromisoformat(value)
+            return "<time>"
+        except ValueError:
+            return value
+    if isinstance(value, (list, tuple)):
+        return [normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in sorted(value.items())}
+    return value
+
+async def scenario(db):
+    """Exercise the storage interface, return {call: result}"""
+    results = {}
+    # Written directly, before start()
+    for user_id in range(1, USERS + 1):
+        db.add_or_update_user(user_id, f"user{user_id}", f"User {user_id}")
+        db.log_command(user_id, "start", "")
+    await db.start()
+
+    # Written through the write-behind queue
+    for user_id in range(1, USERS + 1):
+        for n in range(user_id % 7):
+            db.add_or_update_user(user_id, f"user{user_id}", f"User {user_id}")
+            db.log_command(user_id, "qr", f"text {n}")
+            db.log_qr_generation(user_id, f"text {n}")
+    db.log_qr_batch(3, [f"batch {n}" for n in range(10)])
+    db.save_qr_file_id("key-a", "file-a")
+    db.save_qr_file_id("key-b", "file-b")
+    db.save_qr_file_id("key-a", "file-a2")
+    db.delete_qr_file_id("key-b")
+    await db.write_queue.flush()
+
+    results["get_stats"] = await db.get_stats()
+    results["count_users"] = await db.count_users()
+    results["count_user_history"] = await db.count_user_history(6)
+    results["get_user_stats"] = await db.get_user_stats(6)
+    results["get_user_stats/missing"] = await db.get_user_stats(10 ** 9)
+    results["get_user_history"] = await db.get_user_history(6)
+    results["get_qr_history"] = await db.get_qr_history(3)
+    results["get_qr_file_ids"] = await db.get_qr_file_ids(["key-a", "key-b", "key-c"])
+    results["get_qr_file_id"] = await db.get_qr_file_id("key-a")
+    results["get_commands_today"] = await db.get_commands_today()
+    results["get_active_users_today"] = await db.get_active_users_today()
+
+    for name in ("qr", "users"):
+        rows = []
+        count = await db.export(name, rows.extend, chunk_size=7)
+        results[f"export/{name}"] = rows
+        results[f"export/{name}/count"] = count
+
+    # Cursors go through str() like the callback data of the admin keyboards
+    page, has_more = await db.get_users_page(None, 20)
+    results["get_users_page/first"] = (page, has_more)
+    cursor = (str(page[-1][3]), page[-1][0])
+    older, has_more = await db.get_users_page(cursor, 20)
+    results["get_users_page"] = (older, has_more)
+    cursor = (str(older[0][3]), older[0][0])
+    results["get_users_page/newer"] = await db.get_users_page(cursor, 20, newer=True)
+
+    page, has_more = await db.get_user_history_page(6, None, 2)
+    results["get_user_history_page/first"] = (page, has_more)
+    cursor = (str(page[-1][3]), page[-1][0])
+    older = await db.get_user_history_page(6, cursor, 2)
+    results["get_user_history_page"] = older
+    cursor = (str(older[0][0][3]), older[0][0][0])
+    results["get_user_history_page/newer"] = await db.get_user_history_page(6, cursor, 2, newer=True)
+
+    broadcast_id, total = await db.create_broadcast(1, "hello")
+    results["create_broadcast"] = (broadcast_id, total)
+    db.set_broadcast_message(broadcast_id, 1, 99)
+    pending = await db.get_pending_recipients(broadcast_id, after_user_id=0, limit=10)
+    results["get_pending_recipients"] = pending
+    for user_id in pending[:6]:
+        db.mark_broadcast_recipient(broadcast_id, user_id, "sent")
+    db.mark_broadcast_recipient(broadcast_id, pending[6], "failed", "Forbidden")
+    await db.write_queue.flush()
+    results["get_pending_recipients/after"] = await db.get_pending_recipients(broadcast_id, pending[-1], 5)
+    results["get_broadcast_counts"] = await db.get_broadcast_counts(broadcast_id)
+    results["get_running_broadcasts"] = await db.get_running_broadcasts()
+    db.finish_broadcast(broadcast_id, "cancelled")
+    await db.write_queue.flush()
+    results["get_running_broadcasts/finished"] = await db.get_running_broadcasts()
+
+    results["get_command_hours"] = await command_totals(db)
+    results["rebuild_stats"] = await db.rebuild_stats()
+    results["get_command_hours/rebuilt"] = await command_totals(db)
+    results = {name: normalize(result) for name, result in results.items()}
+    for name in UNORDERED:
+        results[name].sort()
+    return results
+
+async def command_totals(db):
+    """Commands per command in command_hourly around now, the calls may straddle an hour"""
+    now = datetime.now()
+    totals = Counter()
+    for _, command, count in await db.get_command_hours(now - timedelta(hours=2), now + timedelta(hours=2)):
+        totals[command] += count
+    return sorted(totals.items())
+
+async def flush_rate(db, writes):
+    """Queue writes logging calls (user, command and QR rows) and time the flushes"""
+    start = time.perf_counter()
+    for n in range(writes):
+        user_id = 1000 + n % 500
+        db.add_or_update_user(user_id, f"user{user_id}", "Bench")
+        db.log_command(user_id, "qr", "bench")
+        db.log_qr_generation(user_id, "bench")
+        if len(db.write_queue.pending) >= db.write_queue.max_batch:
+            await db.write_queue.flush()
+    await db.write_queue.flush()
+    return writes * 3 / (time.perf_counter() - start)
+
+async def run(db, writes):
+    try:
+        results = await scenario(db)
+        rate = await flush_rate(db, writes)
+    finally:
+        await db.close()
+    return results, rate
+
+def mongo_backend(args):
+    from mongo_database import MongoDatabase
+    if args.mongodb_uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongodb_uri)
+        client.drop_database(args.mongodb_database)
+        return "mongodb", MongoDatabase(args.mongodb_uri, args.mongodb_database, client=client)
+    try:
+        import mongomock
+    except ImportError:
+        return None, None
+    return "mongomock", MongoDatabase(None, args.mongodb_database, client=mongomock.MongoClient())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongodb-uri")
+    parser.add_argument("--mongodb-database", default="ignitebot_check")
+    parser.add_argument("--writes", type=int, default=5000)
+    args = parser.parse_args()
+
+    from database import Database
+    with tempfile.TemporaryDirectory() as workdir:
+        sqlite_results, sqlite_rate = asyncio.run(
+            run(Database(os.path.join(workdir, "check.db")), args.writes)
+        )
+    print(f"sqlite:    {sqlite_rate:10.0f} rows/s flushed")
+
+    name, mongo = mongo_backend(args)
+    if mongo is None:
+        raise SystemExit("No MongoDB to compare with: pass --mongodb-uri or install mongomock")
+    mongo_results, mongo_rate = asyncio.run(run(mongo, args.writes))
+    print(f"{name + ':':<10} {mongo_rate:10.0f} rows/s flushed")
+
+    failures = [
+        call for call in sqlite_results if sqlite_results[call] != mongo_results.get(call)
+    ]
+    for call in failures:
+        print(f"FAIL {call}:\n  sqlite: {sqlite_results[call]}\n  {name}: {mongo_results.get(call)}")
+    if failures:
+        raise SystemExit(1)
+    print(f"OK: {len(sqlite_results)} calls return the same results")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""In-process stand-in for the Telegram Bot API
+
+StubRequest plugs into Application.builder().request(...) and answers every
+Bot API call locally after an optional simulated network latency, so the real
+handlers can be driven without a token or network access.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+class StubRequest(BaseRequest):
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        params = request_data.parameters if request_data else {}
+        result = self._result(api_method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _message(self, params, **extra):
+        chat_id = params.get("chat_id", 1)
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER
+        }
+        message.update(extra)
+        return message
+
+    def _photo(self):
+        file_id = f"photo-{next(self._file_ids)}"
+        return [{"file_id": file_id, "file_unique_id": file_id, "width": 310, "height": 310}]
+
+    def _document(self, name="file"):
+        file_id = f"document-{next(self._file_ids)}"
+        return {"file_id": file_id, "file_unique_id": file_id, "file_name": name}
+
+    def _result(self, api_method, params):
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method == "sendPhoto":
+            return self._message(params, photo=self._photo())
+        if api_method == "sendDocument":
+            return self._message(params, document=self._document())
+        if api_method == "sendMediaGroup":
+            media = params.get("media") or []
+            if isinstance(media, str):
+                media = json.loads(media)
+            return [
+                self._message(params, **(
+                    {"document": self._document()} if item.get("type") == "document"
+                    else {"photo": self._photo()}
+                ))
+                for item in media
+            ]
+        if api_method in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        # setWebhook, deleteWebhook, answerCallbackQuery, ...
+        return True
+
+def make_update(update_id, user_id, text, chat_id=None):
+    """Return the JSON dict of a private text message update"""
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+    entities = []
+    if text.startswith("/"):
+        entities.append({"type": "bot_command", "offset": 0, "length": len(text.split()[0])})
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id or user_id, "type": "private"},
+            "from": user,
+            "text": text,
+            "entities": entities
+        }
+    }
@@ -1,71 +1,43 @@
 from telegram import Update
-from telegram.ext import Application, CommandHandler, CallbackContext
+from telegram.ext import Application, CommandHandler, TypeHandler, CallbackContext
 import config
-from command import ping, test
-from qr_generator import generate_qr
-from database import Database
+from database import Database, get_database
 from logger import logger
-from utils import admin_only
 import sqlite3
-import traceback
-from plugins.qr_generator.qr_handler import QRGeneratorPlugin
-from plugins.admin.admin_handler import AdminPlugin
-
-# Initialize database
-db = Database()
+from plugins.registry import discover_plugins
+from update_processor import PerChatUpdateProcessor
+from flood_control import FloodControl
+from metrics import metrics, instrument_handlers
+from plugins.base import RateLimit
+from retention import Retention
+from error_digest import ErrorDigest
 
 # Error handler function
-async def error_handler(update: Update, context: CallbackContext):
-    logger.error(f"Update {update} caused error {context.error}", exc_info=context.error)
-    
-    # Notify user
-    error_message = "An error occurred while processing your request."
-    if update and update.effective_message:
-        await update.effective_message.reply_text(error_message)
-
-    # Log additional details if available
-    if update:
-        logger.error(
-            f"User: {update.effective_user.id if update.effective_user else 'Unknown'}\n"
-            f"Chat: {update.effective_chat.id if update.effective_chat else 'Unknown'}\n"
-            f"Message: {update.effective_message.text if update.effective_message else 'Unknown'}"
-        )
+async def error_handler(update: object, context: CallbackContext):
+    error = context.error
+    user = getattr(update, "effective_user", None)
+    extra = {"user_id": user.id} if user else {}
 
+    # Admins get one digest per kind of error instead of a message per error
+    digest = context.bot_data.get("error_digest")
+    error_id, first = digest.record(error, update) if digest else ("-", True)
+    if first:
+        logger.error(f"Update {update} caused error {error} [{error_id}]", exc_info=error, extra=extra)
+    else:
+        logger.error(f"{type(error).__name__}: {error} [{error_id}]", extra=extra)
+
+    # One reply to the user
+    message = getattr(update, "effective_message", None)
+    if message is None:
+        return
+    if isinstance(error, sqlite3.Error):
+        reply = "😕 Database error occurred. Please try again later."
+    elif "Message is too long" in str(error):
+        reply = "⚠️ Response is too long. Please try a more specific request."
+    else:
+        reply = "😔 An error occurred while processing your request. Please try again later."
     try:
-        # Get the error message
-        error_msg = str(context.error)
-        
-        # Handle specific errors
-        if isinstance(context.error, sqlite3.Error):
-            await update.message.reply_text(
-                "😕 Database error occurred. Please try again later."
-            )
-        elif "Message is too long" in error_msg:
-            await update.message.reply_text(
-                "⚠️ Response is too long. Please try a more specific request."
-            )
-        else:
-            # Generic error message for users
-            await update.message.reply_text(
-                "😔 An error occurred while processing your request. Please try again later."
-            )
-            
-        # Notify admin of the error (replace with your admin chat ID)
-        if update.effective_user:
-            error_text = f"❌ Error for user {update.effective_user.id}:\n"
-            error_text += f"Command: {update.message.text if update.message else 'Unknown'}\n"
-            error_text += f"Error: {traceback.format_exc()}"
-            
-            # Send to admin (you'll need to add admin notification logic)
-            for admin_id in config.ADMIN_IDS:
-                try:
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=error_text[:4000]  # Telegram message length limit
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to notify admin {admin_id}: {e}")
-                    
+        await message.reply_text(reply)
     except Exception as e:
         logger.error(f"Error in error handler: {e}")
 
@@ -74,19 +46,19 @@ async def safe_command(update: Update, context: CallbackContext, handler):
     try:
         await handler(update, context)
     except Exception as e:
+        context.error = e
         await error_handler(update, context)
 
 class Bot:
     def __init__(self):
         self.plugins = []
-        self.db = Database()  # Initialize database
+        self.db = get_database()  # Shared by the bot and every plugin
+        self.error_digest = ErrorDigest(config.ADMIN_IDS, config.ERROR_DIGEST_INTERVAL)
         self.load_plugins()
 
     def load_plugins(self):
-        # Load regular plugins
-        self.plugins.append(QRGeneratorPlugin())
-        # Load admin plugin
-        self.plugins.append(AdminPlugin())
+        # Every package under plugins/ with a plugin.json, heavy ones are imported on first use
+        self.plugins.extend(discover_plugins(self.db))
         logger.info(f"Loaded {len(self.plugins)} plugins")
 
     async def start(self, update: Update, context: CallbackContext):
@@ -100,7 +72,10 @@ class Bot:
             )
             self.db.log_command(user.id, "start", "")
             
-            logger.info(f"Command /start used by {user.first_name} (@{user.username})")
+            logger.info(
+                f"Command /start used by {user.first_name} (@{user.username})",
+                extra={"user_id": user.id, "command": "start"}
+            )
             
             # Basic help text for all users
             help_text = "Available commands:\n"
@@ -108,36 +83,162 @@ class Bot:
             
             # Add regular commands to help
             for plugin in self.plugins:
-                for command, _, description in getattr(plugin, 'commands', []):
-                    help_text += f"/{command} - {description}\n"
+                for command in getattr(plugin, 'commands', []):
+                    help_text += f"/{command.name} - {command.description}\n"
             
             # Only add admin commands if user is an admin
             if user.id in config.ADMIN_IDS:
                 help_text += "\n👑 Admin commands:\n"
                 for plugin in self.plugins:
-                    for command, _, description in getattr(plugin, 'admin_commands', []):
-                        help_text += f"/{command} - {description}\n"
+                    for command in getattr(plugin, 'admin_commands', []):
+                        help_text += f"/{command.name} - {command.description}\n"
             
             await update.message.reply_text(help_text)
             
         except Exception as e:
             logger.error(f"Error in start command: {str(e)}")
 
+    async def post_init(self, application):
+        # Start batching logging writes once the event loop is running
+        await self.db.start()
+        self.error_digest.start(application.bot)
+        for plugin in self.plugins:
+            await plugin.on_startup(application)
+        if config.METRICS_PORT:
+            try:
+                await metrics.start_server(config.METRICS_HOST, config.METRICS_PORT)
+            except OSError as e:
+                logger.error(f"Could not start metrics endpoint: {e}")
+
+    async def post_stop(self, application):
+        # Last digest while the bot can still send messages
+        await self.error_digest.stop()
+        for plugin in self.plugins:
+            try:
+                await plugin.on_stop(application)
+            except Exception as e:
+                logger.error(f"Error stopping {plugin.get_description()}: {e}")
+
+    async def post_shutdown(self, application):
+        await metrics.stop_server()
+        for plugin in self.plugins:
+            try:
+                await plugin.on_shutdown(application)
+            except Exception as e:
+                logger.error(f"Error shutting down {plugin.get_description()}: {e}")
+        # Make sure queued logging writes reach the database
+        await self.db.close()
+
+    def schedule_retention(self, app):
+        if not isinstance(self.db, Database):
+            logger.warning("RETENTION_DAYS is only supported with the SQLite backend")
+            return
+        if app.job_queue is None:
+            logger.warning("RETENTION_DAYS needs the job queue: pip install python-telegram-bot[job-queue]")
+            return
+        retention = Retention(
+            self.db, config.RETENTION_DAYS, config.ARCHIVE_DIR, config.RETENTION_BATCH_SIZE
+        )
+        retention.schedule(app.job_queue, config.RETENTION_INTERVAL_HOURS)
+        app.bot_data["retention"] = retention
+
+    def build_application(self, request=None):
+        """Build the Application with every handler registered
+
+        request replaces the HTTP layer used to talk to the Bot API, which lets
+        benchmarks run the real handlers against a local stand-in.
+        """
+        builder = (
+            Application.builder()
+            .token(config.BOT_TOKEN)
+            .post_init(self.post_init)
+            .post_stop(self.post_stop)
+            .post_shutdown(self.post_shutdown)
+        )
+        if request is not None:
+            builder = builder.request(request).get_updates_request(request)
+
+        # Handle updates concurrently, one at a time per chat, cheap commands first
+        processor = None
+        if config.CONCURRENT_UPDATES > 1:
+            processor = PerChatUpdateProcessor(
+                config.CONCURRENT_UPDATES,
+                class_limits={
+                    "admin": (config.CONCURRENT_UPDATES, config.CLASS_QUEUE_SIZE),
+                    "cheap": (config.CONCURRENT_UPDATES, config.CLASS_QUEUE_SIZE),
+                    "io": (config.IO_CONCURRENCY, config.CLASS_QUEUE_SIZE),
+                    "cpu": (config.CPU_CONCURRENCY, config.CLASS_QUEUE_SIZE),
+                },
+                admin_ids=config.ADMIN_IDS
+            )
+            builder = builder.concurrent_updates(processor)
+        app = builder.build()
+
+        # Flood control sees every update before the handlers in group 0
+        flood_control = FloodControl(
+            RateLimit(config.FLOOD_USER_CALLS, config.FLOOD_USER_PERIOD),
+            exempt=config.ADMIN_IDS
+        )
+        for plugin in self.plugins:
+            for command in plugin.commands + plugin.admin_commands:
+                flood_control.set_limit(command.name, command.limit)
+                if processor:
+                    processor.set_command(command.name, command.cost, command.max_concurrent)
+        if processor:
+            processor.set_command("start", "cheap")
+            app.bot_data["update_processor"] = processor
+        app.add_handler(TypeHandler(Update, flood_control.handle_update), group=-1)
+        app.bot_data["flood_control"] = flood_control
+
+        # Move old history out of the database in the background
+        if config.RETENTION_DAYS > 0:
+            self.schedule_retention(app)
+
+        # Uncaught errors are answered once and counted for the admin digest
+        app.add_error_handler(error_handler)
+        app.bot_data["error_digest"] = self.error_digest
+
+        # Register core commands
+        app.add_handler(CommandHandler("start", self.start))
+
+        # Plugins are shared with handlers that report on them, like /stats
+        app.bot_data["plugins"] = self.plugins
+
+        # Register plugin commands
+        for plugin in self.plugins:
+            plugin.register_handlers(app)
+            logger.info(f"Registered plugin: {plugin.get_description()}")
+
+        # Latency histograms for every handler, shown by /perf and on /metrics
+        instrument_handlers(app)
+
+        return app
+
     def main(self):
         try:
             logger.info("[BOT] Bot is starting up...")
-            app = Application.builder().token(config.BOT_TOKEN).build()
-
-            # Register core commands
-            app.add_handler(CommandHandler("start", self.start))
-
-            # Register plugin commands
-            for plugin in self.plugins:
-                plugin.register_handlers(app)
-                logger.info(f"Registered plugin: {plugin.get_description()}")
+            if config.BOT_MODE == "webhook" and not config.WEBHOOK_URL:
+                # Telegram can't be told where to send updates, set_webhook would fail on every restart
+                logger.error("[ERROR] BOT_MODE is webhook but WEBHOOK_URL is not set, not starting")
+                return
+            app = self.build_application()
 
-            logger.info("[OK] Bot is ready and listening for commands!")
-            app.run_polling()
+            if config.BOT_MODE == "webhook":
+                logger.info(
+                    f"[OK] Bot is ready, serving webhooks on port {config.PORT} "
+                    f"({config.CONCURRENT_UPDATES} concurrent updates)"
+                )
+                app.run_webhook(
+                    listen=config.WEBHOOK_LISTEN,
+                    port=config.PORT,
+                    url_path=config.WEBHOOK_PATH,
+                    webhook_url=f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}",
+                    secret_token=config.WEBHOOK_SECRET,
+                    max_connections=config.WEBHOOK_MAX_CONNECTIONS
+                )
+            else:
+                logger.info("[OK] Bot is ready and listening for commands!")
+                app.run_polling()
             
         except Exception as e:
             logger.error(f"[ERROR] Critical error: {str(e)}")
@@ -1,21 +1,19 @@
 from telegram import Update
 from telegram.ext import CallbackContext   
 import time
-from database import Database
-
-db = Database()
+from database import get_database
 
 async def test(update: Update, context: CallbackContext):
     # Log the command
     user = update.effective_user
-    db.log_command(user.id, "test", "")
+    get_database().log_command(user.id, "test", "")
     
     await update.message.reply_text("✅ Test command is working!")      
 
 async def ping(update: Update, context: CallbackContext):
     # Log the command
     user = update.effective_user
-    db.log_command(user.id, "ping", "")
+    get_database().log_command(user.id, "ping", "")
     
     start_time = time.time()
     message = await update.message.reply_text("Pinging... ⏳")
@@ -7,6 +7,83 @@ load_dotenv()
 # Bot token
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
+# Log file format: "text" (default) or "json" for one JSON object per line
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+
 # Admin IDs as a list of integers
 ADMIN_IDS = [int(id.strip()) for id in os.getenv('ADMIN_IDS', '').split(',')]
 
+# Storage backend: "sqlite" (default, bot_data.db) or "mongodb" to share data across dynos
+DB_BACKEND = os.getenv('DB_BACKEND', 'sqlite').lower()
+MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
+MONGODB_DATABASE = os.getenv('MONGODB_DATABASE', 'ignitebot')
+
+# History older than RETENTION_DAYS is folded into daily aggregates and moved to
+# gzip CSV files in ARCHIVE_DIR every RETENTION_INTERVAL_HOURS (SQLite only), 0 keeps everything
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', '0'))
+RETENTION_INTERVAL_HOURS = float(os.getenv('RETENTION_INTERVAL_HOURS', '24'))
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', '2000'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+
+# Write-behind batching for logging writes
+WRITE_FLUSH_INTERVAL_MS = int(os.getenv('WRITE_FLUSH_INTERVAL_MS', '50'))
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '500'))
+
+# Rows kept while the database can't be written, and failed flushes of the same rows
+# before they are dropped
+WRITE_MAX_PENDING = int(os.getenv('WRITE_MAX_PENDING', '100000'))
+WRITE_MAX_RETRIES = int(os.getenv('WRITE_MAX_RETRIES', '20'))
+
+# Users whose profile is kept in memory, and how often the commands_used and
+# last_seen of repeat users are written
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+USER_FLUSH_INTERVAL = float(os.getenv('USER_FLUSH_INTERVAL', '5'))
+
+# Read-only SQLite connections used for queries
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', '4'))
+
+# Rendered QR codes kept in memory
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '256'))
+
+# QR rendering process pool and how many renders may wait for it
+QR_RENDER_WORKERS = int(os.getenv('QR_RENDER_WORKERS', '2'))
+QR_RENDER_BACKLOG = int(os.getenv('QR_RENDER_BACKLOG', str(QR_RENDER_WORKERS * 8)))
+
+# Largest /qrbatch request, in codes and in uploaded file size
+QR_BATCH_MAX = int(os.getenv('QR_BATCH_MAX', '100'))
+QR_BATCH_MAX_FILE_BYTES = int(os.getenv('QR_BATCH_MAX_FILE_BYTES', str(256 * 1024)))
+
+# How updates arrive: "polling" (default) or "webhook"
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+
+# Webhook settings, PORT is provided by Heroku for web dynos
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+PORT = int(os.getenv('PORT', '8443'))
+
+# Updates handled at the same time, updates from one chat always run in order
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+
+# Handler slots (out of CONCURRENT_UPDATES) for io and cpu cost commands and the waiting
+# updates each cost class may queue before users get a "busy, try again" reply
+IO_CONCURRENCY = int(os.getenv('IO_CONCURRENCY', str(max(1, CONCURRENT_UPDATES * 3 // 4))))
+CPU_CONCURRENCY = int(os.getenv('CPU_CONCURRENCY', str(QR_RENDER_WORKERS * 2)))
+CLASS_QUEUE_SIZE = int(os.getenv('CLASS_QUEUE_SIZE', '64'))
+
+# Broadcast delivery rate (Telegram allows about 30 messages/s) and requests in flight
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '8'))
+
+# Updates a user may send per period (seconds) before flood control rejects them, admins are exempt
+FLOOD_USER_CALLS = int(os.getenv('FLOOD_USER_CALLS', '30'))
+FLOOD_USER_PERIOD = float(os.getenv('FLOOD_USER_PERIOD', '60'))
+
+# Errors are grouped by type and code location and sent to admins once per interval (seconds)
+ERROR_DIGEST_INTERVAL = float(os.getenv('ERROR_DIGEST_INTERVAL', '60'))
+
+# Local Prometheus endpoint serving GET /metrics, METRICS_PORT=0 turns it off
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9091'))
@@ -1,159 +1,831 @@
-import os
+import queue
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
 import sqlite3
+import config
 from logger import logger
+from stats import StatsRollup, REBUILD_STATS_SQL, REBUILD_HOURS_SQL
+from metrics import instrument_methods
+from storage import EXPORT_COLUMNS, Storage, UserCache, WriteBehindQueue, keyset_page, with_pending_activity
 
-class Database:
-    def __init__(self):
+DB_PATH = 'bot_data.db'
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version
+MIGRATIONS = [
+    # 1: base tables
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_seen DATETIME,
+        commands_used INTEGER DEFAULT 0,
+        join_date DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS command_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        command TEXT,
+        args TEXT,
+        timestamp DATETIME,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS qr_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        text_content TEXT,
+        timestamp DATETIME,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    );
+    ''',
+    # 2: indexes for the history, today and user list queries
+    '''
+    CREATE INDEX IF NOT EXISTS idx_command_history_user_ts
+        ON command_history (user_id, timestamp DESC);
+    CREATE INDEX IF NOT EXISTS idx_qr_history_user_ts
+        ON qr_history (user_id, timestamp DESC);
+    CREATE INDEX IF NOT EXISTS idx_command_history_ts
+        ON command_history (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_users_last_seen
+        ON users (last_seen);
+    ''',
+    # 3: per-day rollup behind /stats, backfilled from existing history
+    '''
+    CREATE TABLE IF NOT EXISTS daily_stats (
+        day TEXT PRIMARY KEY,
+        new_users INTEGER NOT NULL DEFAULT 0,
+        active_users INTEGER NOT NULL DEFAULT 0,
+        commands INTEGER NOT NULL DEFAULT 0,
+        qr_codes INTEGER NOT NULL DEFAULT 0
+    );
+    ''' + REBUILD_STATS_SQL,
+    # 4: Telegram file_id of every rendered QR code, keyed by content hash
+    '''
+    CREATE TABLE IF NOT EXISTS qr_file_cache (
+        cache_key TEXT PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        created_at DATETIME
+    );
+    ''',
+    # 5: id in the history index so keyset pages on (timestamp, id) need no sort
+    '''
+    CREATE INDEX IF NOT EXISTS idx_command_history_user_ts_id
+        ON command_history (user_id, timestamp DESC, id DESC);
+    DROP INDEX IF EXISTS idx_command_history_user_ts;
+    ''',
+    # 6: broadcasts and the delivery state of every recipient, so restarts resume them
+    '''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        admin_id INTEGER,
+        text TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        total INTEGER NOT NULL DEFAULT 0,
+        chat_id INTEGER,
+        message_id INTEGER,
+        created_at DATETIME,
+        finished_at DATETIME
+    );
+
+    CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        broadcast_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        error TEXT,
+        PRIMARY KEY (broadcast_id, user_id)
+    ) WITHOUT ROWID;
+    ''',
+    # 7: what the retention job keeps of archived history: commands per day and
+    # command, QR codes per user, and the cutoff of every run
+    '''
+    CREATE TABLE IF NOT EXISTS command_daily (
+        day TEXT NOT NULL,
+        command TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, command)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS qr_archived (
+        user_id INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS archive_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cutoff_day TEXT NOT NULL,
+        commands INTEGER NOT NULL DEFAULT 0,
+        qr_codes INTEGER NOT NULL DEFAULT 0,
+        reclaimed_pages INTEGER NOT NULL DEFAULT 0,
+        started_at DATETIME,
+        finished_at DATETIME
+    );
+    ''',
+    # 8: full-text indexes behind /search, kept in sync by triggers and backfilled
+    # here. The text of /qr is indexed from qr_history only, its command_history
+    # row holds the same text. History rows are never updated, only deleted.
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS qr_search USING fts5(
+        text_content, content='qr_history', content_rowid='id'
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS command_search USING fts5(
+        args, content='command_history', content_rowid='id'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS qr_search_insert AFTER INSERT ON qr_history BEGIN
+        INSERT INTO qr_search (rowid, text_content) VALUES (new.id, new.text_content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS qr_search_delete AFTER DELETE ON qr_history BEGIN
+        INSERT INTO qr_search (qr_search, rowid, text_content)
+        VALUES ('delete', old.id, old.text_content);
+    END;
+    CREATE TRIGGER IF NOT EXISTS command_search_insert AFTER INSERT ON command_history
+    WHEN new.command <> 'qr' BEGIN
+        INSERT INTO command_search (rowid, args) VALUES (new.id, new.args);
+    END;
+    CREATE TRIGGER IF NOT EXISTS command_search_delete AFTER DELETE ON command_history
+    WHEN old.command <> 'qr' BEGIN
+        INSERT INTO command_search (command_search, rowid, args) VALUES ('delete', old.id, old.args);
+    END;
+
+    INSERT INTO qr_search (rowid, text_content) SELECT id, text_content FROM qr_history;
+    INSERT INTO command_search (rowid, args) SELECT id, args FROM command_history WHERE command <> 'qr';
+    ''',
+    # 9: commands per hour and command behind /activity, backfilled from the
+    # history still in the database and kept like daily_stats from then on
+    '''
+    CREATE TABLE IF NOT EXISTS command_hourly (
+        hour TEXT NOT NULL,
+        command TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, command)
+    ) WITHOUT ROWID;
+    ''' + REBUILD_HOURS_SQL,
+    # 10: timestamp index for the retention job, command_history has one since 2
+    '''
+    CREATE INDEX IF NOT EXISTS idx_qr_history_ts
+        ON qr_history (timestamp);
+    ''',
+    # 11: command_hourly keeps the commands per command of archived history, so
+    # command_daily is folded into it. Days archived before migration 9 have no
+    # hourly counts, theirs are stored in the first hour of the day.
+    '''
+    INSERT INTO command_hourly (hour, command, count)
+        SELECT day || ' 00', command, count
+        FROM command_daily
+        WHERE day < (SELECT COALESCE(MIN(substr(hour, 1, 10)), '9999') FROM command_hourly);
+    DROP TABLE command_daily;
+    ''',
+]
+
+# Read queries, kept here so check_query_plans() sees exactly what the methods run
+USER_HISTORY_QUERY = '''
+    SELECT command, args, timestamp
+    FROM command_history
+    WHERE user_id = ?
+    ORDER BY timestamp DESC
+'''
+
+# QR codes already moved to the archive by the retention job are counted in qr_archived
+USER_STATS_QUERY = '''
+    SELECT
+        u.username,
+        u.first_name,
+        u.commands_used,
+        u.join_date,
+        u.last_seen,
+        (SELECT COUNT(*) FROM qr_history q WHERE q.user_id = u.user_id)
+            + COALESCE((SELECT a.count FROM qr_archived a WHERE a.user_id = u.user_id), 0)
+            AS qr_codes_generated
+    FROM users u
+    WHERE u.user_id = ?
+'''
+
+QR_HISTORY_QUERY = '''
+    SELECT text_content, timestamp
+    FROM qr_history
+    WHERE user_id = ?
+    ORDER BY timestamp DESC
+'''
+
+ALL_USERS_QUERY = '''
+    SELECT user_id, username, first_name, last_seen
+    FROM users
+    ORDER BY last_seen DESC
+'''
+
+# Keyset pages: rows strictly after the cursor, in the direction being paged
+FIRST_USERS_PAGE_QUERY = '''
+    SELECT user_id, username, first_name, last_seen
+    FROM users
+    ORDER BY last_seen DESC, user_id DESC
+    LIMIT ?
+'''
+
+USERS_PAGE_QUERY = '''
+    SELECT user_id, username, first_name, last_seen
+    FROM users
+    WHERE (last_seen, user_id) < (?, ?)
+    ORDER BY last_seen DESC, user_id DESC
+    LIMIT ?
+'''
+
+USERS_PAGE_NEWER_QUERY = '''
+    SELECT user_id, username, first_name, last_seen
+    FROM users
+    WHERE (last_seen, user_id) > (?, ?)
+    ORDER BY last_seen ASC, user_id ASC
+    LIMIT ?
+'''
+
+FIRST_USER_HISTORY_PAGE_QUERY = '''
+    SELECT id, command, args, timestamp
+    FROM command_history
+    WHERE user_id = ?
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+'''
+
+USER_HISTORY_PAGE_QUERY = '''
+    SELECT id, command, args, timestamp
+    FROM command_history
+    WHERE user_id = ? AND (timestamp, id) < (?, ?)
+    ORDER BY timestamp DESC, id DESC
+    LIMIT ?
+'''
+
+USER_HISTORY_PAGE_NEWER_QUERY = '''
+    SELECT id, command, args, timestamp
+    FROM command_history
+    WHERE user_id = ? AND (timestamp, id) > (?, ?)
+    ORDER BY timestamp ASC, id ASC
+    LIMIT ?
+'''
+
+PENDING_RECIPIENTS_QUERY = '''
+    SELECT user_id
+    FROM broadcast_recipients
+    WHERE broadcast_id = ? AND user_id > ? AND status = 'pending'
+    ORDER BY user_id
+    LIMIT ?
+'''
+
+BROADCAST_COUNTS_QUERY = '''
+    SELECT status, COUNT(*)
+    FROM broadcast_recipients
+    WHERE broadcast_id = ?
+    GROUP BY status
+'''
+
+COUNT_USERS_QUERY = 'SELECT COUNT(*) FROM users'
+COUNT_USER_HISTORY_QUERY = 'SELECT COUNT(*) FROM command_history WHERE user_id = ?'
+COMMANDS_SINCE_QUERY = 'SELECT COUNT(*) FROM command_history WHERE timestamp >= ?'
+ACTIVE_USERS_SINCE_QUERY = 'SELECT COUNT(DISTINCT user_id) FROM users WHERE last_seen >= ?'
+
+COMMAND_HOURS_QUERY = 'SELECT hour, command, count FROM command_hourly WHERE hour >= ? AND hour < ?'
+
+# Seconds a search may spend ranking before it is interrupted, a word found in
+# most rows would otherwise keep a reader busy scoring every one of them
+SEARCH_TIMEOUT = 5
+
+# /search over both full-text indexes, best bm25 match first. Rows are
+# (source, id, user_id, text, timestamp, score), source is "qr" or the command.
+# Each index hands over only its best :end matches (ORDER BY rank LIMIT keeps
+# a small heap instead of sorting), so common words don't join every match.
+SEARCH_QUERY = '''
+    SELECT 'qr' AS source, h.id, h.user_id, h.text_content, h.timestamp, m.score
+    FROM (
+        SELECT rowid, rank AS score FROM qr_search
+        WHERE qr_search MATCH :query ORDER BY rank LIMIT :end
+    ) m JOIN qr_history h ON h.id = m.rowid
+    UNION ALL
+    SELECT h.command, h.id, h.user_id, h.args, h.timestamp, m.score
+    FROM (
+        SELECT rowid, rank AS score FROM command_search
+        WHERE command_search MATCH :query ORDER BY rank LIMIT :end
+    ) m JOIN command_history h ON h.id = m.rowid
+    ORDER BY score, id DESC
+    LIMIT :limit OFFSET :offset
+'''
+
+# The same for one user, whose rows have to be picked out before the limit
+USER_SEARCH_QUERY = '''
+    SELECT 'qr' AS source, h.id, h.user_id, h.text_content, h.timestamp, qr_search.rank AS score
+    FROM qr_search JOIN qr_history h ON h.id = qr_search.rowid
+    WHERE qr_search MATCH :query AND h.user_id = :user_id
+    UNION ALL
+    SELECT h.command, h.id, h.user_id, h.args, h.timestamp, command_search.rank
+    FROM command_search JOIN command_history h ON h.id = command_search.rowid
+    WHERE command_search MATCH :query AND h.user_id = :user_id
+    ORDER BY score, id DESC
+    LIMIT :limit OFFSET :offset
+'''
+
+# Retention batches, oldest first along the timestamp index so a run never reads newer rows
+ARCHIVE_QUERIES = {
+    "command_history": '''
+        SELECT id, user_id, command, args, timestamp
+        FROM command_history
+        WHERE timestamp < ? AND (timestamp, id) > (?, ?)
+        ORDER BY timestamp, id
+        LIMIT ?
+    ''',
+    "qr_history": '''
+        SELECT id, user_id, text_content, timestamp
+        FROM qr_history
+        WHERE timestamp < ? AND (timestamp, id) > (?, ?)
+        ORDER BY timestamp, id
+        LIMIT ?
+    ''',
+}
+
+# /export name -> table
+EXPORT_TABLES = {"users": "users", "commands": "command_history", "qr": "qr_history"}
+
+# (name, query, sample params, full_scan) for every read path that has to stay indexed.
+# Queries marked full_scan read the whole table by design but must still walk an index.
+QUERY_PLAN_CHECKS = [
+    ("get_user_history", USER_HISTORY_QUERY, (1,), False),
+    ("get_user_stats", USER_STATS_QUERY, (1,), False),
+    ("get_qr_history", QR_HISTORY_QUERY, (1,), False),
+    ("get_all_users", ALL_USERS_QUERY, (), True),
+    ("get_users_page/first", FIRST_USERS_PAGE_QUERY, (20,), True),
+    ("get_users_page", USERS_PAGE_QUERY, ('', 0, 20), False),
+    ("get_users_page/newer", USERS_PAGE_NEWER_QUERY, ('', 0, 20), False),
+    ("get_user_history_page/first", FIRST_USER_HISTORY_PAGE_QUERY, (1, 5), False),
+    ("get_user_history_page", USER_HISTORY_PAGE_QUERY, (1, '', 0, 5), False),
+    ("get_user_history_page/newer", USER_HISTORY_PAGE_NEWER_QUERY, (1, '', 0, 5), False),
+    ("count_users", COUNT_USERS_QUERY, (), True),
+    ("count_user_history", COUNT_USER_HISTORY_QUERY, (1,), False),
+    ("get_commands_today", COMMANDS_SINCE_QUERY, (datetime.min,), False),
+    ("get_active_users_today", ACTIVE_USERS_SINCE_QUERY, (datetime.min,), False),
+    ("get_command_hours", COMMAND_HOURS_QUERY, ('', ''), False),
+    ("get_pending_recipients", PENDING_RECIPIENTS_QUERY, (1, 0, 500), False),
+    ("get_broadcast_counts", BROADCAST_COUNTS_QUERY, (1,), False),
+    ("retention/command_history", ARCHIVE_QUERIES["command_history"], ('', '', 0, 500), False),
+    ("retention/qr_history", ARCHIVE_QUERIES["qr_history"], ('', '', 0, 500), False),
+]
+
+@instrument_methods("db", exclude=("start", "close", "retryable"))
+class Database(Storage):
+    """SQLite storage with one writer connection and a pool of WAL readers
+
+    Every query runs in a thread executor so the event loop never waits on SQLite.
+    Use get_database() instead of creating instances directly.
+    """
+
+    RETRY_ERRORS = (sqlite3.OperationalError,)
+    WRITE_ERRORS = (sqlite3.Error,)
+
+    def retryable(self, error):
+        # OperationalError also covers a missing table, I/O errors and a corrupt file
+        code = getattr(error, 'sqlite_errorcode', None) or 0
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+
+    def __init__(self, path=DB_PATH, read_pool_size=None):
+        self.path = path
+        self.read_pool_size = read_pool_size or config.DB_READ_POOL_SIZE
         try:
-            self.conn = sqlite3.connect('bot_data.db', detect_types=sqlite3.PARSE_DECLTYPES)
+            # The writer connection is only ever used under _write_lock
+            self.conn = self._connect()
+            if self.conn.execute('PRAGMA user_version').fetchone()[0] == 0:
+                # Only takes effect on a new file, before WAL and the first table
+                self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
             self.cursor = self.conn.cursor()
-            self._setup_sqlite_tables()
+            self._migrate()
+
+            # /stats counters, kept current by write_batch()
+            self.stats = StatsRollup()
+            self.stats.load(self.conn)
+
+            # Readers open the file read-only so they never take the write lock
+            self._read_conns = queue.SimpleQueue()
+            for _ in range(self.read_pool_size):
+                self._read_conns.put(self._connect(read_only=True))
         except sqlite3.Error as e:
             logger.error(f"SQLite initialization error: {e}")
             raise
 
-    def _setup_sqlite_tables(self):
-        self.cursor.executescript('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_seen DATETIME,
-                commands_used INTEGER DEFAULT 0,
-                join_date DATETIME DEFAULT CURRENT_TIMESTAMP
-            );
-
-            CREATE TABLE IF NOT EXISTS command_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                command TEXT,
-                args TEXT,
-                timestamp DATETIME,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            );
-
-            CREATE TABLE IF NOT EXISTS qr_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                text_content TEXT,
-                timestamp DATETIME,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            );
-        ''')
-        self.conn.commit()
+        self._write_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(
+            max_workers=self.read_pool_size,
+            thread_name_prefix='db-reader'
+        )
+        self.write_queue = WriteBehindQueue(
+            self,
+            flush_interval_ms=config.WRITE_FLUSH_INTERVAL_MS,
+            max_batch=config.WRITE_BATCH_SIZE,
+            max_pending=config.WRITE_MAX_PENDING,
+            max_retries=config.WRITE_MAX_RETRIES
+        )
+        self.user_cache = UserCache(self, config.USER_CACHE_SIZE, config.USER_FLUSH_INTERVAL)
+
+    def _connect(self, read_only=False):
+        if read_only:
+            return sqlite3.connect(
+                f'file:{self.path}?mode=ro',
+                uri=True,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                check_same_thread=False
+            )
+        return sqlite3.connect(
+            self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False
+        )
+
+    def _migrate(self):
+        """Bring the schema up to the latest version"""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Applying database migration {number}")
+            # executescript commits on its own, so the version bump shares the transaction
+            self.conn.executescript(
+                f"BEGIN; {script}\nPRAGMA user_version = {number}; COMMIT;"
+            )
+
+    def check_query_plans(self):
+        """Return (name, plan detail) for every checked query that scans a table"""
+        problems = []
+        with self._write_lock:
+            for name, sql, params, full_scan in QUERY_PLAN_CHECKS:
+                for row in self.conn.execute(f'EXPLAIN QUERY PLAN {sql}', params):
+                    detail = row[3]
+                    # A temp b-tree means no index matched the ORDER BY
+                    if 'TEMP B-TREE FOR' in detail and 'ORDER BY' in detail:
+                        problems.append((name, detail))
+                    elif detail.startswith('SCAN') and (not full_scan or 'INDEX' not in detail):
+                        problems.append((name, detail))
+        return problems
+
+    async def start(self):
+        """Start background work that needs a running event loop"""
+        loop = asyncio.get_running_loop()
+        for name, detail in await loop.run_in_executor(self._writer, self.check_query_plans):
+            logger.warning(f"Query plan regression in {name}: {detail}")
+        self.write_queue.start()
+        self.user_cache.start()
+
+    async def close(self):
+        """Flush pending writes and release every connection"""
+        await self.user_cache.stop()
+        await self.write_queue.stop()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        while not self._read_conns.empty():
+            self._read_conns.get().close()
+        self.conn.close()
+        logger.info("Database connections closed")
+
+    def _run_locked(self, func, args):
+        with self._write_lock:
+            return func(self.conn, *args)
+
+    def _run_read(self, func, args):
+        conn = self._read_conns.get()
+        try:
+            return func(conn.cursor(), *args)
+        finally:
+            self._read_conns.put(conn)
+
+    async def run_write(self, func, *args):
+        """Run func(conn, *args) on the writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._run_locked, func, args)
+
+    async def run_read(self, func, *args):
+        """Run func(cursor, *args) on a pooled read-only connection"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, func, args)
+
+    async def _fetchone(self, sql, params=()):
+        return await self.run_read(lambda cursor: cursor.execute(sql, params).fetchone())
+
+    async def _fetchall(self, sql, params=()):
+        return await self.run_read(lambda cursor: cursor.execute(sql, params).fetchall())
+
+    def write_batch(self, conn, batch):
+        """Execute queued (sql, params, event) rows and their stats in one transaction"""
+        events = [event for _, _, event in batch if event is not None]
+        with conn:
+            deltas = self.stats.collect(conn, events)
+            # Consecutive rows for the same statement go in one executemany
+            for sql, rows in groupby(batch, key=itemgetter(0)):
+                conn.executemany(sql, [params for _, params, _ in rows])
+            self.stats.persist(conn, deltas)
+            self.stats.persist_hours(conn, self.stats.command_hours(events))
+        self.stats.apply(deltas)
+
+    def _write(self, sql, params, event=None):
+        # Go through the write-behind queue once the bot is running
+        if self.write_queue.running:
+            self.write_queue.put(sql, params, event)
+        else:
+            with self._write_lock:
+                self.write_batch(self.conn, [(sql, params, event)])
+
+    def _write_many(self, sql, rows, event=None):
+        # Queued rows for one statement are flushed as a single executemany
+        if self.write_queue.running:
+            self.write_queue.put_many(sql, rows, event)
+        else:
+            with self._write_lock:
+                self.write_batch(self.conn, [(sql, params, event) for params in rows])
 
     def add_or_update_user(self, user_id, username, first_name):
-        self.cursor.execute('''
-            INSERT INTO users (user_id, username, first_name, last_seen, commands_used)
-            VALUES (?, ?, ?, ?, 1)
+        # Repeat users with an unchanged profile are written every USER_FLUSH_INTERVAL
+        self.user_cache.touch(user_id, username, first_name)
+
+    def write_user(self, user_id, username, first_name, commands, last_seen):
+        self._write('''
+            INSERT INTO users (user_id, username, first_name, last_seen, commands_used, join_date)
+            VALUES (?, ?, ?, ?, ?, ?)
             ON CONFLICT(user_id) DO UPDATE SET
-                username = ?,
-                first_name = ?,
-                last_seen = ?,
-                commands_used = commands_used + 1
-        ''', (user_id, username, first_name, datetime.now(),
-              username, first_name, datetime.now()))
-        self.conn.commit()
+                username = excluded.username,
+                first_name = excluded.first_name,
+                last_seen = excluded.last_seen,
+                commands_used = commands_used + excluded.commands_used
+        ''', (user_id, username, first_name, last_seen, commands, last_seen),
+            ("user", user_id, last_seen))
 
     def log_command(self, user_id, command, args):
-        self.cursor.execute('''
+        now = datetime.now()
+        self._write('''
         INSERT INTO command_history (user_id, command, args, timestamp)
         VALUES (?, ?, ?, ?)
-        ''', (user_id, command, args, datetime.now()))
-        self.conn.commit()
+        ''', (user_id, command, args, now), ("command", command, now))
 
     def log_qr_generation(self, user_id, text_content):
-        self.cursor.execute('''
+        now = datetime.now()
+        self._write('''
+        INSERT INTO qr_history (user_id, text_content, timestamp)
+        VALUES (?, ?, ?)
+        ''', (user_id, text_content, now), ("qr", now))
+
+    def log_qr_batch(self, user_id, texts):
+        """Record a whole /qrbatch in qr_history with one executemany"""
+        now = datetime.now()
+        self._write_many('''
         INSERT INTO qr_history (user_id, text_content, timestamp)
         VALUES (?, ?, ?)
-        ''', (user_id, text_content, datetime.now()))
-        self.conn.commit()
-
-    def get_user_history(self, user_id):
-        self.cursor.execute('''
-        SELECT command, args, timestamp 
-        FROM command_history 
-        WHERE user_id = ? 
-        ORDER BY timestamp DESC
-        ''', (user_id,))
-        return self.cursor.fetchall()
-
-    def get_user_stats(self, user_id):
+        ''', [(user_id, text, now) for text in texts], ("qr", now))
+
+    def save_qr_file_id(self, cache_key, file_id):
+        self._write('''
+        INSERT OR REPLACE INTO qr_file_cache (cache_key, file_id, created_at)
+        VALUES (?, ?, ?)
+        ''', (cache_key, file_id, datetime.now()))
+
+    def delete_qr_file_id(self, cache_key):
+        self._write('DELETE FROM qr_file_cache WHERE cache_key = ?', (cache_key,))
+
+    async def get_qr_file_id(self, cache_key):
+        row = await self._fetchone(
+            'SELECT file_id FROM qr_file_cache WHERE cache_key = ?', (cache_key,)
+        )
+        return row[0] if row else None
+
+    async def get_qr_file_ids(self, cache_keys):
+        """Return {cache_key: file_id} for the keys that have one"""
+        if not cache_keys:
+            return {}
+        placeholders = ', '.join('?' * len(cache_keys))
+        rows = await self._fetchall(
+            f'SELECT cache_key, file_id FROM qr_file_cache WHERE cache_key IN ({placeholders})',
+            tuple(cache_keys)
+        )
+        return dict(rows)
+
+    async def create_broadcast(self, admin_id, text):
+        """Store a broadcast addressed to every current user, return (id, total)"""
+        # Users seen in the last few seconds may still be queued
+        await self.user_cache.sync()
+
+        def create(conn):
+            with conn:
+                broadcast_id = conn.execute('''
+                INSERT INTO broadcasts (admin_id, text, created_at)
+                VALUES (?, ?, ?)
+                ''', (admin_id, text, datetime.now())).lastrowid
+                total = conn.execute('''
+                INSERT INTO broadcast_recipients (broadcast_id, user_id)
+                SELECT ?, user_id FROM users
+                ''', (broadcast_id,)).rowcount
+                conn.execute(
+                    'UPDATE broadcasts SET total = ? WHERE id = ?', (total, broadcast_id)
+                )
+            return broadcast_id, total
+
+        return await self.run_write(create)
+
+    def set_broadcast_message(self, broadcast_id, chat_id, message_id):
+        """Remember the admin message that shows the progress of a broadcast"""
+        self._write(
+            'UPDATE broadcasts SET chat_id = ?, message_id = ? WHERE id = ?',
+            (chat_id, message_id, broadcast_id)
+        )
+
+    def mark_broadcast_recipient(self, broadcast_id, user_id, status, error=None):
+        self._write('''
+        UPDATE broadcast_recipients SET status = ?, error = ?
+        WHERE broadcast_id = ? AND user_id = ?
+        ''', (status, error, broadcast_id, user_id))
+
+    def finish_broadcast(self, broadcast_id, status):
+        self._write(
+            'UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?',
+            (status, datetime.now(), broadcast_id)
+        )
+
+    async def get_running_broadcasts(self):
+        return await self._fetchall('''
+            SELECT id, text, total, chat_id, message_id
+            FROM broadcasts
+            WHERE status = 'running'
+            ORDER BY id
+        ''')
+
+    async def get_pending_recipients(self, broadcast_id, after_user_id=0, limit=500):
+        """Return up to limit user_ids still waiting for the broadcast, after after_user_id"""
+        rows = await self._fetchall(PENDING_RECIPIENTS_QUERY, (broadcast_id, after_user_id, limit))
+        return [row[0] for row in rows]
+
+    async def get_broadcast_counts(self, broadcast_id):
+        """Return {status: recipients} for a broadcast"""
+        return dict(await self._fetchall(BROADCAST_COUNTS_QUERY, (broadcast_id,)))
+
+    async def get_user_history(self, user_id):
+        return await self._fetchall(USER_HISTORY_QUERY, (user_id,))
+
+    async def get_user_stats(self, user_id):
         try:
-            self.cursor.execute('''
-            SELECT 
-                u.username,
-                u.first_name,
-                u.commands_used,
-                u.join_date,
-                u.last_seen,
-                COUNT(DISTINCT q.id) as qr_codes_generated
-            FROM users u
-            LEFT JOIN qr_history q ON u.user_id = q.user_id
-            WHERE u.user_id = ?
-            GROUP BY u.user_id
-            ''', (user_id,))
-            return self.cursor.fetchone()
+            row = await self._fetchone(USER_STATS_QUERY, (user_id,))
         except sqlite3.Error as e:
             logger.error(f"Database error in get_user_stats: {e}")
             raise
+        return with_pending_activity(row, self.user_cache.pending_activity(user_id))
 
-    def get_qr_history(self, user_id):
-        self.cursor.execute('''
-        SELECT text_content, timestamp
-        FROM qr_history
-        WHERE user_id = ?
-        ORDER BY timestamp DESC
-        ''', (user_id,))
-        return self.cursor.fetchall()
-
-    def get_all_users(self):
-        self.cursor.execute('''
-        SELECT user_id, username, first_name, last_seen
-        FROM users
-        ORDER BY last_seen DESC
-        ''')
-        return self.cursor.fetchall()
+    async def get_users_page(self, cursor=None, limit=20, newer=False):
+        """Page through users by last_seen DESC, user_id DESC without OFFSET
+
+        cursor is the (last_seen, user_id) of the row to continue from, None for
+        the first page. With newer=True the page before the cursor is returned.
+        Returns (rows, has_more) where has_more says whether paging further in
+        the same direction would return anything.
+        """
+        if cursor is None:
+            rows = await self._fetchall(FIRST_USERS_PAGE_QUERY, (limit + 1,))
+        else:
+            query = USERS_PAGE_NEWER_QUERY if newer else USERS_PAGE_QUERY
+            rows = await self._fetchall(query, (*cursor, limit + 1))
+        return keyset_page(rows, limit, newer)
+
+    async def get_user_history_page(self, user_id, cursor=None, limit=5, newer=False):
+        """Page through a user's commands by timestamp DESC, id DESC
+
+        Rows are (id, command, args, timestamp) and the cursor is (timestamp, id).
+        Returns (rows, has_more) like get_users_page().
+        """
+        if cursor is None:
+            rows = await self._fetchall(FIRST_USER_HISTORY_PAGE_QUERY, (user_id, limit + 1))
+        else:
+            query = USER_HISTORY_PAGE_NEWER_QUERY if newer else USER_HISTORY_PAGE_QUERY
+            rows = await self._fetchall(query, (user_id, *cursor, limit + 1))
+        return keyset_page(rows, limit, newer)
+
+    async def count_users(self):
+        row = await self._fetchone(COUNT_USERS_QUERY)
+        return row[0]
+
+    async def count_user_history(self, user_id):
+        row = await self._fetchone(COUNT_USER_HISTORY_QUERY, (user_id,))
+        return row[0]
+
+    async def get_qr_history(self, user_id):
+        return await self._fetchall(QR_HISTORY_QUERY, (user_id,))
+
+    async def search_history(self, query, user_id=None, limit=10, offset=0):
+        """Full-text search of QR texts and command arguments, SQLite only
+
+        query uses FTS5 syntax, see fts_query(). Ranked results have no stable
+        keyset, so pages are taken with OFFSET; bm25 has to score every match
+        either way. Returns ([(source, id, user_id, text, timestamp)], has_more).
+        Raises sqlite3.OperationalError ("interrupted") after SEARCH_TIMEOUT.
+        """
+        # Rows written in the last few milliseconds may still be queued
+        await self.write_queue.flush()
+        sql = SEARCH_QUERY if user_id is None else USER_SEARCH_QUERY
+        params = {
+            "query": query, "user_id": user_id,
+            "limit": limit + 1, "offset": offset, "end": offset + limit + 1
+        }
+
+        def search(cursor):
+            deadline = time.monotonic() + SEARCH_TIMEOUT
+            cursor.connection.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
+            try:
+                return cursor.execute(sql, params).fetchall()
+            finally:
+                cursor.connection.set_progress_handler(None, 0)
 
-    def get_total_qr_codes(self):
-        self.cursor.execute('SELECT COUNT(*) FROM qr_history')
-        return self.cursor.fetchone()[0]
+        rows = await self.run_read(search)
+        return [row[:5] for row in rows[:limit]], len(rows) > limit
 
-    def get_commands_today(self):
+    async def export(self, name, write_rows, since=None, until=None, chunk_size=1000):
+        # Rows written in the last few seconds may still be queued
+        await self.user_cache.sync()
+        columns = EXPORT_COLUMNS[name]
+        sql = f'SELECT {", ".join(columns)} FROM {EXPORT_TABLES[name]}'
+        conditions, params = [], []
+        if since:
+            conditions.append(f'{columns[-1]} >= ?')
+            params.append(since)
+        if until:
+            conditions.append(f'{columns[-1]} < ?')
+            params.append(until)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        def export(cursor):
+            cursor.execute(sql, params)
+            count = 0
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return count
+                write_rows(rows)
+                count += len(rows)
+
+        return await self.run_read(export)
+
+    async def get_all_users(self):
+        return await self._fetchall(ALL_USERS_QUERY)
+
+    async def get_command_hours(self, since, until):
+        # Commands of the last few milliseconds may still be queued
+        await self.write_queue.flush()
+        return await self._fetchall(
+            COMMAND_HOURS_QUERY, (since.strftime('%Y-%m-%d %H'), until.strftime('%Y-%m-%d %H'))
+        )
+
+    async def get_total_qr_codes(self):
+        return self.stats.snapshot()["total_qr_codes"]
+
+    async def get_commands_today(self):
         today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        self.cursor.execute('''
-            SELECT COUNT(*) FROM command_history 
-            WHERE timestamp > ?
-        ''', (today_start,))
-        return self.cursor.fetchone()[0]
+        row = await self._fetchone(COMMANDS_SINCE_QUERY, (today_start,))
+        return row[0]
 
-    def get_active_users_today(self):
+    async def get_active_users_today(self):
+        await self.user_cache.sync()
         today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        self.cursor.execute('''
-            SELECT COUNT(DISTINCT user_id) FROM users 
-            WHERE last_seen > ?
-        ''', (today_start,))
-        return self.cursor.fetchone()[0]
-
-    def get_stats(self):
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        self.cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = self.cursor.fetchone()[0]
-        
-        self.cursor.execute('SELECT COUNT(DISTINCT user_id) FROM users WHERE last_seen >= ?', (today,))
-        active_today = self.cursor.fetchone()[0]
-        
-        self.cursor.execute('SELECT COUNT(*) FROM command_history WHERE timestamp >= ?', (today,))
-        commands_today = self.cursor.fetchone()[0]
-        
-        self.cursor.execute('SELECT COUNT(*) FROM qr_history')
-        total_qr_codes = self.cursor.fetchone()[0]
-        
-        return {
-            "total_users": total_users,
-            "active_today": active_today,
-            "commands_today": commands_today,
-            "total_qr_codes": total_qr_codes
-        }
\ No newline at end of file
+        row = await self._fetchone(ACTIVE_USERS_SINCE_QUERY, (today_start,))
+        return row[0]
+
+    async def get_stats(self):
+        # Served from the in-memory rollup, no COUNT(*) on the history tables
+        await self.user_cache.sync()
+        return self.stats.snapshot()
+
+    async def rebuild_stats(self):
+        """Recompute the stats rollup from the base tables"""
+        await self.run_write(self.stats.rebuild)
+        return self.stats.snapshot()
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every word, "word*" matches a prefix
+
+    Every word is quoted, so FTS5 operators and punctuation in URLs are taken
+    literally: "paypal.com" matches the tokens paypal and com next to each other.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return ' '.join(terms)
+
+# Process-wide instance, created on first use
+_database = None
+
+def get_database():
+    """Return the shared storage backend selected by DB_BACKEND, creating it on first use"""
+    global _database
+    if _database is None:
+        if config.DB_BACKEND == "mongodb":
+            # pymongo is only imported when it is used
+            from mongo_database import MongoDatabase
+            _database = MongoDatabase(config.MONGODB_URI, config.MONGODB_DATABASE)
+        else:
+            _database = Database()
+    return _database
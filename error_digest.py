@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import os
+import traceback
+from datetime import datetime
+from telegram.error import RetryAfter, TelegramError
+from logger import logger
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+MAX_MESSAGE_LENGTH = 4000
+# Distinct users remembered per fingerprint and interval
+MAX_USERS = 1000
+
+def fingerprint(error):
+    """Return (id, description) of an error: its type and the innermost frame of our code"""
+    frame = None
+    tb = error.__traceback__
+    while tb is not None:
+        filename = tb.tb_frame.f_code.co_filename
+        # Library frames only count when the traceback never reaches our code
+        if frame is None or (filename.startswith(PROJECT_DIR) and 'site-packages' not in filename):
+            frame = tb
+        tb = tb.tb_next
+
+    error_type = type(error).__qualname__
+    if frame is None:
+        description = f"{error_type} (no traceback)"
+    else:
+        code = frame.tb_frame.f_code
+        filename = code.co_filename
+        if filename.startswith(PROJECT_DIR):
+            filename = os.path.relpath(filename, PROJECT_DIR)
+        description = f"{error_type} at {filename}:{frame.tb_lineno} in {code.co_name}"
+    return hashlib.sha1(description.encode()).hexdigest()[:8], description
+
+def _describe_update(update):
+    message = getattr(update, "effective_message", None)
+    user = getattr(update, "effective_user", None)
+    text = (message.text or message.caption or "") if message else ""
+    return f"{text[:200] or 'no text'} (user {user.id if user else 'unknown'})"
+
+class ErrorDigest:
+    """Counts errors by fingerprint and sends admins one message per fingerprint per interval
+
+    Only the first occurrence of a fingerprint in an interval formats its
+    traceback, repeats cost a dict lookup and a few counters.
+    """
+
+    def __init__(self, admin_ids, interval=60):
+        self.admin_ids = admin_ids
+        self.interval = interval
+        # fingerprint id -> occurrences since the last digest
+        self.pending = {}
+        self.total = 0
+        self.digests_sent = 0
+        self._bot = None
+        self._task = None
+
+    def record(self, error, update=None):
+        """Count error, return (fingerprint id, True if first in this interval)"""
+        error_id, description = fingerprint(error)
+        now = datetime.now()
+        self.total += 1
+        entry = self.pending.get(error_id)
+        first = entry is None
+        if first:
+            entry = self.pending[error_id] = {
+                "description": description,
+                "count": 0,
+                "first_seen": now,
+                "users": set(),
+                "message": f"{type(error).__name__}: {error}",
+                "traceback": "".join(traceback.format_exception(error)),
+                "update": _describe_update(update) if update else None
+            }
+        entry["count"] += 1
+        entry["last_seen"] = now
+        user = getattr(update, "effective_user", None)
+        if user and len(entry["users"]) < MAX_USERS:
+            entry["users"].add(user.id)
+        return error_id, first
+
+    def start(self, bot):
+        """Send digests from a background task every interval"""
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and send what is still pending"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error sending error digest: {e}")
+
+    async def flush(self):
+        """Send one message per pending fingerprint to every admin"""
+        if not self.pending or self._bot is None:
+            return
+        pending, self.pending = self.pending, {}
+        for error_id, entry in pending.items():
+            text = self.format_entry(error_id, entry)
+            for admin_id in self.admin_ids:
+                await self._send(admin_id, text)
+            self.digests_sent += 1
+
+    async def _send(self, chat_id, text):
+        for _ in range(2):
+            try:
+                await self._bot.send_message(chat_id=chat_id, text=text)
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except TelegramError as e:
+                logger.error(f"Failed to send error digest to admin {chat_id}: {e}")
+                return
+
+    def format_entry(self, error_id, entry):
+        header = f"❌ {entry['count']}× {entry['description']}\n"
+        header += f"ID: {error_id}\n"
+        header += f"Seen {entry['first_seen']:%H:%M:%S} - {entry['last_seen']:%H:%M:%S}"
+        if entry["users"]:
+            users = len(entry["users"])
+            header += f", {users}{'+' if users >= MAX_USERS else ''} users"
+        header += f"\n{entry['message'][:500]}\n"
+        if entry["update"]:
+            header += f"First update: {entry['update']}\n"
+        header += "\nSample traceback:\n"
+        # The innermost frames are the useful part when it has to be cut
+        room = MAX_MESSAGE_LENGTH - len(header)
+        sample = entry["traceback"]
+        if len(sample) > room:
+            sample = "…" + sample[-(room - 1):]
+        return header + sample
+
+    def stats(self):
+        return {
+            "total": self.total,
+            "pending": len(self.pending),
+            "digests_sent": self.digests_sent
+        }
@@ -0,0 +1,120 @@
+import time
+from collections import Counter
+from telegram import Update
+from telegram.ext import ContextTypes, ApplicationHandlerStop
+from logger import logger
+
+# Seconds between sweeps of buckets that have refilled completely
+SWEEP_INTERVAL = 60
+
+class FloodControl:
+    """Per-user and per-command rate limits checked before any plugin handler
+
+    Registered as a TypeHandler in group -1, so it sees every update first and
+    stops rejected ones with ApplicationHandlerStop. Buckets use GCRA, a token
+    bucket that stores a single float per user: the time at which the bucket
+    will be full again. A bucket whose time has passed holds no information,
+    so idle users are dropped by the periodic sweep and memory only grows with
+    the users active within one limit period.
+    """
+
+    def __init__(self, user_limit, exempt=()):
+        self.user_limit = user_limit
+        self.exempt = set(exempt)
+        # command name -> RateLimit, declared by the plugins
+        self.limits = {}
+        # None (the per-user limit) or command name -> {user_id: full at}
+        self._buckets = {None: {}}
+        # user_id -> time until which they were already told to slow down
+        self._warned = {}
+        self._last_sweep = time.monotonic()
+
+        # Counters shown to admins in /stats
+        self.rejected = Counter()
+
+    def set_limit(self, command, limit):
+        if limit is None:
+            return
+        self.limits[command] = limit
+        self._buckets.setdefault(command, {})
+
+    @property
+    def tracked_users(self):
+        return len(self._buckets[None])
+
+    def _next(self, key, limit, user_id, now):
+        """Return (seconds to wait, bucket state after taking a token)"""
+        interval = limit.period / limit.calls
+        full_at = max(self._buckets[key].get(user_id, now), now)
+        # Up to `calls` tokens may be taken at once before the bucket runs dry
+        return max(full_at + interval - limit.period - now, 0), full_at + interval
+
+    def _sweep(self, now):
+        for buckets in self._buckets.values():
+            for user_id in [user_id for user_id, full_at in buckets.items() if full_at <= now]:
+                del buckets[user_id]
+        for user_id in [user_id for user_id, until in self._warned.items() if until <= now]:
+            del self._warned[user_id]
+        self._last_sweep = now
+
+    @staticmethod
+    def _command(update):
+        message = update.effective_message
+        text = message and (message.text or message.caption)
+        if not text or not text.startswith('/'):
+            return None
+        return text.split(None, 1)[0][1:].split('@', 1)[0].lower()
+
+    def check(self, user_id, command=None):
+        """Return 0 if user_id may run command now, or how many seconds to wait"""
+        now = time.monotonic()
+        if now - self._last_sweep >= SWEEP_INTERVAL:
+            self._sweep(now)
+
+        keys = [(None, self.user_limit)]
+        if command in self.limits:
+            keys.append((command, self.limits[command]))
+
+        # Tokens are only taken when every bucket has one
+        updates = []
+        for key, limit in keys:
+            wait, full_at = self._next(key, limit, user_id, now)
+            if wait:
+                return wait
+            updates.append((key, full_at))
+        for key, full_at in updates:
+            self._buckets[key][user_id] = full_at
+        return 0
+
+    async def handle_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if user is None or user.id in self.exempt:
+            return
+
+        command = self._command(update)
+        wait = self.check(user.id, command)
+        if not wait:
+            return
+
+        self.rejected[f"/{command}" if command else "other"] += 1
+        now = time.monotonic()
+        # Tell the user once per streak, replying to every message would feed the flood
+        if self._warned.get(user.id, 0) <= now:
+            self._warned[user.id] = now + wait
+            logger.warning(f"Flood control: user {user.id} rejected for {wait:.1f}s ({command or 'update'})")
+            if update.callback_query:
+                await update.callback_query.answer(
+                    f"⏳ Slow down, try again in {int(wait) + 1}s.", show_alert=True
+                )
+            elif update.effective_message:
+                await update.effective_message.reply_text(
+                    f"⏳ Slow down! Try again in {int(wait) + 1} seconds."
+                )
+        raise ApplicationHandlerStop
+
+    def stats(self):
+        return {
+            "rejected": sum(self.rejected.values()),
+            "by_command": dict(self.rejected),
+            "tracked_users": self.tracked_users
+        }
@@ -1,20 +1,150 @@
+import atexit
+import gzip
+import json
 import logging
 import os
+import queue
+import re
+import shutil
 import sys
+import threading
+import time
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+import config
+
+# Current log file, rotated files are bot.log.<rotation time>.gz next to it
+LOG_DIR = 'logs'
+LOG_FILE = os.path.join(LOG_DIR, 'bot.log')
+LOG_MAX_BYTES = 10485760  # 10MB
+LOG_BACKUP_COUNT = 14
 
 # Create logs directory if it doesn't exist
-if not os.path.exists('logs'):
-    os.makedirs('logs')
+if not os.path.exists(LOG_DIR):
+    os.makedirs(LOG_DIR)
 
 class BotLogFilter(logging.Filter):
     def filter(self, record):
         # Filter out HTTP API calls and telegram updates
-        if any(text in record.getMessage() for text in ['HTTP Request:', 'api.telegram.org', 'getUpdates']):
+        message = record.getMessage()
+        if any(text in message for text in ['HTTP Request:', 'api.telegram.org', 'getUpdates']):
             return False
+        # Keep the merged message, so LocalQueueHandler.prepare() doesn't format it again
+        record.msg = message
+        record.args = None
         return True
 
+class LocalQueueHandler(QueueHandler):
+    """QueueHandler for a listener thread in the same process
+
+    The stock prepare() formats every record and copies it so it can be
+    pickled. Records here never leave the process, so only the message
+    arguments are merged (the caller may change them later) and the rest of
+    the formatting, tracebacks included, is left to the listener thread.
+    Records that went through BotLogFilter already have them merged.
+    """
+
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line"""
+
+    # Passed with extra={...} on calls that have them
+    FIELDS = ('user_id', 'command', 'latency_ms')
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class TimedSizeRotatingFileHandler(TimedRotatingFileHandler):
+    """Rotate the log at midnight and whenever it grows past max_bytes
+
+    Rotated files are named after the time they were rotated, since size
+    rotations can happen several times a day, and gzip-compressed on a
+    background thread so the listener thread never waits for it.
+    """
+
+    SUFFIX = '%Y-%m-%d_%H-%M-%S'
+
+    def __init__(self, filename, max_bytes, backup_count, encoding=None):
+        super().__init__(filename, when='midnight', backupCount=backup_count, encoding=encoding)
+        self.max_bytes = max_bytes
+        self.extMatch = re.compile(r'^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$', re.ASCII)
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._rotate
+        # Finish compressing files left behind by a previous run
+        for path in self._uncompressed():
+            self._compress_in_background(path, path + '.gz')
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return True
+        # The stream is flushed after every record, so the size on disk is current
+        return self.stream is not None and os.fstat(self.stream.fileno()).st_size >= self.max_bytes
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        base = f"{self.baseFilename}.{time.strftime(self.SUFFIX)}"
+        dest = self.rotation_filename(base)
+        count = 1
+        while os.path.exists(dest) or os.path.exists(base):
+            base = f"{self.baseFilename}.{time.strftime(self.SUFFIX)}.{count}"
+            dest = self.rotation_filename(base)
+            count += 1
+        self.rotate(self.baseFilename, dest)
+
+        if self.backupCount > 0:
+            for path in self.getFilesToDelete():
+                os.remove(path)
+        self.stream = self._open()
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+    def _rotate(self, source, dest):
+        if not os.path.exists(source):
+            return
+        # Renaming is instant, compressing happens elsewhere
+        raw = dest[:-len('.gz')]
+        os.rename(source, raw)
+        self._compress_in_background(raw, dest)
+
+    def _uncompressed(self):
+        directory, name = os.path.split(self.baseFilename)
+        return [
+            os.path.join(directory, file)
+            for file in os.listdir(directory)
+            if file.startswith(name + '.') and not file.endswith(('.gz', '.part'))
+        ]
+
+    @staticmethod
+    def _compress_in_background(source, dest):
+        def compress():
+            try:
+                with open(source, 'rb') as src, gzip.open(dest + '.part', 'wb') as out:
+                    shutil.copyfileobj(src, out)
+                os.replace(dest + '.part', dest)
+                os.remove(source)
+            except OSError as e:
+                sys.stderr.write(f"Could not compress rotated log {source}: {e}\n")
+
+        threading.Thread(target=compress, name='log-compress', daemon=True).start()
+
 class WindowsSafeStreamHandler(logging.StreamHandler):
     def emit(self, record):
         try:
@@ -44,30 +174,39 @@ def setup_logger():
     
     # Create formatters
     log_format = '%(asctime)s - %(levelname)s - %(message)s'
-    file_formatter = logging.Formatter(log_format)
+    if config.LOG_FORMAT == 'json':
+        file_formatter = JsonFormatter()
+    else:
+        file_formatter = logging.Formatter(log_format)
     console_formatter = logging.Formatter(log_format, datefmt='%H:%M:%S')
 
     # Create file handler
-    log_file = f'logs/bot_{datetime.now().strftime("%Y-%m-%d")}.log'
-    file_handler = RotatingFileHandler(
-        log_file,
-        maxBytes=10485760,  # 10MB
-        backupCount=5,
+    file_handler = TimedSizeRotatingFileHandler(
+        LOG_FILE,
+        max_bytes=LOG_MAX_BYTES,
+        backup_count=LOG_BACKUP_COUNT,
         encoding='utf-8'  # Specify UTF-8 encoding
     )
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(file_formatter)
-    file_handler.addFilter(BotLogFilter())
 
     # Create console handler with Windows-safe output
     console_handler = WindowsSafeStreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(console_formatter)
-    console_handler.addFilter(BotLogFilter())
 
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # The calling thread only filters and enqueues the record, formatting and
+    # file/console writes happen on the listener thread
+    log_queue = queue.SimpleQueue()
+    queue_handler = LocalQueueHandler(log_queue)
+    queue_handler.addFilter(BotLogFilter())
+    logger.addHandler(queue_handler)
+
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    queue_handler.listener = listener
+    # Drain the queue on exit so the last records reach the file
+    atexit.register(listener.stop)
 
     return logger
 
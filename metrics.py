@@ -0,0 +1,214 @@
+import asyncio
+import inspect
+import math
+import time
+from functools import wraps
+from telegram.ext import CommandHandler
+from logger import logger
+
+# Sub-buckets per power of two, 2**(SUB_BITS - 1) of them: 8 keeps every
+# bucket within 12.5% of the values it holds
+SUB_BITS = 4
+HALF = 1 << (SUB_BITS - 1)
+# Enough buckets for any value below 2**65 ns
+BUCKETS = (67 - SUB_BITS) * HALF
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+KIND_HELP = {
+    "handler": "Time spent in update handlers",
+    "db": "Time spent in Database methods, including waiting for a connection thread",
+    "render": "Time spent rendering QR codes, including waiting for a worker process",
+    "queue": "Time updates waited for a handler slot, by cost class",
+}
+
+def _bucket(value):
+    if value < (1 << SUB_BITS):
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return shift * HALF + (value >> shift)
+
+def _bucket_value(index):
+    """Middle of the range of values that fall into bucket index"""
+    if index < (1 << SUB_BITS):
+        return index
+    shift, mantissa = divmod(index, HALF)
+    shift -= 1
+    mantissa += HALF
+    return (mantissa << shift) + (1 << shift) // 2
+
+class Histogram:
+    """Log-linear latency histogram in nanoseconds, like HdrHistogram
+
+    record() is a couple of integer operations and one list increment, and
+    the memory used is fixed no matter how many values are recorded.
+    """
+
+    __slots__ = ("counts", "count", "total", "max", "errors")
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.errors = 0
+
+    def record(self, nanoseconds):
+        self.counts[_bucket(nanoseconds)] += 1
+        self.count += 1
+        self.total += nanoseconds
+        if nanoseconds > self.max:
+            self.max = nanoseconds
+
+    def percentile(self, quantile):
+        """Return the value at quantile (0-1) in nanoseconds, 0 when empty"""
+        if not self.count:
+            return 0
+        target = max(1, math.ceil(quantile * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(_bucket_value(index), self.max)
+        return self.max
+
+class Metrics:
+    """Latency histograms and error counts for every instrumented call, by kind and name"""
+
+    def __init__(self):
+        # (kind, name) -> Histogram
+        self.histograms = {}
+        self._server = None
+
+    def histogram(self, kind, name):
+        key = (kind, name)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        return histogram
+
+    def timed(self, kind, name, func):
+        """Wrap func, sync or async, so every call is recorded under (kind, name)"""
+        histogram = self.histogram(kind, name)
+        clock = time.perf_counter_ns
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = clock()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    histogram.errors += 1
+                    raise
+                finally:
+                    histogram.record(clock() - start)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                histogram.errors += 1
+                raise
+            finally:
+                histogram.record(clock() - start)
+        return wrapper
+
+    def summary(self, kind):
+        """Return [(name, histogram)] for kind, busiest first"""
+        rows = [
+            (name, histogram) for (row_kind, name), histogram in self.histograms.items()
+            if row_kind == kind and histogram.count
+        ]
+        rows.sort(key=lambda row: row[1].count, reverse=True)
+        return rows
+
+    def prometheus_text(self):
+        """Render every histogram in the Prometheus text exposition format"""
+        lines = []
+        for kind, help_text in KIND_HELP.items():
+            rows = self.summary(kind)
+            if not rows:
+                continue
+            metric = f"ignitebot_{kind}_seconds"
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} summary")
+            for name, histogram in rows:
+                for quantile in QUANTILES:
+                    value = histogram.percentile(quantile) / 1e9
+                    lines.append(f'{metric}{{name="{name}",quantile="{quantile}"}} {value:.9f}')
+                lines.append(f'{metric}_sum{{name="{name}"}} {histogram.total / 1e9:.9f}')
+                lines.append(f'{metric}_count{{name="{name}"}} {histogram.count}')
+
+            errors = f"ignitebot_{kind}_errors_total"
+            lines.append(f"# HELP {errors} Calls that raised an exception")
+            lines.append(f"# TYPE {errors} counter")
+            for name, histogram in rows:
+                lines.append(f'{errors}{{name="{name}"}} {histogram.errors}')
+        return "\n".join(lines) + "\n"
+
+    async def start_server(self, host, port):
+        """Serve GET /metrics on host:port"""
+        self._server = await asyncio.start_server(self._handle_request, host, port)
+        logger.info(f"Metrics available at http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_request(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Skip the headers, the request has no body we care about
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split('?')[0] == "/metrics":
+                status, body = "200 OK", self.prometheus_text().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+# Process-wide registry
+metrics = Metrics()
+
+def instrument_methods(kind, exclude=()):
+    """Class decorator that times every public method of the class under kind"""
+    def decorate(cls):
+        for name, func in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not inspect.isfunction(func):
+                continue
+            setattr(cls, name, metrics.timed(kind, name, func))
+        return cls
+    return decorate
+
+def instrument_handlers(application):
+    """Time the callback of every handler in the regular (non-negative) handler groups"""
+    for group, handlers in application.handlers.items():
+        if group < 0:
+            continue
+        for handler in handlers:
+            if getattr(handler.callback, "_metrics_name", None):
+                continue
+            if isinstance(handler, CommandHandler):
+                name = "/" + sorted(handler.commands)[0]
+            else:
+                name = handler.callback.__name__
+            handler.callback = metrics.timed("handler", name, handler.callback)
+            handler.callback._metrics_name = name
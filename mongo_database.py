@@ -0,0 +1,561 @@
+import asyncio
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pymongo import MongoClient, ASCENDING, DESCENDING, InsertOne, UpdateOne, DeleteOne, ReturnDocument
+from pymongo.errors import PyMongoError, ConnectionFailure, BulkWriteError
+import config
+from logger import logger
+from metrics import instrument_methods
+from stats import StatsRollup, FIELDS
+from storage import EXPORT_COLUMNS, Storage, UserCache, WriteBehindQueue, keyset_page, with_pending_activity
+
+# (collection, keys, options) created on startup, the counterparts of the SQLite indexes
+INDEXES = [
+    ("users", [("last_seen", DESCENDING), ("_id", DESCENDING)], {}),
+    ("command_history", [("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], {}),
+    ("command_history", [("timestamp", ASCENDING)], {}),
+    ("qr_history", [("user_id", ASCENDING), ("timestamp", DESCENDING)], {}),
+    ("command_hourly", [("hour", ASCENDING), ("command", ASCENDING)], {"unique": True}),
+    ("broadcasts", [("status", ASCENDING)], {}),
+    ("broadcast_recipients", [("broadcast_id", ASCENDING), ("user_id", ASCENDING)], {"unique": True}),
+    ("broadcast_recipients", [("broadcast_id", ASCENDING), ("status", ASCENDING), ("user_id", ASCENDING)], {}),
+]
+
+# Collections whose documents get integer ids from the counters collection, like
+# AUTOINCREMENT. History ids end up in callback data, where an ObjectId won't fit.
+SEQUENCED = ("command_history", "qr_history", "broadcasts")
+
+# /export name -> collection
+EXPORT_COLLECTIONS = {"users": "users", "commands": "command_history", "qr": "qr_history"}
+
+DUPLICATE_KEY = 11000
+RECIPIENT_BATCH = 1000
+
+def _day_pipeline(match, date):
+    """Aggregation that counts the matching documents per day of the date expression"""
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": date}},
+            "count": {"$sum": 1}
+        }}
+    ]
+
+def _parse_cursor_time(value):
+    # Cursors come back from callback data as the str() of the stored datetime
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+class MongoStatsRollup(StatsRollup):
+    """StatsRollup stored in the daily_stats collection, one document per day"""
+
+    def load(self, mdb):
+        days = defaultdict(Counter)
+        totals = Counter()
+        for document in mdb.daily_stats.find():
+            for field in FIELDS:
+                value = document.get(field) or 0
+                days[document["_id"]][field] = value
+                totals[field] += value
+        with self._lock:
+            self.days = days
+            self.totals = totals
+
+    def rebuild(self, mdb):
+        """Recompute daily_stats with aggregations over the history and reload it"""
+        days = defaultdict(Counter)
+        # Commands and distinct users per day, grouped by (day, user) first
+        for row in mdb.command_history.aggregate([
+            {"$match": {"timestamp": {"$ne": None}}},
+            {"$group": {
+                "_id": {
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                    "user_id": "$user_id"
+                },
+                "count": {"$sum": 1}
+            }},
+            {"$group": {"_id": "$_id.day", "commands": {"$sum": "$count"}, "users": {"$sum": 1}}}
+        ], allowDiskUse=True):
+            days[row["_id"]]["commands"] = row["commands"]
+            days[row["_id"]]["active_users"] = row["users"]
+        for row in mdb.qr_history.aggregate(
+            _day_pipeline({"timestamp": {"$ne": None}}, "$timestamp"), allowDiskUse=True
+        ):
+            days[row["_id"]]["qr_codes"] = row["count"]
+        for row in mdb.users.aggregate(
+            _day_pipeline({}, {"$ifNull": ["$join_date", "$last_seen"]}), allowDiskUse=True
+        ):
+            days[row["_id"]]["new_users"] = row["count"]
+        hours = [
+            {"hour": row["_id"]["hour"], "command": row["_id"]["command"], "count": row["count"]}
+            for row in mdb.command_history.aggregate([
+                {"$match": {"timestamp": {"$ne": None}}},
+                {"$group": {
+                    "_id": {
+                        "hour": {"$dateToString": {"format": "%Y-%m-%d %H", "date": "$timestamp"}},
+                        "command": "$command"
+                    },
+                    "count": {"$sum": 1}
+                }}
+            ], allowDiskUse=True)
+        ]
+
+        now = datetime.now()
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        days[now.strftime('%Y-%m-%d')]["active_users"] = mdb.users.count_documents(
+            {"last_seen": {"$gte": today_start}}
+        )
+
+        mdb.daily_stats.delete_many({})
+        if days:
+            mdb.daily_stats.insert_many([
+                {"_id": day, **{field: counts[field] for field in FIELDS}}
+                for day, counts in days.items()
+            ])
+        mdb.command_hourly.delete_many({})
+        if hours:
+            mdb.command_hourly.insert_many(hours)
+        self.load(mdb)
+
+    def stored_last_seen(self, mdb, user_ids):
+        return {
+            document["_id"]: document.get("last_seen")
+            for document in mdb.users.find({"_id": {"$in": list(user_ids)}}, {"last_seen": 1})
+        }
+
+    def persist(self, mdb, deltas):
+        if deltas:
+            mdb.daily_stats.bulk_write([
+                UpdateOne({"_id": day}, {"$inc": dict(counts)}, upsert=True)
+                for day, counts in deltas.items()
+            ], ordered=False)
+
+    def persist_hours(self, mdb, hours):
+        if hours:
+            mdb.command_hourly.bulk_write([
+                UpdateOne({"hour": hour, "command": command}, {"$inc": {"count": count}}, upsert=True)
+                for (hour, command), count in hours.items()
+            ], ordered=False)
+
+@instrument_methods("db", exclude=("start", "close"))
+class MongoDatabase(Storage):
+    """MongoDB storage, so every dyno shares the same data and it survives restarts
+
+    pymongo is synchronous, so writes run on one writer thread and reads on a
+    small thread pool. Queued writes go out as one bulk_write per collection,
+    unordered for collections that only receive inserts. There are no
+    transactions on a standalone server: if the stats update of a batch fails
+    after its documents were written, "/stats rebuild" recounts them.
+    Use get_database() instead of creating instances directly.
+    """
+
+    RETRY_ERRORS = (ConnectionFailure,)
+    WRITE_ERRORS = (PyMongoError,)
+
+    def __init__(self, uri, name, client=None, read_pool_size=None):
+        self.read_pool_size = read_pool_size or config.DB_READ_POOL_SIZE
+        # MongoClient connects in the background, nothing here waits on the network
+        self.client = client or MongoClient(uri, tz_aware=False, connect=False)
+        self.mdb = self.client[name]
+        self.stats = MongoStatsRollup()
+
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._readers = ThreadPoolExecutor(
+            max_workers=self.read_pool_size,
+            thread_name_prefix='db-reader'
+        )
+        self.write_queue = WriteBehindQueue(
+            self,
+            flush_interval_ms=config.WRITE_FLUSH_INTERVAL_MS,
+            max_batch=config.WRITE_BATCH_SIZE,
+            max_pending=config.WRITE_MAX_PENDING,
+            max_retries=config.WRITE_MAX_RETRIES
+        )
+        self.user_cache = UserCache(self, config.USER_CACHE_SIZE, config.USER_FLUSH_INTERVAL)
+
+    def _prepare(self, mdb):
+        for collection, keys, options in INDEXES:
+            mdb[collection].create_index(keys, **options)
+        self.stats.load(mdb)
+
+    async def start(self):
+        """Create missing indexes, load the stats rollup and start the write queue"""
+        try:
+            await self.run_write(self._prepare)
+        except PyMongoError as e:
+            logger.error(f"MongoDB initialization error: {e}")
+            raise
+        logger.info(f"Using MongoDB database {self.mdb.name}")
+        self.write_queue.start()
+        self.user_cache.start()
+
+    async def close(self):
+        """Flush pending writes and close the client"""
+        await self.user_cache.stop()
+        await self.write_queue.stop()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        self.client.close()
+        logger.info("MongoDB connection closed")
+
+    async def run_write(self, func, *args):
+        """Run func(mdb, *args) on the writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, func, self.mdb, *args)
+
+    async def run_read(self, func, *args):
+        """Run func(mdb, *args) on a reader thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, func, self.mdb, *args)
+
+    async def _find(self, collection, query, fields, sort=None, limit=0):
+        """Return the fields of the matching documents as tuples"""
+        def find(mdb):
+            cursor = mdb[collection].find(query, dict.fromkeys(fields, 1), sort=sort, limit=limit)
+            return [tuple(document.get(field) for field in fields) for document in cursor]
+        return await self.run_read(find)
+
+    def _reserve_ids(self, mdb, collection, count):
+        """Take count consecutive ids for collection, return the first"""
+        counter = mdb.counters.find_one_and_update(
+            {"_id": collection}, {"$inc": {"seq": count}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"] - count + 1
+
+    def write_batch(self, mdb, batch):
+        """Apply queued (collection, operation, event) rows with one bulk_write per collection
+
+        An operation is either a document to insert or a pymongo write model.
+        """
+        events = [event for _, _, event in batch if event is not None]
+        deltas = self.stats.collect(mdb, events)
+
+        by_collection = defaultdict(list)
+        for collection, operation, _ in batch:
+            by_collection[collection].append(operation)
+
+        for collection, operations in by_collection.items():
+            inserts = [operation for operation in operations if isinstance(operation, dict)]
+            if collection in SEQUENCED:
+                # Ids stay on the documents, so a retried batch can't insert twice
+                new = [document for document in inserts if "_id" not in document]
+                if new:
+                    first = self._reserve_ids(mdb, collection, len(new))
+                    for offset, document in enumerate(new):
+                        document["_id"] = first + offset
+
+            # Inserts don't depend on each other, updates keep their order
+            ordered = len(inserts) < len(operations)
+            requests = [
+                InsertOne(operation) if isinstance(operation, dict) else operation
+                for operation in operations
+            ]
+            try:
+                mdb[collection].bulk_write(requests, ordered=ordered)
+            except BulkWriteError as e:
+                # Documents already inserted by an earlier attempt of this batch
+                errors = e.details.get("writeErrors", [])
+                if ordered or e.details.get("writeConcernErrors") or any(
+                    error["code"] != DUPLICATE_KEY for error in errors
+                ):
+                    raise
+                logger.warning(f"Skipped {len(errors)} documents already in {collection}")
+
+        self.stats.persist(mdb, deltas)
+        self.stats.persist_hours(mdb, self.stats.command_hours(events))
+        self.stats.apply(deltas)
+
+    def _write(self, collection, operation, event=None):
+        # Go through the write-behind queue once the bot is running
+        if self.write_queue.running:
+            self.write_queue.put(collection, operation, event)
+        else:
+            self.write_batch(self.mdb, [(collection, operation, event)])
+
+    def _write_many(self, collection, operations, event=None):
+        if self.write_queue.running:
+            self.write_queue.put_many(collection, operations, event)
+        else:
+            self.write_batch(self.mdb, [(collection, operation, event) for operation in operations])
+
+    def add_or_update_user(self, user_id, username, first_name):
+        # Repeat users with an unchanged profile are written every USER_FLUSH_INTERVAL
+        self.user_cache.touch(user_id, username, first_name)
+
+    def write_user(self, user_id, username, first_name, commands, last_seen):
+        self._write("users", UpdateOne(
+            {"_id": user_id},
+            {
+                "$set": {"username": username, "first_name": first_name, "last_seen": last_seen},
+                "$inc": {"commands_used": commands},
+                "$setOnInsert": {"join_date": last_seen}
+            },
+            upsert=True
+        ), ("user", user_id, last_seen))
+
+    def log_command(self, user_id, command, args):
+        now = datetime.now()
+        self._write("command_history", {
+            "user_id": user_id, "command": command, "args": args, "timestamp": now
+        }, ("command", command, now))
+
+    def log_qr_generation(self, user_id, text_content):
+        now = datetime.now()
+        self._write("qr_history", {
+            "user_id": user_id, "text_content": text_content, "timestamp": now
+        }, ("qr", now))
+
+    def log_qr_batch(self, user_id, texts):
+        """Record a whole /qrbatch in qr_history, inserted with the same bulk_write"""
+        now = datetime.now()
+        self._write_many("qr_history", [
+            {"user_id": user_id, "text_content": text, "timestamp": now} for text in texts
+        ], ("qr", now))
+
+    def save_qr_file_id(self, cache_key, file_id):
+        self._write("qr_file_cache", UpdateOne(
+            {"_id": cache_key},
+            {"$set": {"file_id": file_id, "created_at": datetime.now()}},
+            upsert=True
+        ))
+
+    def delete_qr_file_id(self, cache_key):
+        self._write("qr_file_cache", DeleteOne({"_id": cache_key}))
+
+    async def get_qr_file_id(self, cache_key):
+        rows = await self._find("qr_file_cache", {"_id": cache_key}, ("file_id",), limit=1)
+        return rows[0][0] if rows else None
+
+    async def get_qr_file_ids(self, cache_keys):
+        """Return {cache_key: file_id} for the keys that have one"""
+        if not cache_keys:
+            return {}
+        rows = await self._find(
+            "qr_file_cache", {"_id": {"$in": list(cache_keys)}}, ("_id", "file_id")
+        )
+        return dict(rows)
+
+    async def create_broadcast(self, admin_id, text):
+        """Store a broadcast addressed to every current user, return (id, total)"""
+        # Users seen in the last few seconds may still be queued
+        await self.user_cache.sync()
+
+        def create(mdb):
+            broadcast_id = self._reserve_ids(mdb, "broadcasts", 1)
+            mdb.broadcasts.insert_one({
+                "_id": broadcast_id,
+                "admin_id": admin_id,
+                "text": text,
+                "status": "running",
+                "total": 0,
+                "chat_id": None,
+                "message_id": None,
+                "created_at": datetime.now(),
+                "finished_at": None
+            })
+            total = 0
+            batch = []
+            for user in mdb.users.find({}, {"_id": 1}):
+                batch.append({"broadcast_id": broadcast_id, "user_id": user["_id"], "status": "pending"})
+                if len(batch) == RECIPIENT_BATCH:
+                    mdb.broadcast_recipients.insert_many(batch, ordered=False)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                mdb.broadcast_recipients.insert_many(batch, ordered=False)
+                total += len(batch)
+            mdb.broadcasts.update_one({"_id": broadcast_id}, {"$set": {"total": total}})
+            return broadcast_id, total
+
+        return await self.run_write(create)
+
+    def set_broadcast_message(self, broadcast_id, chat_id, message_id):
+        """Remember the admin message that shows the progress of a broadcast"""
+        self._write("broadcasts", UpdateOne(
+            {"_id": broadcast_id}, {"$set": {"chat_id": chat_id, "message_id": message_id}}
+        ))
+
+    def mark_broadcast_recipient(self, broadcast_id, user_id, status, error=None):
+        self._write("broadcast_recipients", UpdateOne(
+            {"broadcast_id": broadcast_id, "user_id": user_id},
+            {"$set": {"status": status, "error": error}}
+        ))
+
+    def finish_broadcast(self, broadcast_id, status):
+        self._write("broadcasts", UpdateOne(
+            {"_id": broadcast_id}, {"$set": {"status": status, "finished_at": datetime.now()}}
+        ))
+
+    async def get_running_broadcasts(self):
+        return await self._find(
+            "broadcasts", {"status": "running"},
+            ("_id", "text", "total", "chat_id", "message_id"), sort=[("_id", ASCENDING)]
+        )
+
+    async def get_pending_recipients(self, broadcast_id, after_user_id=0, limit=500):
+        """Return up to limit user_ids still waiting for the broadcast, after after_user_id"""
+        rows = await self._find(
+            "broadcast_recipients",
+            {"broadcast_id": broadcast_id, "status": "pending", "user_id": {"$gt": after_user_id}},
+            ("user_id",), sort=[("user_id", ASCENDING)], limit=limit
+        )
+        return [row[0] for row in rows]
+
+    async def get_broadcast_counts(self, broadcast_id):
+        """Return {status: recipients} for a broadcast"""
+        def counts(mdb):
+            return {
+                row["_id"]: row["count"]
+                for row in mdb.broadcast_recipients.aggregate([
+                    {"$match": {"broadcast_id": broadcast_id}},
+                    {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+                ])
+            }
+        return await self.run_read(counts)
+
+    async def get_user_history(self, user_id):
+        return await self._find(
+            "command_history", {"user_id": user_id},
+            ("command", "args", "timestamp"), sort=[("timestamp", DESCENDING), ("_id", DESCENDING)]
+        )
+
+    async def get_user_stats(self, user_id):
+        def user_stats(mdb):
+            user = mdb.users.find_one({"_id": user_id})
+            if user is None:
+                return None
+            return (
+                user.get("username"),
+                user.get("first_name"),
+                user.get("commands_used"),
+                user.get("join_date"),
+                user.get("last_seen"),
+                mdb.qr_history.count_documents({"user_id": user_id})
+            )
+
+        try:
+            row = await self.run_read(user_stats)
+        except PyMongoError as e:
+            logger.error(f"Database error in get_user_stats: {e}")
+            raise
+        return with_pending_activity(row, self.user_cache.pending_activity(user_id))
+
+    async def get_users_page(self, cursor=None, limit=20, newer=False):
+        """Page through users by last_seen DESC, user_id DESC without skip(), like Database"""
+        direction = ASCENDING if newer else DESCENDING
+        query = {}
+        if cursor is not None:
+            last_seen, user_id = _parse_cursor_time(cursor[0]), cursor[1]
+            compare = "$gt" if newer else "$lt"
+            query = {"$or": [
+                {"last_seen": {compare: last_seen}},
+                {"last_seen": last_seen, "_id": {compare: user_id}}
+            ]}
+        rows = await self._find(
+            "users", query, ("_id", "username", "first_name", "last_seen"),
+            sort=[("last_seen", direction), ("_id", direction)], limit=limit + 1
+        )
+        return keyset_page(rows, limit, newer)
+
+    async def get_user_history_page(self, user_id, cursor=None, limit=5, newer=False):
+        """Page through a user's commands by timestamp DESC, id DESC, like Database"""
+        direction = ASCENDING if newer else DESCENDING
+        query = {"user_id": user_id}
+        if cursor is not None:
+            timestamp, row_id = _parse_cursor_time(cursor[0]), cursor[1]
+            compare = "$gt" if newer else "$lt"
+            query["$or"] = [
+                {"timestamp": {compare: timestamp}},
+                {"timestamp": timestamp, "_id": {compare: row_id}}
+            ]
+        rows = await self._find(
+            "command_history", query, ("_id", "command", "args", "timestamp"),
+            sort=[("timestamp", direction), ("_id", direction)], limit=limit + 1
+        )
+        return keyset_page(rows, limit, newer)
+
+    async def count_users(self):
+        # Collection metadata instead of a scan, exact unless the server crashed
+        return await self.run_read(lambda mdb: mdb.users.estimated_document_count())
+
+    async def count_user_history(self, user_id):
+        return await self.run_read(
+            lambda mdb: mdb.command_history.count_documents({"user_id": user_id})
+        )
+
+    async def get_qr_history(self, user_id):
+        return await self._find(
+            "qr_history", {"user_id": user_id},
+            ("text_content", "timestamp"), sort=[("timestamp", DESCENDING), ("_id", DESCENDING)]
+        )
+
+    async def export(self, name, write_rows, since=None, until=None, chunk_size=1000):
+        await self.user_cache.sync()
+        # The id column is _id in every collection
+        columns = EXPORT_COLUMNS[name]
+        fields = ("_id",) + columns[1:]
+        bounds = {}
+        if since:
+            bounds["$gte"] = since
+        if until:
+            bounds["$lt"] = until
+        query = {columns[-1]: bounds} if bounds else {}
+
+        def export(mdb):
+            cursor = mdb[EXPORT_COLLECTIONS[name]].find(
+                query, dict.fromkeys(fields, 1), batch_size=chunk_size
+            )
+            count = 0
+            rows = []
+            for document in cursor:
+                rows.append(tuple(document.get(field) for field in fields))
+                if len(rows) >= chunk_size:
+                    write_rows(rows)
+                    count += len(rows)
+                    rows = []
+            if rows:
+                write_rows(rows)
+                count += len(rows)
+            return count
+
+        return await self.run_read(export)
+
+    async def get_all_users(self):
+        return await self._find(
+            "users", {}, ("_id", "username", "first_name", "last_seen"),
+            sort=[("last_seen", DESCENDING)]
+        )
+
+    async def get_command_hours(self, since, until):
+        await self.write_queue.flush()
+        hours = {"$gte": since.strftime('%Y-%m-%d %H'), "$lt": until.strftime('%Y-%m-%d %H')}
+        return await self._find(
+            "command_hourly", {"hour": hours}, ("hour", "command", "count"), sort=[("hour", ASCENDING)]
+        )
+
+    async def get_total_qr_codes(self):
+        return self.stats.snapshot()["total_qr_codes"]
+
+    async def get_commands_today(self):
+        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return await self.run_read(
+            lambda mdb: mdb.command_history.count_documents({"timestamp": {"$gte": today_start}})
+        )
+
+    async def get_active_users_today(self):
+        await self.user_cache.sync()
+        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        return await self.run_read(
+            lambda mdb: mdb.users.count_documents({"last_seen": {"$gte": today_start}})
+        )
+
+    async def get_stats(self):
+        # Served from the in-memory rollup, no counting over the history collections
+        await self.user_cache.sync()
+        return self.stats.snapshot()
+
+    async def rebuild_stats(self):
+        """Recompute the stats rollup from the collections"""
+        await self.run_write(self.stats.rebuild)
+        return self.stats.snapshot()
@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta
+from io import BytesIO
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Bucket width in seconds
+GRANULARITIES = {"hour": 3600, "day": 86400}
+
+# Buckets between labels on the time axis, the first step giving at most eight labels is used
+LABEL_STEPS = {"hour": (1, 2, 3, 6, 12, 24, 48, 96, 168), "day": (1, 2, 7, 14, 28, 56)}
+
+# The busiest commands get a series each, the rest are stacked as "other"
+MAX_SERIES = 6
+COLORS = ("#4e79a7", "#f28e2b", "#59a14f", "#e15759", "#76b7b2", "#edc948", "#bab0ac")
+
+WIDTH = 1000
+HEIGHT = 520
+MARGIN_LEFT = 60
+MARGIN_RIGHT = 20
+MARGIN_TOP = 50
+MARGIN_BOTTOM = 40
+
+def bucket_range(days, granularity, now=None):
+    """Return (start, end) covering the closed buckets of the last days, end is where the open bucket starts"""
+    now = now or datetime.now()
+    end = now.replace(minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        end = end.replace(hour=0)
+    return end - timedelta(days=days), end
+
+class ActivityHistogram:
+    """Commands per bucket and command, binned from the (hour, command, count) rows of command_hourly"""
+
+    def __init__(self, start, end, granularity):
+        self.start = start
+        self.end = end
+        self.granularity = granularity
+        self.step = GRANULARITIES[granularity]
+        self.buckets = int((end - start).total_seconds()) // self.step
+        # command -> counts per bucket
+        self.counts = {}
+
+    def add_rows(self, rows):
+        if not rows:
+            return
+        hours, commands, counts = zip(*rows)
+        # Hours since start, then the bucket each hour falls in
+        offsets = (np.array(hours, dtype='datetime64[h]') - np.datetime64(self.start, 'h')).astype(np.int64)
+        index = offsets * 3600 // self.step
+        names, codes = np.unique(np.array(commands, dtype=str), return_inverse=True)
+        inside = (index >= 0) & (index < self.buckets)
+        binned = np.bincount(
+            codes[inside] * self.buckets + index[inside],
+            weights=np.array(counts, dtype=np.int64)[inside],
+            minlength=len(names) * self.buckets
+        ).astype(np.int64).reshape(len(names), self.buckets)
+        for name, row in zip(names.tolist(), binned):
+            if name in self.counts:
+                self.counts[name] += row
+            else:
+                self.counts[name] = row
+
+    def series(self):
+        """Return [(label, counts)] of the busiest commands, then "other", busiest first"""
+        ranked = sorted(self.counts.items(), key=lambda item: item[1].sum(), reverse=True)
+        series = [(f"/{name}", counts) for name, counts in ranked[:MAX_SERIES]]
+        if len(ranked) > MAX_SERIES:
+            series.append(("other", np.sum([counts for _, counts in ranked[MAX_SERIES:]], axis=0)))
+        return series
+
+    def totals(self):
+        """Commands per bucket, all commands together"""
+        if not self.counts:
+            return np.zeros(self.buckets, dtype=np.int64)
+        return np.sum(list(self.counts.values()), axis=0)
+
+    def bucket_start(self, index):
+        return self.start + timedelta(seconds=int(index) * self.step)
+
+def _tick_step(peak, ticks=5):
+    """A 1, 2 or 5 times a power of ten step giving about ticks gridlines up to peak"""
+    raw = max(peak / ticks, 1)
+    power = 10 ** int(np.floor(np.log10(raw)))
+    for factor in (1, 2, 5, 10):
+        if raw <= factor * power:
+            return factor * power
+    return 10 * power
+
+def build_chart(rows, start, end, granularity):
+    """Bin command_hourly rows and render them, return (PNG in a BytesIO, caption)"""
+    histogram = ActivityHistogram(start, end, granularity)
+    histogram.add_rows(rows)
+    totals = histogram.totals()
+    title = f"Commands per {granularity}, {start:%Y-%m-%d %H:00} to {end:%Y-%m-%d %H:00}"
+    caption = f"📈 {int(totals.sum()):,} commands in {histogram.buckets} {granularity}s"
+    if totals.any():
+        busiest = histogram.bucket_start(totals.argmax())
+        label = f"{busiest:%Y-%m-%d}" if granularity == "day" else f"{busiest:%Y-%m-%d %H:00}"
+        caption += f", busiest {label} with {int(totals.max()):,}"
+    return render_chart(histogram, title), caption
+
+def render_chart(histogram, title):
+    """Draw the histogram as stacked columns and return it as a PNG in a BytesIO"""
+    image = Image.new("RGB", (WIDTH, HEIGHT), "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    left, right = MARGIN_LEFT, WIDTH - MARGIN_RIGHT
+    top, bottom = MARGIN_TOP, HEIGHT - MARGIN_BOTTOM
+
+    series = histogram.series()
+    peak = int(histogram.totals().max()) if histogram.buckets else 0
+    step = _tick_step(peak)
+    y_max = max(step, -(-peak // step) * step)
+    scale = (bottom - top) / y_max
+
+    draw.text((left, 8), title, fill="black", font=font)
+    for value in range(0, y_max + 1, step):
+        y = bottom - round(value * scale)
+        draw.line((left, y, right, y), fill="#e0e0e0")
+        draw.text((left - 8, y), f"{value:,}", fill="black", font=font, anchor="rm")
+
+    # Column edges, a column or segment smaller than a pixel still gets one
+    edges = np.linspace(left, right, histogram.buckets + 1).round().astype(int)
+    base = np.zeros(histogram.buckets)
+    for (label, counts), color in zip(series, COLORS):
+        lower = bottom - (base * scale).round().astype(int)
+        base = base + counts
+        upper = bottom - (base * scale).round().astype(int)
+        for index in np.flatnonzero(counts):
+            x0 = edges[index]
+            x1 = max(x0, edges[index + 1] - 1)
+            draw.rectangle((x0, upper[index], x1, max(upper[index], lower[index] - 1)), fill=color)
+    draw.line((left, bottom, right, bottom), fill="black")
+    draw.line((left, top, left, bottom), fill="black")
+
+    steps = LABEL_STEPS[histogram.granularity]
+    every = next((step for step in steps if step * 8 >= histogram.buckets), steps[-1])
+    first = 0
+    label_format = "%m-%d"
+    if histogram.granularity == "hour":
+        # Labels on round hours, at midnight once they are a day or more apart
+        first = -histogram.start.hour % min(every, 24)
+        label_format = "%m-%d %H:00"
+    for index in range(first, histogram.buckets, every):
+        x = (edges[index] + edges[index + 1]) // 2
+        draw.line((x, bottom, x, bottom + 4), fill="black")
+        label = histogram.bucket_start(index).strftime(label_format)
+        draw.text((x, bottom + 8), label, fill="black", font=font, anchor="mt")
+
+    x = left
+    for (label, counts), color in zip(series, COLORS):
+        draw.rectangle((x, 30, x + 10, 40), fill=color)
+        text = f"{label} {int(counts.sum()):,}"
+        draw.text((x + 14, 35), text, fill="black", font=font, anchor="lm")
+        x += 24 + round(draw.textlength(text, font=font))
+
+    output = BytesIO()
+    image.save(output, format="PNG", optimize=True)
+    output.seek(0)
+    return output
@@ -1,34 +1,210 @@
-from telegram import Update
-from telegram.ext import ContextTypes, CommandHandler
-from plugins.base import BotPlugin
-from logger import logger
-from database import Database  # Import the Database class
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, CommandHandler, CallbackQueryHandler
+from plugins.base import BotPlugin, Command
+from plugins.admin.broadcast import Broadcaster
+from plugins.admin import log_search
+from plugins.admin.export import ExportWriter, FORMATS
+from storage import EXPORT_COLUMNS
+from database import Database, fts_query
+from logger import logger, LOG_FILE
+from metrics import metrics
+import config
+import asyncio
+import importlib
+import os
+import re
+import sqlite3
+from collections import OrderedDict
+from io import BytesIO
 from datetime import datetime
 
+USERS_PER_PAGE = 20
+HISTORY_PER_PAGE = 5
+
+SEARCH_PER_PAGE = 10
+# Searches the prev/next buttons refer to, the query itself doesn't fit in callback data
+MAX_SAVED_SEARCHES = 100
+
+SEARCH_USAGE = (
+    "Usage: /search <words> [user_id]\n"
+    "Finds QR texts and command arguments containing every word, word* matches a prefix"
+)
+
+ACTIVITY_USAGE = (
+    "Usage: /activity [days] [hour|day]\n"
+    "Commands per hour or day over the last days (default 7), hourly up to 31 days, daily up to 365"
+)
+DEFAULT_ACTIVITY_DAYS = 7
+MAX_HOURLY_DAYS = 31
+MAX_ACTIVITY_DAYS = 365
+
+# /perf sections and the number of busiest entries shown in each
+PERF_SECTIONS = (
+    ("handler", "Handlers"), ("queue", "Queue wait"), ("db", "Database"), ("render", "Rendering")
+)
+PERF_ROWS = 10
+
+DEFAULT_TAIL_LINES = 50
+MAX_LOG_LINES = 500
+MAX_MESSAGE_LENGTH = 4000
+
+LOGS_USAGE = (
+    "Usage:\n"
+    "/logs tail [N] - Last N lines of the log (default 50)\n"
+    "/logs grep PATTERN [since] - Newest lines matching a regex, since e.g. 30m, 2h, 1d, 14:00 or 2024-01-31\n"
+    "/logs full - The current log file, gzip-compressed"
+)
+
+EXPORT_USAGE = (
+    "Usage:\n"
+    "/export users|commands|qr [since] [until] [format=csv|ndjson]\n"
+    "since and until take e.g. 30m, 2h, 1d, 14:00 or 2024-01-31, users are filtered by last seen"
+)
+# Seconds allowed for uploading one export part
+EXPORT_UPLOAD_TIMEOUT = 300
+
+BROADCAST_USAGE = (
+    "Usage:\n"
+    "/broadcast <message> - Send a message to every user\n"
+    "/broadcast status - Show running broadcasts\n"
+    "/broadcast cancel <id> - Stop a running broadcast"
+)
+
+def _page_keyboard(prefix, rows, cursor_of, has_prev, has_next):
+    """Prev/next buttons whose callback data carries the keyset cursor of the edge rows
+
+    Callback data looks like "<prefix>:<p|n>:<cursor id>:<cursor value>". The
+    value goes last because timestamps contain ":" themselves.
+    """
+    buttons = []
+    if rows and has_prev:
+        value, row_id = cursor_of(rows[0])
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"{prefix}:p:{row_id}:{value}"))
+    if rows and has_next:
+        value, row_id = cursor_of(rows[-1])
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"{prefix}:n:{row_id}:{value}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+def _parse_page_data(data, prefix_parts=1):
+    """Split callback data from _page_keyboard() into (prefix parts, newer, cursor)"""
+    parts = data.split(":", prefix_parts + 2)
+    prefix = parts[:prefix_parts]
+    direction, row_id, value = parts[prefix_parts:]
+    return prefix, direction == "p", (value, int(row_id))
+
+def _search_error(query, error):
+    """Log a failed search and return the reply for it"""
+    if getattr(error, 'sqlite_errorcode', None) == sqlite3.SQLITE_INTERRUPT:
+        # Stopped by the progress handler after SEARCH_TIMEOUT
+        logger.warning(f"Search {query} timed out")
+        return "⏳ Too many matches to rank, add more words or a user_id."
+    message = str(error)
+    if message.startswith("fts5: syntax error") or message == "unterminated string":
+        logger.warning(f"Search {query} could not be parsed: {message}")
+        return "🔎 Couldn't understand that search, try plain words."
+    logger.error(f"Error in search command: {message}")
+    return "Error searching history."
+
 class AdminPlugin(BotPlugin):
-    def __init__(self):
-        super().__init__()
-        self.db = Database()  # Initialize the database
+    def __init__(self, db):
+        super().__init__(db)
         self.admin_commands = [
-            ("stats", self.show_stats, "Show bot statistics"),
-            ("users", self.list_users, "List all registered users"),
-            ("userinfo", self.user_info, "Get detailed info about a user"),
-            ("logs", self.get_logs, "Get recent log files")
+            Command("stats", self.show_stats, "Show bot statistics (/stats rebuild to recount)", cost="cheap"),
+            Command("perf", self.show_perf, "Latency percentiles of handlers, database and rendering", cost="cheap"),
+            Command("users", self.list_users, "List registered users, newest first"),
+            Command("userinfo", self.user_info, "Get detailed info about a user"),
+            Command("broadcast", self.broadcast_message, "Send a message to every user (status, cancel <id>)"),
+            Command("logs", self.get_logs, "Read the log: tail [N], grep PATTERN [since], full"),
+            Command("search", self.search_history, "Full-text search of QR texts and command arguments"),
+            Command("activity", self.show_activity, "Chart of commands per hour or day: [days] [hour|day]",
+                    cost="cpu", max_concurrent=1),
+            Command("export", self.export_data, "Download users, commands or qr as gzip CSV/NDJSON",
+                    max_concurrent=1)
         ]
+        self.broadcaster = Broadcaster(
+            db, rate=config.BROADCAST_RATE, concurrency=config.BROADCAST_CONCURRENCY
+        )
+        # search id -> (FTS5 query, user_id), oldest first
+        self.searches = OrderedDict()
+        self.next_search_id = 1
+        # (days, granularity) -> (end of the last bucket, file_id, caption) of the last chart sent
+        self.activity_charts = {}
 
     async def show_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not await self.check_admin(update):
             return
 
         try:
-            # Get all stats from database
-            stats = self.db.get_stats()
+            # Counters come from the in-memory rollup, "/stats rebuild" recomputes it
+            if context.args and context.args[0].lower() == "rebuild":
+                stats = await self.db.rebuild_stats()
+                logger.info(f"Stats rollup rebuilt by admin {update.effective_user.id}")
+            else:
+                stats = await self.db.get_stats()
             
             stats_text = "📊 Bot Statistics:\n\n"
             stats_text += f"Total users: {stats['total_users']}\n"
             stats_text += f"Active today: {stats['active_today']}\n"
             stats_text += f"Commands used today: {stats['commands_today']}\n"
-            stats_text += f"Total QR codes generated: {stats['total_qr_codes']}"
+            stats_text += f"Total QR codes generated: {stats['total_qr_codes']}\n"
+
+            queue_stats = self.db.write_queue.stats()
+            stats_text += "\n💾 Write queue:\n"
+            stats_text += f"Pending rows: {queue_stats['depth']}\n"
+            stats_text += f"Rows written: {queue_stats['rows_written']} in {queue_stats['flushes']} flushes\n"
+            stats_text += f"Last flush: {queue_stats['last_flush_ms']:.2f}ms (max {queue_stats['max_flush_ms']:.2f}ms)"
+            if queue_stats['rows_dropped']:
+                stats_text += f"\nDropped rows: {queue_stats['rows_dropped']}"
+            if self.db.user_cache:
+                cache_stats = self.db.user_cache.stats()
+                stats_text += f"\nUser writes: {cache_stats['writes']} for {cache_stats['touches']} commands"
+                stats_text += f" ({cache_stats['cached']} profiles cached)"
+
+            flood_control = context.bot_data.get("flood_control")
+            if flood_control:
+                flood_stats = flood_control.stats()
+                stats_text += "\n\n🚦 Flood control:\n"
+                stats_text += f"Rejected updates: {flood_stats['rejected']}\n"
+                for command, count in sorted(flood_stats['by_command'].items()):
+                    stats_text += f"  {command}: {count}\n"
+                stats_text += f"Users tracked: {flood_stats['tracked_users']}"
+
+            scheduler = context.bot_data.get("update_processor")
+            if scheduler:
+                stats_text += "\n\n⚙️ Scheduler:"
+                for cost, class_stats in scheduler.stats().items():
+                    stats_text += f"\n{cost}: {class_stats['running']}/{class_stats['slots']} running, "
+                    stats_text += f"{class_stats['waiting']}/{class_stats['queue_size']} waiting"
+                    if class_stats['shed']:
+                        stats_text += f", {class_stats['shed']} turned away"
+
+            error_digest = context.bot_data.get("error_digest")
+            if error_digest:
+                error_stats = error_digest.stats()
+                stats_text += "\n\n❌ Errors:\n"
+                stats_text += f"Total: {error_stats['total']}\n"
+                stats_text += f"Waiting for the next digest: {error_stats['pending']} kinds\n"
+                stats_text += f"Digests sent: {error_stats['digests_sent']}"
+
+            retention = context.bot_data.get("retention")
+            if retention:
+                stats_text += "\n\n🗄️ Retention:\n"
+                last_run = retention.stats()
+                if last_run:
+                    stats_text += f"Last run: {last_run['finished_at']:%Y-%m-%d %H:%M}\n"
+                    stats_text += f"Archived before {last_run['cutoff_day']}: "
+                    stats_text += f"{last_run['commands']} commands, {last_run['qr_codes']} QR codes\n"
+                    stats_text += f"Pages freed: {last_run['reclaimed_pages']}"
+                else:
+                    stats_text += f"Keeping {retention.days} days, no run yet"
+
+            # Counters reported by the loaded plugins
+            for plugin in context.bot_data.get("plugins", []):
+                plugin_stats = plugin.get_stats()
+                if plugin_stats:
+                    stats_text += "\n"
+                    for label, value in plugin_stats.items():
+                        stats_text += f"\n{label}: {value}"
             
             await update.message.reply_text(stats_text)
             logger.info(f"Stats requested by admin {update.effective_user.id}")
@@ -36,51 +212,118 @@ class AdminPlugin(BotPlugin):
             logger.error(f"Error in stats command: {str(e)}")
             await update.message.reply_text(f"Error fetching statistics: {str(e)}")
 
-    async def list_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def show_perf(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not await self.check_admin(update):
             return
 
         try:
-            users = self.db.get_all_users()
-            
-            if not users:
-                await update.message.reply_text("No users found in database.")
-                return
+            perf_text = "⏱ Performance (ms: p50 / p95 / p99, calls, errors)\n"
+            for kind, title in PERF_SECTIONS:
+                rows = metrics.summary(kind)[:PERF_ROWS]
+                if not rows:
+                    continue
+                perf_text += f"\n{title}:\n"
+                for name, histogram in rows:
+                    p50, p95, p99 = (histogram.percentile(q) / 1e6 for q in (0.5, 0.95, 0.99))
+                    perf_text += f"{name}: {p50:.2f} / {p95:.2f} / {p99:.2f}, {histogram.count}"
+                    perf_text += f", {histogram.errors} errors\n" if histogram.errors else "\n"
 
-            users_text = "👥 Registered Users:\n\n"
-            for user_id, username, first_name, last_seen in users[:20]:  # Show first 20 users
-                # Handle None values
-                username = username or "No username"
-                first_name = first_name or "No name"
-                last_seen = last_seen or "Never"
-                
-                users_text += f"• {first_name}\n"
-                users_text += f"  Username: @{username}\n"
-                users_text += f"  ID: {user_id}\n"
-                users_text += f"  Last seen: {last_seen}\n"
-                users_text += "───────────────\n"
-            
-            users_text += f"\nTotal users: {len(users)}"
-            
-            await update.message.reply_text(users_text)
+            await update.message.reply_text(perf_text)
+            logger.info(f"Perf summary requested by admin {update.effective_user.id}")
+        except Exception as e:
+            logger.error(f"Error in perf command: {str(e)}")
+            await update.message.reply_text("Error fetching performance metrics.")
+
+    async def list_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not await self.check_admin(update):
+            return
+
+        try:
+            users_text, keyboard = await self.render_users_page()
+            await update.message.reply_text(users_text, reply_markup=keyboard)
             logger.info(f"User list requested by admin {update.effective_user.id}")
         except Exception as e:
             logger.error(f"Error in users command: {str(e)}")
             await update.message.reply_text(f"Error fetching user list: {str(e)}")
 
+    async def users_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        if not await self.check_admin(update):
+            return
+
+        try:
+            _, newer, cursor = _parse_page_data(query.data)
+            users_text, keyboard = await self.render_users_page(cursor, newer)
+            await query.answer()
+            await query.edit_message_text(users_text, reply_markup=keyboard)
+        except Exception as e:
+            logger.error(f"Error in users page callback: {str(e)}")
+            await query.answer("Error fetching user list.", show_alert=True)
+
+    async def render_users_page(self, cursor=None, newer=False):
+        users, has_more = await self.db.get_users_page(cursor, USERS_PER_PAGE, newer)
+        total = await self.db.count_users()
+
+        if not users:
+            return "No users found in database.", None
+
+        users_text = "👥 Registered Users:\n\n"
+        for user_id, username, first_name, last_seen in users:
+            # Handle None values
+            username = username or "No username"
+            first_name = first_name or "No name"
+            last_seen = last_seen or "Never"
+
+            users_text += f"• {first_name}\n"
+            users_text += f"  Username: @{username}\n"
+            users_text += f"  ID: {user_id}\n"
+            users_text += f"  Last seen: {last_seen}\n"
+            users_text += "───────────────\n"
+
+        users_text += f"\nTotal users: {total}"
+
+        # Paging newer always leaves an older page behind, and the reverse
+        has_prev = has_more if newer else cursor is not None
+        has_next = True if newer else has_more
+        keyboard = _page_keyboard(
+            "users", users, lambda row: (row[3], row[0]), has_prev, has_next
+        )
+        return users_text, keyboard
+
     async def broadcast_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not await self.check_admin(update):
             return
 
         try:
             if not context.args:
-                await update.message.reply_text("Please provide a message to broadcast.")
+                await update.message.reply_text(BROADCAST_USAGE)
                 return
 
-            message = ' '.join(context.args)
-            # Add broadcast logic here
-            await update.message.reply_text(f"Message broadcast sent: {message}")
-            logger.info(f"Broadcast sent by admin {update.effective_user.id}")
+            action = context.args[0].lower()
+            if action == "status" and len(context.args) == 1:
+                jobs = self.broadcaster.jobs.values()
+                if not jobs:
+                    await update.message.reply_text("No broadcasts running.")
+                    return
+                await update.message.reply_text("\n\n".join(job.progress_text() for job in jobs))
+                return
+
+            if action == "cancel" and len(context.args) == 2:
+                broadcast_id = int(context.args[1].lstrip('#'))
+                if self.broadcaster.cancel(broadcast_id):
+                    await update.message.reply_text(f"🛑 Cancelling broadcast #{broadcast_id}.")
+                    logger.info(f"Broadcast #{broadcast_id} cancelled by admin {update.effective_user.id}")
+                else:
+                    await update.message.reply_text(f"Broadcast #{broadcast_id} is not running.")
+                return
+
+            # Everything after the command, line breaks included
+            message = update.message.text.split(None, 1)[1]
+            await self.broadcaster.create(
+                update.effective_user.id, update.effective_chat.id, message
+            )
+        except ValueError:
+            await update.message.reply_text("Invalid broadcast ID format.")
         except Exception as e:
             logger.error(f"Error in broadcast command: {str(e)}")
             await update.message.reply_text("Error sending broadcast.")
@@ -90,26 +333,216 @@ class AdminPlugin(BotPlugin):
             return
 
         try:
-            import os
-            log_files = [f for f in os.listdir('logs') if f.endswith('.log')]
-            
-            if not log_files:
-                await update.message.reply_text("No log files found.")
+            args = context.args or ["tail"]
+            action = args[0].lower()
+            if not os.path.exists(LOG_FILE):
+                await update.message.reply_text("No log file found.")
                 return
 
-            latest_log = max(log_files, key=lambda x: os.path.getctime(os.path.join('logs', x)))
-            
-            with open(os.path.join('logs', latest_log), 'rb') as file:
-                await update.message.reply_document(
-                    document=file,
-                    filename=latest_log,
-                    caption="Here's the latest log file."
+            loop = asyncio.get_running_loop()
+            if action == "tail" and len(args) <= 2:
+                count = min(int(args[1]), MAX_LOG_LINES) if len(args) == 2 else DEFAULT_TAIL_LINES
+                if count < 1:
+                    raise ValueError(count)
+                lines = await loop.run_in_executor(None, log_search.tail, LOG_FILE, count)
+                await self.send_log_lines(update, lines, f"Last {len(lines)} log lines")
+            elif action == "grep" and len(args) >= 2:
+                pattern = args[1]
+                since = log_search.parse_since(' '.join(args[2:])) if len(args) > 2 else None
+                lines = await loop.run_in_executor(
+                    None, log_search.grep, LOG_FILE, pattern, since, MAX_LOG_LINES
                 )
-            logger.info(f"Logs sent to admin {update.effective_user.id}")
+                if not lines:
+                    await update.message.reply_text(f"No log lines match {pattern}.")
+                    return
+                await self.send_log_lines(update, lines, f"{len(lines)} newest lines matching {pattern}")
+            elif action == "full" and len(args) == 1:
+                archive = await loop.run_in_executor(None, log_search.gzip_to_tempfile, LOG_FILE)
+                with archive:
+                    await update.message.reply_document(
+                        document=archive,
+                        filename=os.path.basename(LOG_FILE) + '.gz',
+                        caption="Here's the current log file."
+                    )
+            else:
+                await update.message.reply_text(LOGS_USAGE)
+                return
+            logger.info(f"Logs ({action}) sent to admin {update.effective_user.id}")
+        except re.error as e:
+            await update.message.reply_text(f"Invalid pattern: {e}")
+        except ValueError:
+            await update.message.reply_text(LOGS_USAGE)
         except Exception as e:
             logger.error(f"Error in logs command: {str(e)}")
             await update.message.reply_text("Error fetching log files.")
 
+    async def search_history(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not await self.check_admin(update):
+            return
+
+        try:
+            args = list(context.args or [])
+            user_id = int(args.pop()) if len(args) > 1 and args[-1].isdigit() else None
+            query = fts_query(" ".join(args))
+            if not query:
+                await update.message.reply_text(SEARCH_USAGE)
+                return
+            if not isinstance(self.db, Database):
+                await update.message.reply_text("🔎 /search needs the SQLite backend.")
+                return
+
+            search_id = self.next_search_id
+            self.next_search_id += 1
+            self.searches[search_id] = (query, user_id)
+            if len(self.searches) > MAX_SAVED_SEARCHES:
+                self.searches.popitem(last=False)
+
+            results_text, keyboard = await self.render_search(search_id, 0)
+            await update.message.reply_text(results_text, reply_markup=keyboard)
+            logger.info(f"Search {query} by admin {update.effective_user.id}")
+        except sqlite3.OperationalError as e:
+            await update.message.reply_text(_search_error(query, e))
+        except Exception as e:
+            logger.error(f"Error in search command: {str(e)}")
+            await update.message.reply_text("Error searching history.")
+
+    async def show_activity(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not await self.check_admin(update):
+            return
+
+        try:
+            days, granularity = DEFAULT_ACTIVITY_DAYS, None
+            for arg in context.args or []:
+                if arg.isdigit():
+                    days = int(arg)
+                elif arg.lower() in ("hour", "day"):
+                    granularity = arg.lower()
+                else:
+                    raise ValueError(arg)
+            granularity = granularity or ("hour" if days <= DEFAULT_ACTIVITY_DAYS else "day")
+            if not 1 <= days <= (MAX_HOURLY_DAYS if granularity == "hour" else MAX_ACTIVITY_DAYS):
+                raise ValueError(days)
+
+            loop = asyncio.get_running_loop()
+            # numpy and PIL are imported on the first chart, off the event loop
+            activity = await loop.run_in_executor(None, importlib.import_module, "plugins.admin.activity")
+            start, end = activity.bucket_range(days, granularity)
+            key = (days, granularity)
+            cached = self.activity_charts.get(key)
+            # Only closed buckets are drawn, so the chart stays valid until the next one closes
+            if cached and cached[0] == end:
+                await update.message.reply_photo(photo=cached[1], caption=cached[2])
+                return
+
+            rows = await self.db.get_command_hours(start, end)
+            chart, caption = await loop.run_in_executor(
+                None, activity.build_chart, rows, start, end, granularity
+            )
+            message = await update.message.reply_photo(photo=chart, caption=caption)
+            self.activity_charts[key] = (end, message.photo[-1].file_id, caption)
+            logger.info(f"Activity chart of {days} days by {granularity} sent to admin {update.effective_user.id}")
+        except ValueError:
+            await update.message.reply_text(ACTIVITY_USAGE)
+        except Exception as e:
+            logger.error(f"Error in activity command: {str(e)}")
+            await update.message.reply_text("Error building the activity chart.")
+
+    async def search_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        if not await self.check_admin(update):
+            return
+
+        try:
+            _, search_id, page = query.data.split(":")
+            if int(search_id) not in self.searches:
+                await query.answer("This search has expired, please run /search again.", show_alert=True)
+                return
+            results_text, keyboard = await self.render_search(int(search_id), int(page))
+            await query.answer()
+            await query.edit_message_text(results_text, reply_markup=keyboard)
+        except sqlite3.OperationalError as e:
+            await query.answer(_search_error(self.searches[int(search_id)][0], e), show_alert=True)
+        except Exception as e:
+            logger.error(f"Error in search page callback: {str(e)}")
+            await query.answer("Error searching history.", show_alert=True)
+
+    async def render_search(self, search_id, page):
+        query, user_id = self.searches[search_id]
+        results, has_more = await self.db.search_history(
+            query, user_id, SEARCH_PER_PAGE, page * SEARCH_PER_PAGE
+        )
+        scope = f" from user {user_id}" if user_id else ""
+        if not results:
+            return f"🔎 Nothing matches {query}{scope}.", None
+
+        first = page * SEARCH_PER_PAGE + 1
+        results_text = f"🔎 Matches {first}-{first + len(results) - 1} for {query}{scope}:\n\n"
+        for source, row_id, row_user_id, text, timestamp in results:
+            label = "QR" if source == "qr" else f"/{source}"
+            results_text += f"• {label} #{row_id} by {row_user_id} - {timestamp}\n"
+            results_text += f"  {(text or '')[:200]}\n"
+
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"search:{search_id}:{page - 1}"))
+        if has_more:
+            buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"search:{search_id}:{page + 1}"))
+        return results_text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+    async def export_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not await self.check_admin(update):
+            return
+
+        try:
+            fmt = "csv"
+            args = []
+            for arg in context.args or []:
+                if arg.lower().startswith("format="):
+                    fmt = arg.split("=", 1)[1].lower()
+                else:
+                    args.append(arg)
+            if not args or args[0].lower() not in EXPORT_COLUMNS or len(args) > 3 or fmt not in FORMATS:
+                await update.message.reply_text(EXPORT_USAGE)
+                return
+            name = args[0].lower()
+            since = log_search.parse_since(args[1]) if len(args) > 1 else None
+            until = log_search.parse_since(args[2]) if len(args) > 2 else None
+
+            await update.message.reply_text(f"⏳ Exporting {name}...")
+            # Rows are compressed on a reader thread as they are fetched
+            writer = ExportWriter(EXPORT_COLUMNS[name], fmt)
+            count = await self.db.export(name, writer.write_rows, since, until)
+            parts = await asyncio.get_running_loop().run_in_executor(None, writer.close)
+            for number, part in enumerate(parts, start=1):
+                caption = f"📦 {count} {name} rows"
+                if len(parts) > 1:
+                    caption += f", part {number} of {len(parts)}"
+                with part:
+                    await update.message.reply_document(
+                        document=part,
+                        filename=writer.filename(name, number),
+                        caption=caption,
+                        write_timeout=EXPORT_UPLOAD_TIMEOUT
+                    )
+            logger.info(f"Export of {count} {name} rows sent to admin {update.effective_user.id}")
+        except ValueError:
+            await update.message.reply_text(EXPORT_USAGE)
+        except Exception as e:
+            logger.error(f"Error in export command: {str(e)}")
+            await update.message.reply_text("Error exporting data.")
+
+    async def send_log_lines(self, update, lines, title):
+        text = f"📄 {title}:\n\n" + "\n".join(lines)
+        if len(text) <= MAX_MESSAGE_LENGTH:
+            await update.message.reply_text(text)
+            return
+        # Too long for one message, send the lines as a text file
+        await update.message.reply_document(
+            document=BytesIO("\n".join(lines).encode('utf-8')),
+            filename="logs.txt",
+            caption=title
+        )
+
     async def user_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not await self.check_admin(update):
             return
@@ -120,31 +553,8 @@ class AdminPlugin(BotPlugin):
                 return
 
             user_id = int(context.args[0])
-            user_stats = self.db.get_user_stats(user_id)
-            
-            if not user_stats:
-                await update.message.reply_text("User not found.")
-                return
-
-            username, first_name, commands_used, join_date, last_seen, qr_generated = user_stats
-            
-            info_text = f"📱 User Information:\n\n"
-            info_text += f"Name: {first_name}\n"
-            info_text += f"Username: @{username}\n"
-            info_text += f"User ID: {user_id}\n"
-            info_text += f"Commands used: {commands_used}\n"
-            info_text += f"QR codes generated: {qr_generated}\n"
-            info_text += f"Join date: {join_date}\n"
-            info_text += f"Last seen: {last_seen}\n"
-
-            # Get recent commands
-            recent_commands = self.db.get_user_history(user_id)[:5]
-            if recent_commands:
-                info_text += "\nRecent commands:\n"
-                for cmd, args, timestamp in recent_commands:
-                    info_text += f"• {cmd} {args} - {timestamp}\n"
-
-            await update.message.reply_text(info_text)
+            info_text, keyboard = await self.render_user_info(user_id)
+            await update.message.reply_text(info_text, reply_markup=keyboard)
             logger.info(f"User info requested for {user_id} by admin {update.effective_user.id}")
         except ValueError:
             await update.message.reply_text("Invalid user ID format.")
@@ -152,10 +562,72 @@ class AdminPlugin(BotPlugin):
             logger.error(f"Error in userinfo command: {str(e)}")
             await update.message.reply_text("Error fetching user information.")
 
+    async def user_history_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        if not await self.check_admin(update):
+            return
+
+        try:
+            prefix, newer, cursor = _parse_page_data(query.data, prefix_parts=2)
+            info_text, keyboard = await self.render_user_info(int(prefix[1]), cursor, newer)
+            await query.answer()
+            await query.edit_message_text(info_text, reply_markup=keyboard)
+        except Exception as e:
+            logger.error(f"Error in userinfo page callback: {str(e)}")
+            await query.answer("Error fetching user information.", show_alert=True)
+
+    async def render_user_info(self, user_id, cursor=None, newer=False):
+        user_stats = await self.db.get_user_stats(user_id)
+        if not user_stats:
+            return "User not found.", None
+
+        username, first_name, commands_used, join_date, last_seen, qr_generated = user_stats
+
+        info_text = f"📱 User Information:\n\n"
+        info_text += f"Name: {first_name}\n"
+        info_text += f"Username: @{username}\n"
+        info_text += f"User ID: {user_id}\n"
+        info_text += f"Commands used: {commands_used}\n"
+        info_text += f"QR codes generated: {qr_generated}\n"
+        info_text += f"Join date: {join_date}\n"
+        info_text += f"Last seen: {last_seen}\n"
+
+        # One page of recent commands, newest first
+        commands, has_more = await self.db.get_user_history_page(
+            user_id, cursor, HISTORY_PER_PAGE, newer
+        )
+        if not commands:
+            return info_text, None
+
+        info_text += "\nRecent commands:\n" if cursor is None else "\nCommands:\n"
+        for _, cmd, args, timestamp in commands:
+            info_text += f"• {cmd} {args} - {timestamp}\n"
+
+        has_prev = has_more if newer else cursor is not None
+        has_next = True if newer else has_more
+        keyboard = _page_keyboard(
+            f"uh:{user_id}", commands, lambda row: (row[3], row[0]), has_prev, has_next
+        )
+        return info_text, keyboard
+
+    async def on_startup(self, application):
+        await self.broadcaster.start(application.bot)
+
+    async def on_stop(self, application):
+        await self.broadcaster.stop()
+
+    def get_stats(self):
+        return {"Broadcasts running": len(self.broadcaster.jobs)}
+
     def register_handlers(self, application):
-        for command, handler, _ in self.admin_commands:
-            application.add_handler(CommandHandler(command, handler))
-            logger.info(f"Registered admin command /{command}")
+        for command in self.admin_commands:
+            application.add_handler(CommandHandler(command.name, command.handler))
+            logger.info(f"Registered admin command /{command.name}")
+
+        # Prev/next buttons of /users, /userinfo and /search
+        application.add_handler(CallbackQueryHandler(self.users_page, pattern=r'^users:'))
+        application.add_handler(CallbackQueryHandler(self.user_history_page, pattern=r'^uh:'))
+        application.add_handler(CallbackQueryHandler(self.search_page, pattern=r'^search:'))
 
     def get_description(self):
         return "Admin Plugin - Administrative commands" 
\ No newline at end of file
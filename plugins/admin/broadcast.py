@@ -0,0 +1,255 @@
+import time
+import asyncio
+from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError, TelegramError
+from logger import logger
+
+# Recipients read from the database at a time
+RECIPIENT_PAGE_SIZE = 500
+# Attempts per recipient on network errors before giving up on them
+MAX_ATTEMPTS = 3
+# Seconds between edits of the admin's progress message
+PROGRESS_INTERVAL = 5
+# Seconds to let in-flight messages finish when the bot stops
+STOP_TIMEOUT = 10
+
+class TokenBucket:
+    """Hand out rate tokens per second, bursting up to capacity"""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next seconds, e.g. after a RetryAfter"""
+        resume_at = time.monotonic() + seconds
+        self.tokens = 0
+        self.updated = max(self.updated, resume_at)
+
+    async def acquire(self):
+        # The lock makes waiters queue up in order instead of racing for tokens
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.updated:
+                    # Paused
+                    await asyncio.sleep(self.updated - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class BroadcastJob:
+    """Progress of one broadcast while it is being delivered"""
+
+    def __init__(self, broadcast_id, text, total, sent=0, failed=0, chat_id=None, message_id=None):
+        self.id = broadcast_id
+        self.text = text
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.cancelled = False
+        self.task = None
+
+        # ETA is based on the rate since this process picked the job up
+        self.started = time.monotonic()
+        self.done_at_start = sent + failed
+
+    @property
+    def remaining(self):
+        return self.total - self.sent - self.failed
+
+    def eta(self):
+        """Seconds until the job is done at the current rate, None before the first send"""
+        done = self.sent + self.failed - self.done_at_start
+        if done <= 0:
+            return None
+        return self.remaining * (time.monotonic() - self.started) / done
+
+    def progress_text(self, status="running"):
+        text = f"📣 Broadcast #{self.id} ({status})\n\n"
+        text += f"Sent: {self.sent}/{self.total}\n"
+        text += f"Failed: {self.failed}\n"
+        if status == "running":
+            eta = self.eta()
+            text += f"ETA: {_format_duration(eta) if eta is not None else 'estimating...'}"
+        return text
+
+class Broadcaster:
+    """Deliver broadcasts to every user in the background, under Telegram's rate limits
+
+    All jobs share one token bucket, so running broadcasts together never
+    exceeds rate messages per second, and a RetryAfter from Telegram pauses
+    the bucket for every job. Each recipient is marked sent or failed in
+    broadcast_recipients as soon as the send returns, and jobs still marked
+    running are picked up again on startup, so a restart resumes a broadcast
+    instead of starting over. A user gets at most one message per broadcast,
+    and retries wait at least a second, which keeps every chat under the
+    per-chat limit.
+    """
+
+    def __init__(self, db, rate=25, concurrency=8):
+        self.db = db
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.jobs = {}
+        self.bot = None
+        self._stopping = False
+
+    async def start(self, bot):
+        """Resume the broadcasts that were running when the bot stopped"""
+        self.bot = bot
+        self._stopping = False
+        for broadcast_id, text, total, chat_id, message_id in await self.db.get_running_broadcasts():
+            counts = await self.db.get_broadcast_counts(broadcast_id)
+            job = BroadcastJob(
+                broadcast_id, text, total,
+                sent=counts.get("sent", 0),
+                failed=counts.get("failed", 0),
+                chat_id=chat_id,
+                message_id=message_id
+            )
+            logger.info(f"Resuming broadcast #{broadcast_id}, {job.remaining} recipients left")
+            self._launch(job)
+
+    async def stop(self):
+        """Let in-flight messages finish, the remaining recipients resume on next start"""
+        self._stopping = True
+        tasks = [job.task for job in self.jobs.values()]
+        if not tasks:
+            return
+        done, pending = await asyncio.wait(tasks, timeout=STOP_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        logger.info(f"Stopped {len(tasks)} running broadcasts")
+
+    async def create(self, admin_id, chat_id, text):
+        """Start a broadcast of text to every user and report progress to chat_id"""
+        broadcast_id, total = await self.db.create_broadcast(admin_id, text)
+        job = BroadcastJob(broadcast_id, text, total, chat_id=chat_id)
+        try:
+            message = await self.bot.send_message(chat_id=chat_id, text=job.progress_text())
+        except Exception:
+            # Otherwise the stored 'running' row would be resumed on the next start
+            self.db.finish_broadcast(broadcast_id, "failed")
+            raise
+        job.message_id = message.message_id
+        self.db.set_broadcast_message(broadcast_id, chat_id, message.message_id)
+        logger.info(f"Broadcast #{broadcast_id} to {total} users started by admin {admin_id}")
+        self._launch(job)
+        return job
+
+    def cancel(self, broadcast_id):
+        """Stop sending a running broadcast, return False if there is none"""
+        job = self.jobs.get(broadcast_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    def _launch(self, job):
+        self.jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job))
+
+    async def _run(self, job):
+        reporter = asyncio.get_running_loop().create_task(self._report_progress(job))
+        try:
+            after_user_id = 0
+            while not (job.cancelled or self._stopping):
+                user_ids = await self.db.get_pending_recipients(
+                    job.id, after_user_id, RECIPIENT_PAGE_SIZE
+                )
+                if not user_ids:
+                    break
+                after_user_id = user_ids[-1]
+
+                # Workers share the page so at most concurrency sends are in flight
+                recipients = iter(user_ids)
+                await asyncio.gather(*(
+                    self._worker(job, recipients) for _ in range(self.concurrency)
+                ))
+
+            if self._stopping:
+                return
+            status = "cancelled" if job.cancelled else "done"
+            self.db.finish_broadcast(job.id, status)
+            logger.info(
+                f"Broadcast #{job.id} {status}: {job.sent} sent, {job.failed} failed"
+            )
+            await self._edit_progress(job, status)
+        except Exception as e:
+            logger.error(f"Error in broadcast #{job.id}: {e}")
+        finally:
+            reporter.cancel()
+            self.jobs.pop(job.id, None)
+
+    async def _worker(self, job, recipients):
+        for user_id in recipients:
+            if job.cancelled or self._stopping:
+                return
+            error = await self._deliver(job.text, user_id)
+            if error is None:
+                job.sent += 1
+                self.db.mark_broadcast_recipient(job.id, user_id, "sent")
+            else:
+                job.failed += 1
+                self.db.mark_broadcast_recipient(job.id, user_id, "failed", error)
+
+    async def _deliver(self, text, user_id):
+        """Send text to one user, return None on success or the error that made it fail"""
+        attempts = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text)
+                return None
+            except RetryAfter as e:
+                logger.warning(f"Broadcast hit flood control, pausing {e.retry_after}s")
+                self.bucket.pause(e.retry_after)
+            except (Forbidden, BadRequest) as e:
+                # Blocked the bot, deleted the account or never started a chat
+                return str(e)
+            except NetworkError as e:
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    return str(e)
+                await asyncio.sleep(attempts)
+            except TelegramError as e:
+                return str(e)
+
+    async def _report_progress(self, job):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            await self._edit_progress(job)
+
+    async def _edit_progress(self, job, status="running"):
+        if job.message_id is None:
+            return
+        try:
+            await self.bot.edit_message_text(
+                job.progress_text(status), chat_id=job.chat_id, message_id=job.message_id
+            )
+        except BadRequest as e:
+            # Nothing changed since the last edit
+            if "not modified" not in str(e):
+                logger.warning(f"Could not update progress of broadcast #{job.id}: {e}")
+        except TelegramError as e:
+            logger.warning(f"Could not update progress of broadcast #{job.id}: {e}")
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m"
@@ -0,0 +1,73 @@
+import csv
+import gzip
+import io
+import json
+import tempfile
+
+FORMATS = ("csv", "ndjson")
+
+# Bots may upload documents of up to 50MB, every part stays below that
+PART_SIZE = 45 * 1024 * 1024
+
+class ExportWriter:
+    """Write rows as gzip-compressed CSV or NDJSON into anonymous temporary files
+
+    Storage.export() hands the rows over in chunks from a reader thread, so
+    only one chunk and the compressor's buffers are in memory at a time. Once
+    the compressed size of a part passes part_size the next rows start a new
+    part, and every part can be sent as one document.
+    """
+
+    def __init__(self, columns, fmt="csv", part_size=PART_SIZE):
+        self.columns = columns
+        self.fmt = fmt
+        self.part_size = part_size
+        self.rows = 0
+        # Finished parts, rewound
+        self.parts = []
+        self._file = None
+        self._text = None
+        self._csv = None
+
+    def _open_part(self):
+        self._file = tempfile.TemporaryFile()
+        compressed = gzip.GzipFile(fileobj=self._file, mode='wb', compresslevel=6)
+        self._text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+        if self.fmt == "csv":
+            self._csv = csv.writer(self._text)
+            self._csv.writerow(self.columns)
+
+    def _close_part(self):
+        # Closes the gzip stream, the temporary file stays open
+        self._text.close()
+        self._file.seek(0)
+        self.parts.append(self._file)
+        self._file = None
+
+    def write_rows(self, rows):
+        if self._file is None:
+            self._open_part()
+        if self.fmt == "csv":
+            self._csv.writerows(rows)
+        else:
+            for row in rows:
+                self._text.write(
+                    json.dumps(dict(zip(self.columns, row)), default=str, ensure_ascii=False) + "\n"
+                )
+        self.rows += len(rows)
+        # The compressor holds back a little, so a part can end slightly above part_size
+        if self._file.tell() >= self.part_size:
+            self._close_part()
+
+    def close(self):
+        """Finish the last part and return every part"""
+        if self._file is None and not self.parts:
+            # Nothing matched, the CSV header still goes out
+            self._open_part()
+        if self._file is not None:
+            self._close_part()
+        return self.parts
+
+    def filename(self, name, number):
+        part = f"-part{number}" if len(self.parts) > 1 else ""
+        return f"{name}{part}.{self.fmt}.gz"
@@ -0,0 +1,130 @@
+import gzip
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+# Timestamp at the start of text lines ("2024-01-31 12:00:00,123 - ...")
+# and in the "time" field of JSON lines ("2024-01-31T12:00:00.123")
+LINE_TIME = re.compile(rb'(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}:\d{2})')
+RELATIVE_SINCE = re.compile(r'^(\d+)([smhd])$')
+# Rotated files are <log>.<YYYY-mm-dd_HH-MM-SS>[.N].gz, uncompressed until the background gzip finishes
+ROTATED_SUFFIX = re.compile(r'^(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})(?:\.(\d+))?(\.gz)?$')
+UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+def iter_lines_reversed(path):
+    """Yield the lines of a file as bytes, last line first
+
+    A plain file is memory-mapped, so only the pages that are actually
+    scanned are read and nothing is copied besides the yielded lines. A
+    rotated .gz file is decompressed into memory first, it is at most
+    LOG_MAX_BYTES.
+    """
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as file:
+            yield from _reversed_lines(file.read())
+        return
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ) as data:
+            yield from _reversed_lines(data)
+
+def _reversed_lines(data):
+    end = len(data)
+    if data[end - 1:end] == b'\n':
+        end -= 1
+    while end > 0:
+        start = data.rfind(b'\n', 0, end) + 1
+        yield data[start:end]
+        end = start - 1
+
+def log_files(path):
+    """Return path followed by its rotated files, newest first"""
+    directory, name = os.path.split(path)
+    rotated = {}
+    for file in os.listdir(directory or '.'):
+        match = ROTATED_SUFFIX.match(file[len(name) + 1:]) if file.startswith(name + '.') else None
+        if match:
+            key = (match.group(1), int(match.group(2) or 0))
+            # For a moment a file being compressed exists both ways, keep one
+            if key not in rotated or not match.group(3):
+                rotated[key] = os.path.join(directory, file)
+    return [path] + [rotated[key] for key in sorted(rotated, reverse=True)]
+
+def iter_log_lines_reversed(path):
+    """Yield the lines of the log and then of its rotated files, newest first"""
+    for file in log_files(path):
+        try:
+            yield from iter_lines_reversed(file)
+        except FileNotFoundError:
+            # Compressed or deleted by the handler in the meantime
+            continue
+
+def line_time(line):
+    """Return the line's timestamp as b"YYYY-MM-DD HH:MM:SS", None for continuation lines"""
+    match = LINE_TIME.search(line, 0, 40)
+    return match.group(1) + b' ' + match.group(2) if match else None
+
+def parse_since(value, now=None):
+    """Turn "30m", "2h", "1d", "HH:MM", "YYYY-MM-DD" or "YYYY-MM-DD HH:MM" into a datetime
+
+    Raises ValueError for anything else.
+    """
+    now = now or datetime.now()
+    match = RELATIVE_SINCE.match(value)
+    if match:
+        return now - timedelta(**{UNITS[match.group(2)]: int(match.group(1))})
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    clock = datetime.strptime(value, "%H:%M")
+    return now.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+
+def tail(path, count):
+    """Return the last count lines of the log, oldest first, reading into rotated files if needed"""
+    lines = []
+    for line in iter_log_lines_reversed(path):
+        lines.append(line)
+        if len(lines) >= count:
+            break
+    lines.reverse()
+    return _decode(lines)
+
+def grep(path, pattern, since=None, limit=100):
+    """Return up to limit of the newest lines matching pattern, oldest first
+
+    The log is scanned from the end and then the rotated files, newest
+    first, so with since the scan stops at the first line older than it
+    instead of reading every file.
+    """
+    regex = re.compile(pattern.encode('utf-8'), re.IGNORECASE)
+    since_key = since.strftime('%Y-%m-%d %H:%M:%S').encode() if since else None
+    matches = []
+    for line in iter_log_lines_reversed(path):
+        if since_key is not None:
+            timestamp = line_time(line)
+            if timestamp is not None and timestamp < since_key:
+                break
+        if regex.search(line):
+            matches.append(line)
+            if len(matches) >= limit:
+                break
+    matches.reverse()
+    return _decode(matches)
+
+def gzip_to_tempfile(path):
+    """Compress path into an anonymous temporary file, chunk by chunk, and return it rewound"""
+    archive = tempfile.TemporaryFile()
+    with open(path, 'rb') as source, gzip.GzipFile(fileobj=archive, mode='wb') as out:
+        shutil.copyfileobj(source, out, 1024 * 1024)
+    archive.seek(0)
+    return archive
+
+def _decode(lines):
+    return [line.decode('utf-8', errors='replace') for line in lines]
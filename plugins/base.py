@@ -1,21 +1,43 @@
 from abc import ABC, abstractmethod
+from collections import namedtuple
 from telegram.ext import CommandHandler
 from config import ADMIN_IDS
 from logger import logger
-from database import Database
+
+# At most `calls` uses of a command per `period` seconds for each user
+RateLimit = namedtuple("RateLimit", "calls period")
+
+# How a command uses the bot, which decides the queue it waits in: "cheap"
+# answers from memory, "io" waits on the database or the Bot API, "cpu"
+# renders. Admin commands are always served first whatever their cost.
+COST_CLASSES = ("cheap", "io", "cpu")
+
+# Entry of BotPlugin.commands and admin_commands. Commands without a limit
+# are only subject to the per-user limit of FloodControl. max_concurrent caps
+# how many updates for the command run at once, on top of its cost class.
+Command = namedtuple(
+    "Command", "name handler description limit cost max_concurrent",
+    defaults=(None, "io", None)
+)
 
 class BotPlugin(ABC):
-    def __init__(self):
+    def __init__(self, db):
         self.commands = []
         self.admin_commands = []  # New list for admin-only commands
-        self.db = Database()  # Add database to base plugin
+        self.db = db  # Shared database passed in by the bot
 
     async def check_admin(self, update):
         """Check if user is admin"""
         user_id = update.effective_user.id
         is_admin = user_id in ADMIN_IDS
         if not is_admin:
-            await update.message.reply_text("⚠️ This command is only available to bot administrators.")
+            if update.callback_query:
+                await update.callback_query.answer(
+                    "⚠️ This command is only available to bot administrators.",
+                    show_alert=True
+                )
+            else:
+                await update.message.reply_text("⚠️ This command is only available to bot administrators.")
             logger.warning(f"Non-admin user {user_id} tried to use admin command")
         return is_admin
 
@@ -27,4 +49,20 @@ class BotPlugin(ABC):
     @abstractmethod
     def get_description(self):
         """Return plugin description"""
-        pass 
\ No newline at end of file
+        pass
+
+    async def on_startup(self, application):
+        """Called once the application is initialized"""
+        pass
+
+    async def on_stop(self, application):
+        """Called when the application stops, while the bot can still send messages"""
+        pass
+
+    async def on_shutdown(self, application):
+        """Called when the application shuts down"""
+        pass
+
+    def get_stats(self):
+        """Return extra {label: value} counters for the admin /stats command"""
+        return {} 
\ No newline at end of file
@@ -0,0 +1,68 @@
+import hashlib
+import json
+from collections import OrderedDict
+
+class QRCache:
+    """Two-level cache for rendered QR codes
+
+    Level one is a bounded LRU of PNG bytes in memory. Level two is the
+    qr_file_cache table mapping the same key to the file_id Telegram returned
+    for the first upload, so repeats are sent without rendering or uploading.
+    """
+
+    def __init__(self, db, max_items=256):
+        self.db = db
+        self.max_items = max_items
+        self._images = OrderedDict()
+
+        # Counters shown in /stats
+        self.file_id_hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text, options):
+        payload = json.dumps([text, options], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    async def get_file_id(self, key):
+        file_id = await self.db.get_qr_file_id(key)
+        if file_id:
+            self.file_id_hits += 1
+        return file_id
+
+    async def get_file_ids(self, keys):
+        file_ids = await self.db.get_qr_file_ids(keys)
+        self.file_id_hits += len(file_ids)
+        return file_ids
+
+    def save_file_id(self, key, file_id):
+        self.db.save_qr_file_id(key, file_id)
+
+    def forget_file_id(self, key):
+        """Drop a file_id Telegram no longer accepts"""
+        self.file_id_hits -= 1
+        self.db.delete_qr_file_id(key)
+
+    def get_image(self, key):
+        image = self._images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._images.move_to_end(key)
+        self.memory_hits += 1
+        return image
+
+    def put_image(self, key, image):
+        self._images[key] = image
+        self._images.move_to_end(key)
+        while len(self._images) > self.max_items:
+            self._images.popitem(last=False)
+
+    def stats(self):
+        return {
+            "file_id_hits": self.file_id_hits,
+            "memory_hits": self.memory_hits,
+            "misses": self.misses,
+            "cached_images": len(self._images)
+        }
@@ -1,57 +1,151 @@
-import qrcode
-from telegram import Update
-from telegram.ext import ContextTypes, CommandHandler
-from plugins.base import BotPlugin
+import asyncio
+import csv
+import io
+import time
+import zipfile
+from collections import deque
+from telegram import Update, InputMediaPhoto, InputMediaDocument
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
+import config
+from plugins.base import BotPlugin, Command, RateLimit
+from plugins.qr_generator.qr_cache import QRCache
+from plugins.qr_generator.renderer import (
+    QRRenderer, RendererBusy, ERROR_CORRECTION, FORMATS, MIN_SIZE, MAX_SIZE
+)
 from logger import logger
-from database import Database
+from metrics import instrument_methods
+
+# Render settings, part of the cache key so changing them never serves stale images
+RENDER_OPTIONS = {
+    "size": None,
+    "border": 5,
+    "error_correction": "M",
+    "format": "png"
+}
+
+USAGE = (
+    "Please provide text after the command. Example: /qr Hello World\n\n"
+    "Options go before the text:\n"
+    f"size=<pixels> ({MIN_SIZE}-{MAX_SIZE})\n"
+    f"ec=<{'|'.join(ERROR_CORRECTION)}> error correction level\n"
+    f"format=<{'|'.join(FORMATS)}>\n"
+    "Example: /qr size=600 ec=H format=svg https://example.com"
+)
+
+BATCH_USAGE = (
+    "Send one text per line after the command, or reply with /qrbatch to a .txt or .csv file "
+    "(first column is used).\n\n"
+    "Add zip to get a single ZIP file instead of photo albums. QR options work too:\n"
+    "/qrbatch zip size=400\nfirst text\nsecond text"
+)
+
+# Timed here rather than in renderer.py, which the worker processes import too
+instrument_methods("render", exclude=("start", "shutdown"))(QRRenderer)
+
+# Telegram albums hold at most 10 items
+MEDIA_GROUP_SIZE = 10
+
+def parse_options(args):
+    """Split leading key=value options off the /qr arguments
+
+    Returns (options, remaining args) and raises ValueError with a
+    user-facing message for invalid values.
+    """
+    options = dict(RENDER_OPTIONS)
+    index = 0
+    while index < len(args) and '=' in args[index]:
+        key, value = args[index].split('=', 1)
+        key = key.lower()
+        if key == "size":
+            if not value.isdigit() or not MIN_SIZE <= int(value) <= MAX_SIZE:
+                raise ValueError(f"⚠️ size must be a number between {MIN_SIZE} and {MAX_SIZE}.")
+            options["size"] = int(value)
+        elif key == "ec":
+            if value.upper() not in ERROR_CORRECTION:
+                raise ValueError(f"⚠️ ec must be one of {', '.join(ERROR_CORRECTION)}.")
+            options["error_correction"] = value.upper()
+        elif key == "format":
+            if value.lower() not in FORMATS:
+                raise ValueError(f"⚠️ format must be one of {', '.join(FORMATS)}.")
+            options["format"] = value.lower()
+        else:
+            # Not an option, the text itself contains "="
+            break
+        index += 1
+    return options, args[index:]
 
 class QRGeneratorPlugin(BotPlugin):
-    def __init__(self):
-        super().__init__()
-        self.db = Database()
+    def __init__(self, db):
+        super().__init__(db)
+        self.cache = QRCache(db, max_items=config.QR_CACHE_SIZE)
+        self.renderer = QRRenderer(
+            workers=config.QR_RENDER_WORKERS,
+            max_backlog=config.QR_RENDER_BACKLOG
+        )
         self.commands = [
-            ("qr", self.generate_qr, "Generate QR code from text")
+            Command("qr", self.generate_qr, "Generate QR code from text (options: size=, ec=, format=)",
+                    RateLimit(5, 30), cost="cpu"),
+            # A batch keeps the render pool busy for a while, leave room for single codes
+            Command("qrbatch", self.generate_batch, "Generate many QR codes, one per line or from a .txt/.csv file",
+                    RateLimit(2, 60), cost="cpu", max_concurrent=1)
         ]
 
     async def generate_qr(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        started = time.perf_counter()
         try:
             user = update.effective_user
-            if not context.args:
-                await update.message.reply_text(
-                    "Please provide text after the command. Example: /qr Hello World"
-                )
+            try:
+                options, words = parse_options(context.args or [])
+            except ValueError as e:
+                await update.message.reply_text(str(e))
                 return
 
-            text = ' '.join(context.args)
+            if not words:
+                await update.message.reply_text(USAGE)
+                return
+
+            text = ' '.join(words)
             
             # Log the QR code generation
             self.db.add_or_update_user(user.id, user.username, user.first_name)
             self.db.log_command(user.id, "qr", text)
-            self.db.log_qr_generation(user.id, text)
 
-            logger.info(f"Generating QR code for text: {text[:30]}...")
+            caption = f"QR Code for: {text[:100]}..."
+            cache_key = self.cache.make_key(text, options)
 
-            # Generate QR code
-            qr = qrcode.QRCode(version=1, box_size=10, border=5)
-            qr.add_data(text)
-            qr.make(fit=True)
-            img = qr.make_image(fill_color="black", back_color="white")
+            # Telegram already has this exact image, send it by file_id
+            file_id = await self.cache.get_file_id(cache_key)
+            if file_id:
+                try:
+                    await self.send_image(update, file_id, options, caption)
+                    self.db.log_qr_generation(user.id, text)
+                    logger.info("QR code sent from file_id cache", extra=_log_fields(user, "qr", started))
+                    return
+                except BadRequest as e:
+                    logger.warning(f"Cached file_id rejected, rendering again: {e}")
+                    self.cache.forget_file_id(cache_key)
 
-            # Save temporarily and send
-            img_path = "temp_qr.png"
-            img.save(img_path)
-            
-            with open(img_path, "rb") as photo:
-                await update.message.reply_photo(
-                    photo=photo,
-                    caption=f"QR Code for: {text[:100]}..."
-                )
+            image = self.cache.get_image(cache_key)
+            if image is None:
+                logger.info(f"Generating QR code for text: {text[:30]}...")
+                try:
+                    image = await self.renderer.render(text, options)
+                except RendererBusy:
+                    logger.warning(f"QR renderer busy, rejected request from {user.id}")
+                    await update.message.reply_text(
+                        "⏳ Too many QR codes are being generated right now. Please try again in a few seconds."
+                    )
+                    return
+                self.cache.put_image(cache_key, image)
 
-            # Cleanup
-            import os
-            os.remove(img_path)
-            
-            logger.info("QR code generated and sent successfully")
+            message = await self.send_image(update, image, options, caption)
+            self.db.log_qr_generation(user.id, text)
+            file_id = self.sent_file_id(message)
+            if file_id:
+                self.cache.save_file_id(cache_key, file_id)
+
+            logger.info("QR code generated and sent successfully", extra=_log_fields(user, "qr", started))
 
         except Exception as e:
             logger.error(f"Error generating QR code: {str(e)}")
@@ -59,10 +153,241 @@ class QRGeneratorPlugin(BotPlugin):
                 "Sorry, there was an error generating the QR code."
             )
 
+    async def generate_batch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        started = time.perf_counter()
+        try:
+            user = update.effective_user
+            try:
+                options, as_zip, texts = await self.read_batch(update.message)
+            except ValueError as e:
+                await update.message.reply_text(str(e))
+                return
+
+            if not texts:
+                await update.message.reply_text(BATCH_USAGE)
+                return
+            if len(texts) > config.QR_BATCH_MAX:
+                await update.message.reply_text(
+                    f"⚠️ A batch can hold at most {config.QR_BATCH_MAX} codes, got {len(texts)}."
+                )
+                return
+
+            self.db.add_or_update_user(user.id, user.username, user.first_name)
+            self.db.log_command(user.id, "qrbatch", f"{len(texts)} codes")
+            logger.info(f"Generating QR batch of {len(texts)} codes for {user.id}")
+
+            try:
+                if as_zip:
+                    await self.send_zip(update, texts, options)
+                else:
+                    await self.send_media_groups(update, texts, options)
+            except RendererBusy:
+                logger.warning(f"QR renderer busy, stopped batch from {user.id}")
+                await update.message.reply_text(
+                    "⏳ Too many QR codes are being generated right now. Please try again in a few seconds."
+                )
+                return
+
+            # One executemany for the whole batch
+            self.db.log_qr_batch(user.id, texts)
+            logger.info("QR batch generated and sent successfully", extra=_log_fields(user, "qrbatch", started))
+
+        except Exception as e:
+            logger.error(f"Error generating QR batch: {str(e)}")
+            await update.message.reply_text(
+                "Sorry, there was an error generating the QR codes."
+            )
+
+    async def read_batch(self, message):
+        """Return (options, as_zip, texts) from the command text or an attached .txt/.csv"""
+        text = message.text or message.caption or ""
+        first_line, _, rest = text.partition("\n")
+        args = first_line.split()[1:]
+
+        as_zip = False
+        if args and args[0].lower() == "zip":
+            as_zip = True
+            args = args[1:]
+        options, words = parse_options(args)
+
+        lines = [' '.join(words)] if words else []
+        lines += rest.splitlines()
+
+        document = message.document
+        if document is None and message.reply_to_message:
+            document = message.reply_to_message.document
+        if document is not None:
+            lines += await self.read_document(document)
+
+        return options, as_zip, [line.strip() for line in lines if line.strip()]
+
+    @staticmethod
+    async def read_document(document):
+        name = (document.file_name or "").lower()
+        if not name.endswith((".txt", ".csv")):
+            raise ValueError("⚠️ Only .txt and .csv files are supported.")
+        if document.file_size and document.file_size > config.QR_BATCH_MAX_FILE_BYTES:
+            raise ValueError(
+                f"⚠️ The file is too large, the limit is {config.QR_BATCH_MAX_FILE_BYTES // 1024} KB."
+            )
+
+        telegram_file = await document.get_file()
+        content = bytes(await telegram_file.download_as_bytearray()).decode("utf-8", errors="replace")
+        if name.endswith(".csv"):
+            return [row[0] for row in csv.reader(io.StringIO(content)) if row]
+        return content.splitlines()
+
+    async def render_stream(self, texts, options, use_file_ids=True):
+        """Yield (text, cache_key, media, is_file_id) in input order
+
+        Cached images and file_ids are used when possible. At most one render per
+        pool worker is in flight, so a batch leaves room for single /qr requests.
+        """
+        keys = [self.cache.make_key(text, options) for text in texts]
+        file_ids = await self.cache.get_file_ids(keys) if use_file_ids else {}
+        loop = asyncio.get_running_loop()
+        window = deque()
+
+        def submit(text, key):
+            if key in file_ids:
+                future = loop.create_future()
+                future.set_result((file_ids[key], True))
+                return future
+            image = self.cache.get_image(key)
+            if image is not None:
+                future = loop.create_future()
+                future.set_result((image, False))
+                return future
+            return asyncio.ensure_future(self._render_cached(text, key, options))
+
+        try:
+            for text, key in zip(texts, keys):
+                window.append((text, key, submit(text, key)))
+                if len(window) >= self.renderer.workers:
+                    text, key, future = window.popleft()
+                    media, is_file_id = await future
+                    yield text, key, media, is_file_id
+            while window:
+                text, key, future = window.popleft()
+                media, is_file_id = await future
+                yield text, key, media, is_file_id
+        finally:
+            for _, _, future in window:
+                future.cancel()
+
+    async def _render_cached(self, text, key, options):
+        image = await self.renderer.render(text, options)
+        self.cache.put_image(key, image)
+        return image, False
+
+    async def send_media_groups(self, update, texts, options):
+        """Send the batch as albums of up to 10, remembering the uploaded file_ids"""
+        svg = options["format"] == "svg"
+        group = []
+        async for index, (text, key, media, is_file_id) in _aenumerate(self.render_stream(texts, options)):
+            caption = text[:100]
+            if svg:
+                item = InputMediaDocument(media=media, filename=f"qr_{index + 1}.svg", caption=caption)
+            else:
+                item = InputMediaPhoto(media=media, caption=caption)
+            group.append((key, is_file_id, item))
+            if len(group) == MEDIA_GROUP_SIZE:
+                await self._send_group(update, group)
+                group = []
+        if group:
+            await self._send_group(update, group)
+
+    async def _send_group(self, update, group):
+        messages = await update.message.reply_media_group(media=[item for _, _, item in group])
+        for (key, is_file_id, _), message in zip(group, messages):
+            file_id = self.sent_file_id(message)
+            if file_id and not is_file_id:
+                self.cache.save_file_id(key, file_id)
+
+    async def send_zip(self, update, texts, options):
+        """Build a ZIP in memory as codes are rendered and send it as one document"""
+        extension = options["format"]
+        buffer = io.BytesIO()
+        index_rows = io.StringIO()
+        writer = csv.writer(index_rows)
+        writer.writerow(["file", "text"])
+
+        # PNG is already compressed, only the SVG files gain from deflate
+        compression = zipfile.ZIP_DEFLATED if extension == "svg" else zipfile.ZIP_STORED
+        with zipfile.ZipFile(buffer, "w", compression) as archive:
+            stream = self.render_stream(texts, options, use_file_ids=False)
+            async for index, (text, _, image, _) in _aenumerate(stream):
+                filename = f"qr_{index + 1:03d}.{extension}"
+                archive.writestr(filename, image)
+                writer.writerow([filename, text])
+            archive.writestr("index.csv", index_rows.getvalue())
+
+        await update.message.reply_document(
+            document=buffer.getvalue(),
+            filename="qr_codes.zip",
+            caption=f"{len(texts)} QR codes"
+        )
+
+    @staticmethod
+    async def send_image(update, image, options, caption):
+        """Send PNG codes as photos and SVG codes as documents"""
+        if options["format"] == "svg":
+            return await update.message.reply_document(
+                document=image,
+                filename="qr.svg",
+                caption=caption
+            )
+        return await update.message.reply_photo(photo=image, caption=caption)
+
+    @staticmethod
+    def sent_file_id(message):
+        if message.photo:
+            return message.photo[-1].file_id
+        if message.document:
+            return message.document.file_id
+        return None
+
+    async def on_startup(self, application):
+        self.renderer.start()
+
+    async def on_shutdown(self, application):
+        self.renderer.shutdown()
+
+    def get_stats(self):
+        cache_stats = self.cache.stats()
+        return {
+            "QR file_id hits": cache_stats["file_id_hits"],
+            "QR memory hits": cache_stats["memory_hits"],
+            "QR cache misses": cache_stats["misses"],
+            "QR images in memory": cache_stats["cached_images"],
+            "QR renders in flight": self.renderer.in_flight,
+            "QR renders rejected (busy)": self.renderer.rejected
+        }
+
     def register_handlers(self, application):
-        for command, handler, description in self.commands:
-            application.add_handler(CommandHandler(command, handler))
-            logger.info(f"Registered command /{command} - {description}")
+        for command in self.commands:
+            application.add_handler(CommandHandler(command.name, command.handler))
+            logger.info(f"Registered command /{command.name} - {command.description}")
+
+        # Commands in a document caption don't reach CommandHandler
+        application.add_handler(MessageHandler(
+            filters.Document.ALL & filters.CaptionRegex(r'^/qrbatch(@\w+)?(\s|$)'),
+            self.generate_batch
+        ))
 
     def get_description(self):
-        return "QR Code Generator Plugin - Generate QR codes from text" 
\ No newline at end of file
+        return "QR Code Generator Plugin - Generate QR codes from text"
+
+def _log_fields(user, command, started):
+    """Structured fields for the JSON log format"""
+    return {
+        "user_id": user.id,
+        "command": command,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+async def _aenumerate(iterator):
+    index = 0
+    async for item in iterator:
+        yield index, item
+        index += 1
@@ -0,0 +1,124 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import numpy as np
+import qrcode
+from PIL import Image
+
+ERROR_CORRECTION = {
+    "L": qrcode.constants.ERROR_CORRECT_L,
+    "M": qrcode.constants.ERROR_CORRECT_M,
+    "Q": qrcode.constants.ERROR_CORRECT_Q,
+    "H": qrcode.constants.ERROR_CORRECT_H
+}
+
+FORMATS = ("png", "svg")
+
+# Pixels per module when no size is requested, and the limits for a requested size
+DEFAULT_SCALE = 10
+MIN_SIZE = 64
+MAX_SIZE = 2048
+
+class RendererBusy(Exception):
+    """Raised when the render backlog is full and the request should be retried later"""
+
+def build_matrix(text, error_correction="M", border=4):
+    """Encode text and return the module matrix, border included, as a boolean array"""
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=ERROR_CORRECTION[error_correction],
+        border=border
+    )
+    qr.add_data(text)
+    qr.make(fit=True)
+    return np.array(qr.get_matrix(), dtype=bool)
+
+def module_scale(matrix, size=None):
+    """Pixels per module, chosen so the image is as close to size as possible"""
+    if not size:
+        return DEFAULT_SCALE
+    return max(1, round(size / matrix.shape[0]))
+
+def rasterize_png(matrix, scale):
+    """Scale the module matrix up with NumPy and encode it as a 1-bit PNG"""
+    pixels = matrix.repeat(scale, axis=0).repeat(scale, axis=1)
+    # In mode "1" True is white, so dark modules have to be inverted
+    image = Image.fromarray(~pixels)
+
+    buffer = BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+def render_svg(matrix, scale):
+    """Emit the dark modules as one SVG path, merging horizontal runs"""
+    size = matrix.shape[0]
+    path = []
+    for y, row in enumerate(matrix):
+        # Run starts and ends from the edges of the padded row
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], row, [False])).astype(np.int8)))
+        for start, end in zip(edges[::2], edges[1::2]):
+            path.append(f"M{start} {y}h{end - start}v1h-{end - start}z")
+
+    pixels = size * scale
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path fill="#000" d="{"".join(path)}"/>'
+        '</svg>\n'
+    ).encode('utf-8')
+
+def render(text, options):
+    """Render text as a QR code in options["format"] and return the file bytes
+
+    Runs inside the worker processes, so it only depends on qrcode, NumPy and PIL.
+    """
+    matrix = build_matrix(text, options["error_correction"], options["border"])
+    scale = module_scale(matrix, options.get("size"))
+    if options["format"] == "svg":
+        return render_svg(matrix, scale)
+    return rasterize_png(matrix, scale)
+
+class QRRenderer:
+    """Runs QR renders on a process pool with a bounded number of jobs in flight"""
+
+    def __init__(self, workers=2, max_backlog=16):
+        self.workers = workers
+        self.max_backlog = max_backlog
+        self._pool = None
+        self._in_flight = 0
+
+        # Counters shown in /stats
+        self.rendered = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    async def render(self, text, options):
+        """Render on the pool, raising RendererBusy instead of queueing without bound"""
+        if self._in_flight >= self.max_backlog:
+            self.rejected += 1
+            raise RendererBusy()
+
+        self.start()
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            image = await loop.run_in_executor(self._pool, render, text, options)
+        finally:
+            self._in_flight -= 1
+
+        self.rendered += 1
+        return image
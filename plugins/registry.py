@@ -0,0 +1,137 @@
+import asyncio
+import importlib
+import json
+import os
+import time
+from telegram.ext import CommandHandler, CallbackQueryHandler, MessageHandler, filters
+from plugins.base import BotPlugin, Command, RateLimit
+from logger import logger
+
+PLUGINS_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST = 'plugin.json'
+
+def discover_plugins(db):
+    """Create a plugin for every package under plugins/ that has a plugin.json
+
+    The manifest names the module and class of the plugin. With "load":
+    "startup" they are imported right away. Otherwise the plugin is a
+    LazyPlugin that registers the commands and handlers listed in the
+    manifest and imports the module on the first update that needs it.
+    """
+    plugins = []
+    for entry in sorted(os.scandir(PLUGINS_DIR), key=lambda entry: entry.name):
+        path = os.path.join(entry.path, MANIFEST)
+        if not entry.is_dir() or not os.path.exists(path):
+            continue
+        try:
+            with open(path, encoding='utf-8') as file:
+                manifest = json.load(file)
+            if not manifest.get("enabled", True):
+                continue
+            if manifest.get("load") == "startup":
+                module = importlib.import_module(manifest["module"])
+                plugins.append(getattr(module, manifest["class"])(db))
+            else:
+                plugins.append(LazyPlugin(db, manifest))
+        except Exception as e:
+            logger.error(f"Could not load plugin from {path}: {e}")
+    return plugins
+
+def _commands(entries, deferred):
+    return [
+        Command(
+            entry["name"],
+            deferred(entry["method"]),
+            entry["description"],
+            RateLimit(*entry["limit"]) if entry.get("limit") else None,
+            entry.get("cost", "io"),
+            entry.get("max_concurrent")
+        )
+        for entry in entries
+    ]
+
+class LazyPlugin(BotPlugin):
+    """Stand-in for a plugin whose module is imported on first use"""
+
+    def __init__(self, db, manifest):
+        super().__init__(db)
+        self.manifest = manifest
+        self.plugin = None
+        self._application = None
+        self._lock = asyncio.Lock()
+        self.commands = _commands(manifest.get("commands", []), self._deferred)
+        self.admin_commands = _commands(manifest.get("admin_commands", []), self._deferred)
+
+    def _deferred(self, method):
+        async def callback(update, context):
+            plugin = await self.load()
+            return await getattr(plugin, method)(update, context)
+        callback.__name__ = method
+        return callback
+
+    async def load(self):
+        """Import and start the real plugin once, return it"""
+        if self.plugin is not None:
+            return self.plugin
+        async with self._lock:
+            if self.plugin is None:
+                start = time.perf_counter()
+                # Importing numpy and friends takes a while, keep it off the event loop
+                module = await asyncio.get_running_loop().run_in_executor(
+                    None, importlib.import_module, self.manifest["module"]
+                )
+                plugin = getattr(module, self.manifest["class"])(self.db)
+                self._check_manifest(plugin)
+                if self._application is not None:
+                    await plugin.on_startup(self._application)
+                self.plugin = plugin
+                logger.info(
+                    f"Loaded {self.manifest['module']} on first use in "
+                    f"{(time.perf_counter() - start) * 1000:.0f}ms"
+                )
+        return self.plugin
+
+    def _check_manifest(self, plugin):
+        for kind in ("commands", "admin_commands"):
+            declared = {command.name for command in getattr(self, kind)}
+            actual = {command.name for command in getattr(plugin, kind)}
+            if declared != actual:
+                logger.warning(
+                    f"{MANIFEST} of {self.manifest['module']} lists {kind} {sorted(declared)}, "
+                    f"the plugin has {sorted(actual)}"
+                )
+
+    def register_handlers(self, application):
+        for command in self.commands + self.admin_commands:
+            application.add_handler(CommandHandler(command.name, command.handler))
+            logger.info(f"Registered command /{command.name} - {command.description}")
+
+        for entry in self.manifest.get("callbacks", []):
+            application.add_handler(CallbackQueryHandler(
+                self._deferred(entry["method"]), pattern=entry["pattern"]
+            ))
+
+        # Commands in a document caption don't reach CommandHandler
+        for entry in self.manifest.get("document_captions", []):
+            application.add_handler(MessageHandler(
+                filters.Document.ALL & filters.CaptionRegex(entry["pattern"]),
+                self._deferred(entry["method"])
+            ))
+
+    def get_description(self):
+        return self.manifest["description"]
+
+    async def on_startup(self, application):
+        # Handed to the real plugin when it is loaded
+        self._application = application
+
+    async def on_stop(self, application):
+        if self.plugin is not None:
+            await self.plugin.on_stop(application)
+
+    async def on_shutdown(self, application):
+        if self.plugin is not None:
+            await self.plugin.on_shutdown(application)
+
+    def get_stats(self):
+        return self.plugin.get_stats() if self.plugin is not None else {}
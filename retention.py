@@ -0,0 +1,196 @@
+import asyncio
+import csv
+import gzip
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from database import ARCHIVE_QUERIES
+from logger import logger
+
+# Pages freed per PRAGMA incremental_vacuum, 8MB with the default 4KB pages
+VACUUM_STEP_PAGES = 2048
+AUTO_VACUUM_INCREMENTAL = 2
+
+# table -> columns written to its archive, the first one is the id
+ARCHIVED_COLUMNS = {
+    "command_history": ("id", "user_id", "command", "args", "timestamp"),
+    "qr_history": ("id", "user_id", "text_content", "timestamp"),
+}
+
+def _append_csv(path, columns, rows):
+    # Every append adds a gzip member, gzip readers see one continuous file
+    new = not os.path.exists(path)
+    with gzip.open(path, 'at', newline='', encoding='utf-8', compresslevel=6) as file:
+        writer = csv.writer(file)
+        if new:
+            writer.writerow(columns)
+        writer.writerows(rows)
+
+def _aggregate_qr_codes(conn, rows):
+    counts = Counter(user_id for _, user_id, _, _ in rows)
+    conn.executemany('''
+        INSERT INTO qr_archived (user_id, count) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET count = count + excluded.count
+    ''', list(counts.items()))
+
+# Commands need none, daily_stats and command_hourly already count them
+AGGREGATES = {
+    "qr_history": _aggregate_qr_codes,
+}
+
+class Retention:
+    """Moves history older than a number of days out of SQLite
+
+    Rows are read in batches from a read-only connection and appended to gzip
+    CSV files in archive_dir. Each batch is then deleted, QR codes folded into
+    qr_archived first, in one short write transaction, so queued writes get
+    the writer between batches. daily_stats and command_hourly already count
+    the archived days, so /stats, /activity, /userinfo and "/stats rebuild"
+    stay correct.
+
+    A run that stops halfway leaves the rest for the next run. Its last batch
+    may then be appended to the archive a second time, never lost.
+    """
+
+    def __init__(self, db, days, archive_dir, batch_size=2000):
+        self.db = db
+        self.days = days
+        self.archive_dir = archive_dir
+        self.batch_size = batch_size
+        self.last_run = None
+        self._running = False
+        self._vacuum_warned = False
+
+    def schedule(self, job_queue, interval_hours, first=300):
+        job_queue.run_repeating(
+            self.run, interval=interval_hours * 3600, first=first, name="retention"
+        )
+        logger.info(
+            f"History older than {self.days} days is archived to {self.archive_dir} "
+            f"every {interval_hours:g}h"
+        )
+
+    async def run(self, context=None):
+        """JobQueue callback, runs archive() unless a run is still going"""
+        if self._running:
+            return
+        self._running = True
+        try:
+            await self.archive()
+        except Exception as e:
+            logger.error(f"Retention run failed: {e}")
+        finally:
+            self._running = False
+
+    async def archive(self):
+        """Archive every row older than the retention window, return the run summary"""
+        # Whole days only, so every day is either archived or still complete
+        cutoff_day = (datetime.now() - timedelta(days=self.days)).strftime('%Y-%m-%d')
+        start = time.perf_counter()
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        # The cutoff is stored first: "/stats rebuild" must keep the counts of
+        # these days even if the run dies before the last batch is deleted
+        run_id = await self.db.run_write(self._start_run, cutoff_day)
+        archived = {}
+        for table in ARCHIVED_COLUMNS:
+            archived[table] = await self._archive_table(table, cutoff_day)
+        reclaimed = await self._reclaim_space()
+        await self.db.run_write(
+            self._finish_run, run_id, archived["command_history"], archived["qr_history"], reclaimed
+        )
+
+        self.last_run = {
+            "cutoff_day": cutoff_day,
+            "commands": archived["command_history"],
+            "qr_codes": archived["qr_history"],
+            "reclaimed_pages": reclaimed,
+            "seconds": time.perf_counter() - start,
+            "finished_at": datetime.now()
+        }
+        logger.info(
+            f"Archived {archived['command_history']} commands and {archived['qr_history']} "
+            f"QR codes before {cutoff_day}, freed {reclaimed} pages in {self.last_run['seconds']:.1f}s"
+        )
+        return self.last_run
+
+    async def _archive_table(self, table, cutoff_day):
+        columns = ARCHIVED_COLUMNS[table]
+        path = os.path.join(self.archive_dir, f"{table}-before-{cutoff_day}.csv.gz")
+        query = ARCHIVE_QUERIES[table]
+        loop = asyncio.get_running_loop()
+        # (timestamp, id) of the last archived row
+        after = ('', 0)
+        archived = 0
+        while True:
+            rows = await self.db.run_read(
+                lambda cursor: cursor.execute(query, (cutoff_day, *after, self.batch_size)).fetchall()
+            )
+            if not rows:
+                break
+            # Written before the delete commits: a crash can duplicate rows in the archive, not lose them
+            await loop.run_in_executor(None, _append_csv, path, columns, rows)
+            await self.db.run_write(self._delete_batch, table, rows)
+            after = (rows[-1][-1], rows[-1][0])
+            archived += len(rows)
+            if len(rows) < self.batch_size:
+                break
+        return archived
+
+    def _delete_batch(self, conn, table, rows):
+        with conn:
+            if table in AGGREGATES:
+                AGGREGATES[table](conn, rows)
+            conn.executemany(f'DELETE FROM {table} WHERE id = ?', [(row[0],) for row in rows])
+
+    async def _reclaim_space(self):
+        """Give free pages back to the file system, return how many"""
+        free = await self.db.run_write(lambda conn: conn.execute('PRAGMA freelist_count').fetchone()[0])
+        if not free:
+            return 0
+
+        mode = await self.db.run_write(lambda conn: conn.execute('PRAGMA auto_vacuum').fetchone()[0])
+        if mode != AUTO_VACUUM_INCREMENTAL:
+            # Switching takes a full VACUUM, which would hold the writer for as long as
+            # it takes to rewrite the file. Freed pages are reused by new rows meanwhile.
+            if not self._vacuum_warned:
+                self._vacuum_warned = True
+                logger.warning(
+                    f"{self.db.path} was created without incremental auto_vacuum, freed pages "
+                    f"stay in the file until it is converted once with the bot stopped: "
+                    f"sqlite3 {self.db.path} 'PRAGMA auto_vacuum = INCREMENTAL; VACUUM;'"
+                )
+            return 0
+
+        reclaimed = 0
+        while free:
+            # Bounded steps, queued writes get the writer in between
+            free_after = await self.db.run_write(self._vacuum_step)
+            reclaimed += free - free_after
+            if free_after >= free:
+                break
+            free = free_after
+        return reclaimed
+
+    def _vacuum_step(self, conn):
+        conn.execute(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})').fetchall()
+        return conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    def _start_run(self, conn, cutoff_day):
+        with conn:
+            return conn.execute(
+                'INSERT INTO archive_runs (cutoff_day, started_at) VALUES (?, ?)',
+                (cutoff_day, datetime.now())
+            ).lastrowid
+
+    def _finish_run(self, conn, run_id, commands, qr_codes, reclaimed):
+        with conn:
+            conn.execute('''
+                UPDATE archive_runs
+                SET commands = ?, qr_codes = ?, reclaimed_pages = ?, finished_at = ?
+                WHERE id = ?
+            ''', (commands, qr_codes, reclaimed, datetime.now(), run_id))
+
+    def stats(self):
+        return self.last_run
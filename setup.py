@@ -22,6 +22,7 @@ def check_requirements():
         'python-telegram-bot': '20.8',
         'qrcode': '7.4.2',
         'pillow': '11.0.0',
+        'numpy': '1.26.4',
         'python-dotenv': '1.0.1'
     }
     
@@ -0,0 +1,182 @@
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+
+FIELDS = ("new_users", "active_users", "commands", "qr_codes")
+
+# Recomputes daily_stats from the base tables for the days on or after {since}.
+# Active users per past day are approximated from command_history, today's
+# count comes from users.last_seen. new_users is recounted for every day.
+_REBUILD_SQL = '''
+    DELETE FROM daily_stats WHERE day >= {since};
+
+    INSERT INTO daily_stats (day, commands, active_users)
+        SELECT date(timestamp), COUNT(*), COUNT(DISTINCT user_id)
+        FROM command_history
+        WHERE timestamp >= {since}
+        GROUP BY date(timestamp);
+
+    INSERT INTO daily_stats (day, qr_codes)
+        SELECT date(timestamp), COUNT(*)
+        FROM qr_history
+        WHERE timestamp >= {since}
+        GROUP BY date(timestamp)
+    ON CONFLICT(day) DO UPDATE SET qr_codes = excluded.qr_codes;
+
+    INSERT INTO daily_stats (day, new_users)
+        SELECT date(COALESCE(join_date, last_seen)), COUNT(*)
+        FROM users
+        WHERE true
+        GROUP BY date(COALESCE(join_date, last_seen))
+    ON CONFLICT(day) DO UPDATE SET new_users = excluded.new_users;
+
+    INSERT INTO daily_stats (day, active_users)
+        SELECT date('now', 'localtime'), COUNT(*)
+        FROM users
+        WHERE last_seen >= date('now', 'localtime')
+    ON CONFLICT(day) DO UPDATE SET active_users = excluded.active_users;
+'''
+
+# Recomputes command_hourly, commands per hour and command, for the hours on or after {since}
+_REBUILD_HOURS_SQL = '''
+    DELETE FROM command_hourly WHERE hour >= {since};
+
+    INSERT INTO command_hourly (hour, command, count)
+        SELECT strftime('%Y-%m-%d %H', timestamp), command, COUNT(*)
+        FROM command_history
+        WHERE timestamp >= {since}
+        GROUP BY 1, 2;
+'''
+
+# Every day, used to backfill daily_stats and command_hourly when they were introduced
+REBUILD_STATS_SQL = _REBUILD_SQL.format(since="''")
+REBUILD_HOURS_SQL = _REBUILD_HOURS_SQL.format(since="''")
+
+# Days before the last retention cutoff have no raw history left, they keep
+# the counts daily_stats and command_hourly already have
+REBUILD_LIVE_STATS_SQL = (_REBUILD_SQL + _REBUILD_HOURS_SQL).format(
+    since="(SELECT COALESCE(MAX(cutoff_day), '') FROM archive_runs)"
+)
+
+class StatsRollup:
+    """Running totals and per-day counters kept in memory and in daily_stats
+
+    The database updates the rollup inside the same transaction that writes the
+    rows it counts, so /stats can be answered without touching the history tables.
+    Commands are also counted per hour and command in command_hourly for /activity,
+    those counts stay in the database only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.days = defaultdict(Counter)
+        self.totals = Counter()
+
+    def load(self, conn):
+        """Replace the in-memory counters with the contents of daily_stats"""
+        days = defaultdict(Counter)
+        totals = Counter()
+        for day, *values in conn.execute(f'SELECT day, {", ".join(FIELDS)} FROM daily_stats'):
+            for field, value in zip(FIELDS, values):
+                days[day][field] = value or 0
+                totals[field] += value or 0
+        with self._lock:
+            self.days = days
+            self.totals = totals
+
+    def rebuild(self, conn):
+        """Recompute daily_stats from the history still in the database and reload it"""
+        conn.executescript(f"BEGIN; {REBUILD_LIVE_STATS_SQL}\nCOMMIT;")
+        self.load(conn)
+
+    def collect(self, conn, events):
+        """Turn write events into per-day deltas
+
+        Must run inside the write transaction before the user upserts execute,
+        since new and returning users are told apart by their stored last_seen.
+        """
+        deltas = defaultdict(Counter)
+        user_ids = {event[1] for event in events if event[0] == "user"}
+        stored = self.stored_last_seen(conn, user_ids) if user_ids else {}
+        seen_users = {}
+        for event in events:
+            kind, timestamp = event[0], event[-1]
+            day = timestamp.strftime('%Y-%m-%d')
+            if kind == "command":
+                deltas[day]["commands"] += 1
+            elif kind == "qr":
+                deltas[day]["qr_codes"] += 1
+            elif kind == "user":
+                user_id = event[1]
+                if user_id in seen_users:
+                    last_seen = seen_users[user_id]
+                else:
+                    last_seen = stored.get(user_id)
+                    if user_id not in stored:
+                        deltas[day]["new_users"] += 1
+                if last_seen is None or last_seen.strftime('%Y-%m-%d') < day:
+                    deltas[day]["active_users"] += 1
+                seen_users[user_id] = timestamp
+        return deltas
+
+    def stored_last_seen(self, conn, user_ids):
+        """Return {user_id: last_seen} for the user_ids already in users"""
+        stored = {}
+        for user_id in user_ids:
+            row = conn.execute(
+                'SELECT last_seen FROM users WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            if row is not None:
+                stored[user_id] = _parse_timestamp(row[0])
+        return stored
+
+    def persist(self, conn, deltas):
+        """Add deltas to daily_stats, inside the caller's transaction"""
+        conn.executemany('''
+            INSERT INTO daily_stats (day, new_users, active_users, commands, qr_codes)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(day) DO UPDATE SET
+                new_users = new_users + excluded.new_users,
+                active_users = active_users + excluded.active_users,
+                commands = commands + excluded.commands,
+                qr_codes = qr_codes + excluded.qr_codes
+        ''', [(day, *(counts[field] for field in FIELDS)) for day, counts in deltas.items()])
+
+    def command_hours(self, events):
+        """Count the command events per (hour, command)"""
+        hours = Counter()
+        for event in events:
+            if event[0] == "command":
+                hours[event[-1].strftime('%Y-%m-%d %H'), event[1]] += 1
+        return hours
+
+    def persist_hours(self, conn, hours):
+        """Add per-hour command counts to command_hourly, inside the caller's transaction"""
+        conn.executemany('''
+            INSERT INTO command_hourly (hour, command, count)
+            VALUES (?, ?, ?)
+            ON CONFLICT(hour, command) DO UPDATE SET count = count + excluded.count
+        ''', [(hour, command, count) for (hour, command), count in hours.items()])
+
+    def apply(self, deltas):
+        """Add committed deltas to the in-memory counters"""
+        with self._lock:
+            for day, counts in deltas.items():
+                self.days[day].update(counts)
+                self.totals.update(counts)
+
+    def snapshot(self, day=None):
+        day = day or datetime.now().strftime('%Y-%m-%d')
+        with self._lock:
+            today = self.days.get(day, Counter())
+            return {
+                "total_users": self.totals["new_users"],
+                "active_today": today["active_users"],
+                "commands_today": today["commands"],
+                "total_qr_codes": self.totals["qr_codes"]
+            }
+
+def _parse_timestamp(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
@@ -0,0 +1,483 @@
+import time
+import asyncio
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from datetime import datetime
+from logger import logger
+
+# /export name -> columns of its rows, the first is the id and the last the
+# time that since/until apply to
+EXPORT_COLUMNS = {
+    "users": ("user_id", "username", "first_name", "commands_used", "join_date", "last_seen"),
+    "commands": ("id", "user_id", "command", "args", "timestamp"),
+    "qr": ("id", "user_id", "text_content", "timestamp"),
+}
+
+class WriteBehindQueue:
+    """Buffer logging writes and commit them in batches from a background task
+
+    Rows are (target, params, event) where target is whatever the backend's
+    write_batch() groups by: the SQL statement for SQLite, the collection for MongoDB.
+
+    A flush that fails with an error the backend calls retryable keeps its rows
+    for the next flush, up to max_retries flushes in a row. Rows queued beyond
+    max_pending while the database can't be written are dropped.
+    """
+
+    def __init__(self, db, flush_interval_ms=50, max_batch=500, max_pending=100000, max_retries=20):
+        self.db = db
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.pending = deque()
+        self._retries = 0
+        self._overflowing = False
+        self._task = None
+        self._wakeup = None
+        self._stopping = False
+
+        # Counters shown to admins in /stats
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def put(self, target, params, event=None):
+        if len(self.pending) >= self.max_pending:
+            self._drop_overflow(1)
+            return
+        self.pending.append((target, params, event))
+        if self._wakeup is not None and len(self.pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def put_many(self, target, rows, event=None):
+        rows = list(rows)
+        room = self.max_pending - len(self.pending)
+        if room < len(rows):
+            self._drop_overflow(len(rows) - max(room, 0))
+            rows = rows[:max(room, 0)]
+        self.pending.extend((target, params, event) for params in rows)
+        if self._wakeup is not None and len(self.pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def _drop_overflow(self, count):
+        self.rows_dropped += count
+        # Once per outage, not once per row
+        if not self._overflowing:
+            self._overflowing = True
+            logger.error(f"Write queue is full ({self.max_pending} rows), dropping new rows")
+
+    def start(self):
+        """Start the background flush task"""
+        if self._task is not None:
+            return
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        logger.info(
+            f"Write-behind queue started (every {int(self.flush_interval * 1000)}ms "
+            f"or {self.max_batch} rows)"
+        )
+
+    async def stop(self):
+        """Stop the background task and flush whatever is still pending"""
+        if self._task is None:
+            return
+        # Not cancelled: wait_for() can swallow a cancellation that arrives as
+        # the wakeup event is set, and the task would never end
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        self._wakeup = None
+        await self.flush()
+        logger.info(f"Write-behind queue stopped after {self.flushes} flushes")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing write queue: {e}")
+
+    async def flush(self):
+        """Hand every pending row to the backend's write_batch() on its writer thread"""
+        if not self.pending:
+            return 0
+
+        batch = list(self.pending)
+        self.pending.clear()
+
+        start = time.perf_counter()
+        try:
+            await self.db.run_write(self.db.write_batch, batch)
+        except self.db.WRITE_ERRORS as e:
+            self._retries += 1
+            if self.db.retryable(e) and self._retries <= self.max_retries:
+                # Locked database or lost connection, keep the rows for the next flush
+                logger.error(f"Write queue flush failed, retrying later ({self._retries}/{self.max_retries}): {e}")
+                self.pending.extendleft(reversed(batch))
+                # Rows queued since are the ones that no longer fit
+                while len(self.pending) > self.max_pending:
+                    self.pending.pop()
+                    self._drop_overflow(1)
+                return 0
+            logger.error(f"Write queue flush failed, dropping {len(batch)} rows: {e}")
+            self.rows_dropped += len(batch)
+            self._retries = 0
+            return 0
+
+        self._retries = 0
+        if len(self.pending) < self.max_pending:
+            self._overflowing = False
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flushes += 1
+        self.rows_written += len(batch)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        return len(batch)
+
+    def stats(self):
+        return {
+            "depth": len(self.pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms
+        }
+
+class UserCache:
+    """Known user profiles and the activity not written to users yet
+
+    touch() only queues a write for users it doesn't know and for changed
+    usernames or first names. Otherwise the use is added to the user's pending
+    commands_used and last_seen, and flush() queues one write per user every
+    flush interval. A pending entry never spans midnight, so every day's active
+    users are still counted by the stats rollup.
+    """
+
+    def __init__(self, db, max_users=10000, flush_interval=5):
+        self.db = db
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        # user_id -> (username, first_name) as stored, least recently used first
+        self.profiles = OrderedDict()
+        # user_id -> [username, first_name, commands, last_seen]
+        self.pending = {}
+        self._task = None
+
+        # Counters shown to admins in /stats
+        self.touches = 0
+        self.writes = 0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def touch(self, user_id, username, first_name):
+        """Count one command by a user"""
+        now = datetime.now()
+        self.touches += 1
+        entry = self.pending.get(user_id)
+        if entry is not None and entry[3].date() != now.date():
+            self._write(user_id, self.pending.pop(user_id))
+            entry = None
+        if entry is None:
+            entry = self.pending[user_id] = [username, first_name, 0, now]
+        entry[0], entry[1] = username, first_name
+        entry[2] += 1
+        entry[3] = now
+
+        profile = (username, first_name)
+        if self.profiles.get(user_id) == profile:
+            self.profiles.move_to_end(user_id)
+            if not self.running or len(self.pending) >= self.max_users:
+                self.flush()
+            return
+
+        # New or changed profile, written right away with the activity so far
+        self.profiles[user_id] = profile
+        self.profiles.move_to_end(user_id)
+        if len(self.profiles) > self.max_users:
+            self.profiles.popitem(last=False)
+        self._write(user_id, self.pending.pop(user_id))
+
+    def pending_activity(self, user_id):
+        """Return (commands, last_seen) not written yet for a user, or None"""
+        entry = self.pending.get(user_id)
+        return (entry[2], entry[3]) if entry else None
+
+    def _write(self, user_id, entry):
+        self.writes += 1
+        self.db.write_user(user_id, *entry)
+
+    def flush(self):
+        """Queue one write per user with pending activity"""
+        pending, self.pending = self.pending, {}
+        for user_id, entry in pending.items():
+            self._write(user_id, entry)
+        return len(pending)
+
+    async def sync(self):
+        """Write every pending user before a read that needs users to be current"""
+        self.flush()
+        await self.db.write_queue.flush()
+
+    def start(self):
+        """Flush pending activity from a background task every interval"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and queue what is still pending"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing user activity: {e}")
+
+    def stats(self):
+        return {
+            "cached": len(self.profiles),
+            "pending": len(self.pending),
+            "touches": self.touches,
+            "writes": self.writes
+        }
+
+class Storage(ABC):
+    """Interface of the storage backends, see database.Database and mongo_database.MongoDatabase
+
+    Logging writes return immediately and go through a WriteBehindQueue once
+    start() has run. Reads are coroutines and return plain tuples so handlers
+    don't depend on the backend. Timestamps are naive local datetimes.
+    """
+
+    # Flush errors that keep the batch queued for a retry, and those that drop it
+    RETRY_ERRORS = ()
+    WRITE_ERRORS = ()
+
+    def retryable(self, error):
+        """Whether a failed write may succeed later, like a locked database or a lost connection"""
+        return isinstance(error, self.RETRY_ERRORS)
+
+    write_queue = None
+    user_cache = None
+
+    @abstractmethod
+    async def start(self):
+        """Start background work that needs a running event loop"""
+        pass
+
+    @abstractmethod
+    async def close(self):
+        """Flush pending writes and release every connection"""
+        pass
+
+    @abstractmethod
+    async def run_write(self, func, *args):
+        """Run func(handle, *args) on the writer thread"""
+        pass
+
+    @abstractmethod
+    def write_batch(self, handle, batch):
+        """Apply queued (target, params, event) rows and their stats, on the writer thread"""
+        pass
+
+    # Users and history
+
+    @abstractmethod
+    def add_or_update_user(self, user_id, username, first_name):
+        """Record a command by a user, through user_cache"""
+        pass
+
+    @abstractmethod
+    def write_user(self, user_id, username, first_name, commands, last_seen):
+        """Queue the upsert of a user who used `commands` more commands, called by UserCache"""
+        pass
+
+    @abstractmethod
+    def log_command(self, user_id, command, args):
+        pass
+
+    @abstractmethod
+    def log_qr_generation(self, user_id, text_content):
+        pass
+
+    @abstractmethod
+    def log_qr_batch(self, user_id, texts):
+        pass
+
+    @abstractmethod
+    async def get_user_history(self, user_id):
+        """Return [(command, args, timestamp)], newest first"""
+        pass
+
+    @abstractmethod
+    async def get_user_stats(self, user_id):
+        """Return (username, first_name, commands_used, join_date, last_seen, qr_codes) or None"""
+        pass
+
+    @abstractmethod
+    async def get_users_page(self, cursor=None, limit=20, newer=False):
+        """Return ([(user_id, username, first_name, last_seen)], has_more), cursor is (last_seen, user_id)"""
+        pass
+
+    @abstractmethod
+    async def get_user_history_page(self, user_id, cursor=None, limit=5, newer=False):
+        """Return ([(id, command, args, timestamp)], has_more), cursor is (timestamp, id)"""
+        pass
+
+    @abstractmethod
+    async def count_users(self):
+        pass
+
+    @abstractmethod
+    async def count_user_history(self, user_id):
+        pass
+
+    @abstractmethod
+    async def get_qr_history(self, user_id):
+        """Return [(text_content, timestamp)], newest first"""
+        pass
+
+    @abstractmethod
+    async def get_all_users(self):
+        """Return [(user_id, username, first_name, last_seen)] by last_seen, newest first"""
+        pass
+
+    @abstractmethod
+    async def get_command_hours(self, since, until):
+        """Return [(hour, command, count)] for the hours in [since, until), hour as "YYYY-MM-DD HH"
+
+        Counted when the commands are written, so this reads one row per hour
+        and command however many commands there were.
+        """
+        pass
+
+    @abstractmethod
+    async def export(self, name, write_rows, since=None, until=None, chunk_size=1000):
+        """Pass the EXPORT_COLUMNS rows of name to write_rows(rows) in chunks, return the count
+
+        write_rows runs on a reader thread and the rows are never all in memory.
+        """
+        pass
+
+    # Telegram file_ids of rendered QR codes
+
+    @abstractmethod
+    def save_qr_file_id(self, cache_key, file_id):
+        pass
+
+    @abstractmethod
+    def delete_qr_file_id(self, cache_key):
+        pass
+
+    @abstractmethod
+    async def get_qr_file_id(self, cache_key):
+        pass
+
+    @abstractmethod
+    async def get_qr_file_ids(self, cache_keys):
+        """Return {cache_key: file_id} for the keys that have one"""
+        pass
+
+    # Broadcasts
+
+    @abstractmethod
+    async def create_broadcast(self, admin_id, text):
+        """Store a broadcast addressed to every current user, return (id, total)"""
+        pass
+
+    @abstractmethod
+    def set_broadcast_message(self, broadcast_id, chat_id, message_id):
+        pass
+
+    @abstractmethod
+    def mark_broadcast_recipient(self, broadcast_id, user_id, status, error=None):
+        pass
+
+    @abstractmethod
+    def finish_broadcast(self, broadcast_id, status):
+        pass
+
+    @abstractmethod
+    async def get_running_broadcasts(self):
+        """Return [(id, text, total, chat_id, message_id)] of unfinished broadcasts"""
+        pass
+
+    @abstractmethod
+    async def get_pending_recipients(self, broadcast_id, after_user_id=0, limit=500):
+        pass
+
+    @abstractmethod
+    async def get_broadcast_counts(self, broadcast_id):
+        """Return {status: recipients} for a broadcast"""
+        pass
+
+    # Stats
+
+    @abstractmethod
+    async def get_total_qr_codes(self):
+        pass
+
+    @abstractmethod
+    async def get_commands_today(self):
+        pass
+
+    @abstractmethod
+    async def get_active_users_today(self):
+        pass
+
+    @abstractmethod
+    async def get_stats(self):
+        """Return the /stats counters: total_users, active_today, commands_today, total_qr_codes"""
+        pass
+
+    @abstractmethod
+    async def rebuild_stats(self):
+        """Recompute the stats rollup from the stored history"""
+        pass
+
+def keyset_page(rows, limit, newer):
+    """Trim rows fetched with limit + 1 to a page, return (rows, has_more)"""
+    # One extra row was fetched to find out whether there is another page
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    return rows, has_more
+
+def with_pending_activity(user_stats, pending):
+    """Add UserCache.pending_activity() to a get_user_stats() row"""
+    if user_stats is None or pending is None:
+        return user_stats
+    username, first_name, commands_used, join_date, _, qr_codes = user_stats
+    commands, last_seen = pending
+    return (username, first_name, (commands_used or 0) + commands, join_date, last_seen, qr_codes)
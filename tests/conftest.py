@@ -0,0 +1,10 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+# The checks in benchmarks/ are imported by the tests
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+# config.py requires these at import time
+os.environ.setdefault("ADMIN_IDS", "1")
+os.environ.setdefault("BOT_TOKEN", "1000:test")
@@ -0,0 +1,11 @@
+import statistics
+from check_import_time import LAZY_MODULES, measure
+
+BUDGET_MS = 1000
+
+def test_cold_start_stays_lazy_and_within_budget():
+    runs = [measure() for _ in range(3)]
+    leaked = sorted({name for run in runs for name in run if name in LAZY_MODULES})
+    assert leaked == []
+    bot_ms = statistics.median(run["bot"][0] for run in runs) / 1000
+    assert bot_ms <= BUDGET_MS
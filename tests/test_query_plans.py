@@ -0,0 +1,9 @@
+import asyncio
+from database import Database
+
+def test_no_query_scans_a_table(tmp_path):
+    db = Database(str(tmp_path / "t.db"))
+    try:
+        assert db.check_query_plans() == []
+    finally:
+        asyncio.run(db.close())
@@ -0,0 +1,12 @@
+import asyncio
+import pytest
+from check_storage import run
+from database import Database
+
+def test_sqlite_and_mongodb_return_the_same_results(tmp_path):
+    mongomock = pytest.importorskip("mongomock")
+    from mongo_database import MongoDatabase
+    sqlite_results, _ = asyncio.run(run(Database(str(tmp_path / "check.db")), 100))
+    mongo = MongoDatabase(None, "ignitebot_test", client=mongomock.MongoClient())
+    mongo_results, _ = asyncio.run(run(mongo, 100))
+    assert mongo_results == sqlite_results
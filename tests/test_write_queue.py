@@ -0,0 +1,63 @@
+import asyncio
+import sqlite3
+from database import Database
+from storage import WriteBehindQueue
+
+def error(message, code):
+    e = sqlite3.OperationalError(message)
+    e.sqlite_errorcode = code
+    return e
+
+class FailingDatabase:
+    """Fails every write_batch() with error, then succeeds once error is None"""
+
+    WRITE_ERRORS = (sqlite3.Error,)
+    retryable = Database.retryable
+
+    def __init__(self, error):
+        self.error = error
+        self.written = []
+
+    async def run_write(self, func, *args):
+        return func(*args)
+
+    def write_batch(self, batch):
+        if self.error:
+            raise self.error
+        self.written.extend(batch)
+
+def test_busy_batches_are_retried_then_dropped():
+    db = FailingDatabase(error("database is locked", sqlite3.SQLITE_BUSY))
+    queue = WriteBehindQueue(db, max_retries=2)
+    queue.put("sql", (1,))
+
+    async def flush(times):
+        for _ in range(times):
+            await queue.flush()
+
+    asyncio.run(flush(2))
+    assert len(queue.pending) == 1 and queue.rows_dropped == 0
+    db.error = None
+    asyncio.run(flush(1))
+    assert len(db.written) == 1
+
+    db.error = error("database is locked", sqlite3.SQLITE_BUSY)
+    queue.put("sql", (2,))
+    asyncio.run(flush(3))
+    assert len(queue.pending) == 0 and queue.rows_dropped == 1
+
+def test_permanent_errors_drop_the_batch():
+    db = FailingDatabase(error("no such table: users", sqlite3.SQLITE_ERROR))
+    queue = WriteBehindQueue(db)
+    queue.put_many("sql", [(1,), (2,)])
+    asyncio.run(queue.flush())
+    assert len(queue.pending) == 0 and queue.rows_dropped == 2
+
+def test_pending_rows_are_capped():
+    db = FailingDatabase(error("database is locked", sqlite3.SQLITE_BUSY))
+    queue = WriteBehindQueue(db, max_pending=3)
+    queue.put_many("sql", [(n,) for n in range(2)])
+    asyncio.run(queue.flush())
+    queue.put_many("sql", [(n,) for n in range(2)])
+    queue.put("sql", (9,))
+    assert len(queue.pending) == 3 and queue.rows_dropped == 2
@@ -0,0 +1,215 @@
+import asyncio
+import time
+from collections import Counter, deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from logger import logger
+from metrics import metrics
+
+# Cost classes in the order waiting updates are served when a slot frees up
+PRIORITIES = ("admin", "cheap", "io", "cpu")
+
+BUSY_TEXT = "⏳ The bot is busy right now, please try again in a moment."
+
+class CostClass:
+    """Handler slots and bounded waiting queue of one cost class"""
+
+    __slots__ = ("name", "concurrency", "max_queue", "running", "waiting", "shed", "wait_time")
+
+    def __init__(self, name, concurrency, max_queue):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        # (future, command, enqueued at in ns), oldest first
+        self.waiting = deque()
+        self.shed = 0
+        self.wait_time = metrics.histogram("queue", name)
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently while keeping each chat's updates in order
+
+    Updates from the same chat (or user, for updates without a chat) wait on
+    a per-chat lock, so a user's /qr never overtakes their previous command.
+    The concurrency limit is applied after that lock: if it were applied
+    before, one flooding chat could fill every slot with updates that are
+    only waiting for their turn. The base class semaphore is sized larger
+    and only bounds how many updates may be waiting in total.
+
+    Past the chat lock an update waits in the queue of its cost class: admin
+    for updates from admins, otherwise the cost declared by the command. Free
+    slots go to admin, then cheap, io and cpu updates, each class is capped
+    at its own share of the slots, and a command may cap itself further. An
+    update that finds its class queue full is answered with BUSY_TEXT.
+    """
+
+    def __init__(self, max_concurrent_updates, max_pending_updates=None, class_limits=None, admin_ids=()):
+        super().__init__(max_pending_updates or max_concurrent_updates * 16)
+        self.concurrency = max_concurrent_updates
+        self.running = 0
+        # cost class -> (slots, queue size), classes not listed may use every slot
+        class_limits = class_limits or {}
+        self.classes = {
+            name: CostClass(name, *class_limits.get(name, (max_concurrent_updates, max_concurrent_updates * 4)))
+            for name in PRIORITIES
+        }
+        self.admin_ids = set(admin_ids)
+        # command -> (cost class, max_concurrent)
+        self._commands = {}
+        self._command_running = Counter()
+        # chat id -> [lock, number of updates holding or waiting for it]
+        self._chats = {}
+
+    def set_command(self, name, cost, max_concurrent=None):
+        if cost not in self.classes:
+            logger.warning(f"Unknown cost class {cost!r} for /{name}, using io")
+            cost = "io"
+        self._commands[name.lower()] = (cost, max_concurrent)
+
+    def classify(self, update):
+        """Return (cost class, command) of an update"""
+        if not isinstance(update, Update):
+            return self.classes["io"], None
+        command = None
+        message = update.message
+        text = (message.text or message.caption) if message else None
+        if text and text.startswith('/'):
+            command = text.split(None, 1)[0][1:].split('@', 1)[0].lower()
+        user = update.effective_user
+        if user and user.id in self.admin_ids:
+            return self.classes["admin"], command
+        cost = self._commands.get(command, ("io", None))[0]
+        return self.classes[cost], command
+
+    @staticmethod
+    def _chat_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat:
+            return update.effective_chat.id
+        if update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        cost_class, command = self.classify(update)
+        key = self._chat_key(update)
+        if key is None:
+            await self._run(update, coroutine, cost_class, command)
+            return
+
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run(update, coroutine, cost_class, command)
+        finally:
+            entry[1] -= 1
+            # Forget idle chats so the map only holds chats with work in flight
+            if entry[1] == 0:
+                del self._chats[key]
+
+    async def _run(self, update, coroutine, cost_class, command):
+        if not await self._acquire(cost_class, command):
+            coroutine.close()
+            await self._reject(update)
+            return
+        try:
+            await coroutine
+        finally:
+            self._release(cost_class, command)
+
+    async def _acquire(self, cost_class, command):
+        """Wait for a handler slot, return False when the class queue is full"""
+        if len(cost_class.waiting) >= cost_class.max_queue:
+            cost_class.shed += 1
+            return False
+        waiter = (asyncio.get_running_loop().create_future(), command, time.perf_counter_ns())
+        cost_class.waiting.append(waiter)
+        self._dispatch()
+        try:
+            await waiter[0]
+        except asyncio.CancelledError:
+            if waiter[0].done() and not waiter[0].cancelled():
+                # Granted a slot just before being cancelled
+                self._release(cost_class, command)
+            elif waiter in cost_class.waiting:
+                cost_class.waiting.remove(waiter)
+            raise
+        return True
+
+    def _release(self, cost_class, command):
+        self.running -= 1
+        cost_class.running -= 1
+        if command is not None:
+            self._command_running[command] -= 1
+            if not self._command_running[command]:
+                del self._command_running[command]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiting updates, highest priority class first"""
+        while self.running < self.concurrency:
+            for cost_class in self.classes.values():
+                if cost_class.running < cost_class.concurrency and cost_class.waiting:
+                    waiter = self._next_waiter(cost_class)
+                    if waiter is not None:
+                        break
+            else:
+                return
+
+            future, command, enqueued = waiter
+            self.running += 1
+            cost_class.running += 1
+            if command is not None:
+                self._command_running[command] += 1
+            cost_class.wait_time.record(time.perf_counter_ns() - enqueued)
+            future.set_result(None)
+
+    def _next_waiter(self, cost_class):
+        """Take the oldest waiter whose command is under its own cap"""
+        for waiter in list(cost_class.waiting):
+            future, command, _ = waiter
+            if future.done():
+                # Cancelled while waiting
+                cost_class.waiting.remove(waiter)
+                continue
+            limit = self._commands.get(command, (None, None))[1]
+            if limit is None or self._command_running[command] < limit:
+                cost_class.waiting.remove(waiter)
+                return waiter
+        return None
+
+    async def _reject(self, update):
+        try:
+            if update.callback_query:
+                await update.callback_query.answer(BUSY_TEXT, show_alert=True)
+            elif update.effective_message:
+                await update.effective_message.reply_text(BUSY_TEXT)
+        except Exception as e:
+            logger.error(f"Could not send busy reply: {e}")
+
+    def stats(self):
+        """Return {cost class: counters} for /stats"""
+        return {
+            name: {
+                "running": cost_class.running,
+                "slots": cost_class.concurrency,
+                "waiting": len(cost_class.waiting),
+                "queue_size": cost_class.max_queue,
+                "shed": cost_class.shed
+            }
+            for name, cost_class in self.classes.items()
+        }
+
+    @property
+    def active_chats(self):
+        return len(self._chats)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass